@@ -1,28 +1,42 @@
 from flask import Flask, g
 from .app_factory import create_app
 from .db_connect import close_db, get_db
+from .functions import DB_RETRY_AFTER_SECONDS, profile_connection, retry_later_response
 
 app = create_app()
-app.secret_key = 'your-secret'  # Replace with an environment
 
 # Register Blueprints
 from app.blueprints.tickers import tickers
 from app.blueprints.weather import weather
 from app.blueprints.movies import movies
 from app.blueprints.chatbot import chatbot
+from app.blueprints.jobs import jobs
+from app.blueprints.batches import batches
+from app.blueprints.profiles import profiles
 
 app.register_blueprint(tickers, url_prefix='/tickers')
 app.register_blueprint(weather, url_prefix='/weather')
 app.register_blueprint(movies, url_prefix='/movies')
 app.register_blueprint(chatbot, url_prefix='/chatbot')
+app.register_blueprint(jobs, url_prefix='/jobs')
+app.register_blueprint(batches, url_prefix='/api')
+app.register_blueprint(profiles, url_prefix='/profiles')
 
 from . import routes
 
 @app.before_request
 def before_request():
-    g.db = get_db()
-    if g.db is None:
-        print("Warning: Database connection unavailable. Some features may not work.")
+    # The primary connection is opened on first use (require_db), so pages served
+    # from the read replica don't hold one. Profiled requests time all their SQL on it.
+    if 'profile' in g:
+        db = get_db()
+        if db is not None:
+            profile_connection(db)
+
+@app.errorhandler(503)
+def database_unavailable(error):
+    """require_db() aborts with 503 when the database can't be reached"""
+    return retry_later_response(503, error.description, DB_RETRY_AFTER_SECONDS)
 
 # Setup database connection teardown
 @app.teardown_appcontext
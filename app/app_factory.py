@@ -1,5 +1,168 @@
-from flask import Flask
+from flask import Flask, request, send_from_directory
+import mimetypes
+import os
+import re
+import subprocess
+import sys
+
+import click
+from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+# app.functions and app.db_connect read their settings when imported, so .env must be loaded first
+load_dotenv()
+
+from app.functions import (EXPORT_FORMATS, PROFILE_TOKEN_MAX_AGE, STATIC_CACHE_SECONDS, STATIC_DIST_DIR,
+                           admit_request, build_static_assets, compress_response, export_chunks, finish_profile,
+                           load_static_manifest, make_profile_token, open_export, parquet_available, parse_since,
+                           precompressed_variant, release_admission_slot, start_profile, stop_profile)
 
 def create_app():
+    """Create the Flask app (.env was loaded when this module was imported)"""
     app = Flask(__name__)
-    return app
\ No newline at end of file
+    app.secret_key = os.getenv('SECRET_KEY', 'your-secret')  # Set SECRET_KEY in .env for real deployments
+
+    register_proxy(app)
+    register_static_assets(app)
+    register_profiler(app)
+    register_admission_control(app)
+    app.after_request(compress_response)  # gzip/brotli for HTML, JSON and streamed text responses
+    register_commands(app)
+    return app
+
+def register_proxy(app):
+    """Trust PROXY_FIX_HOPS proxies for the client address and scheme (none by default).
+
+    Behind a proxy, request.remote_addr is the proxy's address, so every
+    client would share one rate-limit bucket; the Procfile sets 1 for the
+    Heroku router. Trusting hops that aren't there lets clients spoof
+    X-Forwarded-For, hence the default of 0.
+    """
+    hops = int(os.getenv('PROXY_FIX_HOPS', 0))
+    if hops > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
+def register_static_assets(app):
+    """Serve fingerprinted, precompressed static files built by `flask build-assets`"""
+    manifest = load_static_manifest(app.static_folder)
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        """Rewrite url_for('static', filename=...) to the content-hashed name when one exists"""
+        if endpoint == 'static':
+            values['filename'] = manifest['files'].get(values.get('filename'), values.get('filename'))
+
+    def send_static_asset(filename):
+        """Static view: hashed files get immutable caching and a precompressed body if accepted"""
+        if not filename.startswith(STATIC_DIST_DIR + '/'):
+            return app.send_static_file(filename)
+
+        variant, encoding = precompressed_variant(app.static_folder, filename, request.accept_encodings)
+        response = send_from_directory(app.static_folder, variant,
+                                       mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                                       max_age=STATIC_CACHE_SECONDS)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    app.view_functions['static'] = send_static_asset
+
+def register_profiler(app):
+    """Opt-in request profiling; registered first so the sampler also covers the other hooks"""
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(stop_profile)
+
+def register_admission_control(app):
+    """Rate-limit and cap the concurrency of expensive endpoints before their views run"""
+    app.before_request(admit_request)
+    app.teardown_request(release_admission_slot)
+
+def register_commands(app):
+    """Attach the app's maintenance commands to the `flask` CLI"""
+
+    @app.cli.command('import-audit')
+    @click.option('--limit', default=25, show_default=True, help='Number of modules to list.')
+    @click.option('--module', default='app', show_default=True, help='Module to import.')
+    def import_audit(limit, module):
+        """Report per-module import time and peak RSS for a cold import of the app."""
+        for line in audit_imports(module, limit):
+            click.echo(line)
+
+    @app.cli.command('build-assets')
+    def build_assets():
+        """Fingerprint and precompress static assets into app/static/dist."""
+        manifest = build_static_assets(app.static_folder)
+        click.echo(f"Built {len(manifest['files'])} asset(s) in {os.path.join(app.static_folder, STATIC_DIST_DIR)}")
+
+    @app.cli.command('export')
+    @click.argument('collection')
+    @click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='csv', show_default=True)
+    @click.option('--since', default=None, help='Only rows changed at or after this ISO 8601 timestamp.')
+    @click.option('--output', '-o', type=click.File('wb'), default='-', help='File to write (default: stdout).')
+    def export(collection, fmt, since, output):
+        """Stream a collection (movies, tickers or weather) to a file in constant memory."""
+        if fmt == 'parquet' and not parquet_available():
+            raise click.UsageError('Parquet export needs pyarrow installed.')
+        try:
+            cursor, started_at = open_export(collection, parse_since(since))
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+
+        for chunk in export_chunks(cursor, fmt):
+            output.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        click.echo(f'Next incremental pull: --since {started_at.isoformat()}', err=True)
+
+    @app.cli.command('profile-token')
+    def profile_token():
+        """Print a signed token that enables profiling for requests carrying it."""
+        try:
+            click.echo(make_profile_token())
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        click.echo(f'Valid for {PROFILE_TOKEN_MAX_AGE // 3600} hours. Add ?profile=<token> to a URL (or send an '
+                   'X-Profile header), then browse results at /profiles/?profile=<token>', err=True)
+
+def audit_imports(module, limit):
+    """Import module in a fresh interpreter with -X importtime and summarise the cost.
+
+    Returns printable lines: total time, peak RSS of the child process, and the
+    `limit` slowest modules by cumulative and by self time.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return [f'Import of {module} failed:', result.stderr.strip().splitlines()[-1]]
+
+    # Lines look like: "import time:   self [us] | cumulative | imported package"
+    timings = []
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)', line)
+        if match:
+            timings.append((int(match.group(1)), int(match.group(2)), match.group(4).strip()))
+
+    top_level = [cumulative for _, cumulative, name in timings if name == module]
+    try:
+        import resource  # POSIX only; the app itself runs without it
+        peak_rss = f'{resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024:.1f} MB'
+    except ImportError:
+        peak_rss = 'not available on this platform'
+
+    lines = [
+        f'Total import time for {module}: {(top_level[-1] if top_level else 0) / 1000:.1f} ms',
+        f'Peak RSS of importing process: {peak_rss}',
+        '',
+        f'Slowest {limit} modules by cumulative time (ms):',
+    ]
+    for self_us, cumulative_us, name in sorted(timings, key=lambda t: t[1], reverse=True)[:limit]:
+        lines.append(f'{cumulative_us / 1000:10.1f}  {name}')
+
+    lines += ['', f'Slowest {limit} modules by self time (ms):']
+    for self_us, cumulative_us, name in sorted(timings, key=lambda t: t[0], reverse=True)[:limit]:
+        lines.append(f'{self_us / 1000:10.1f}  {name}')
+    return lines
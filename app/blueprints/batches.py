@@ -0,0 +1,86 @@
+from flask import Blueprint, request, jsonify
+import os
+import time
+
+from app.functions import fetch_all, get_movie_data, get_stock_data, get_weather_data, json_response
+
+batches = Blueprint('batches', __name__)
+
+# Upper bounds for one batch; clients may ask for a shorter deadline with timeout_ms
+BATCH_MAX_LOOKUPS = int(os.getenv('BATCH_MAX_LOOKUPS', 10))
+BATCH_DEADLINE_SECONDS = float(os.getenv('BATCH_DEADLINE_MS', 5000)) / 1000
+
+def parse_lookup(lookup):
+    """Turn one batch item into ((fetch, args), None), or (None, error) if it is malformed"""
+    if not isinstance(lookup, dict):
+        return None, 'Each lookup must be an object'
+
+    lookup_type = lookup.get('type')
+    if lookup_type == 'ticker':
+        symbol = str(lookup.get('symbol') or '').strip().upper()
+        if not symbol:
+            return None, 'Symbol is required'
+        return (get_stock_data, (symbol,)), None
+
+    if lookup_type == 'weather':
+        city = str(lookup.get('city') or '').strip()
+        if not city:
+            return None, 'City is required'
+        return (get_weather_data, (city, str(lookup.get('state') or '').strip())), None
+
+    if lookup_type == 'movie':
+        title = str(lookup.get('title') or '').strip()
+        if not title:
+            return None, 'Title is required'
+        return (get_movie_data, (title, str(lookup.get('year') or '').strip() or None)), None
+
+    return None, "type must be 'ticker', 'weather' or 'movie'"
+
+def batch_deadline(body):
+    """Seconds the whole batch may take: the client's timeout_ms, capped at BATCH_DEADLINE_SECONDS"""
+    try:
+        requested = float(body.get('timeout_ms')) / 1000
+    except (TypeError, ValueError):
+        return BATCH_DEADLINE_SECONDS
+    return min(max(requested, 0), BATCH_DEADLINE_SECONDS)
+
+@batches.route('/batch', methods=['POST'])
+def batch_lookup():
+    """Run several ticker, weather and movie lookups concurrently and return them in one response.
+
+    Body: {"lookups": [{"type": "ticker", "symbol": "AAPL"},
+                       {"type": "weather", "city": "Atlanta", "state": "GA"},
+                       {"type": "movie", "title": "Heat", "year": "1995"}],
+           "timeout_ms": 3000}
+    Results come back in request order as {"type", "ok", "data"} or {"type", "ok", "error"};
+    a slow or failing lookup only fails its own item. Identical lookups share one upstream call.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('lookups'), list) or not body['lookups']:
+        return jsonify({'error': 'Send a JSON body with a non-empty "lookups" list'}), 400
+
+    lookups = body['lookups']
+    if len(lookups) > BATCH_MAX_LOOKUPS:
+        return jsonify({'error': f'At most {BATCH_MAX_LOOKUPS} lookups per batch'}), 400
+
+    started = time.monotonic()
+    parsed = [parse_lookup(lookup) for lookup in lookups]
+    calls = list(dict.fromkeys(call for call, error in parsed if call is not None))
+    outcomes = dict(zip(calls, fetch_all(calls, batch_deadline(body))))
+
+    results = []
+    for lookup, (call, error) in zip(lookups, parsed):
+        data = None
+        if call is not None:
+            data, error = outcomes[call]
+        item = {'type': lookup.get('type') if isinstance(lookup, dict) else None, 'ok': error is None}
+        if error:
+            item['error'] = error
+        else:
+            item['data'] = dict(data, stale=False)
+        results.append(item)
+
+    return json_response({
+        'results': results,
+        'elapsed_ms': round((time.monotonic() - started) * 1000)
+    })
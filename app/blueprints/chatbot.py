@@ -1,9 +1,12 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, g, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 import os
-from dotenv import load_dotenv
-from groq import Groq
+import zlib
+from datetime import date
 
-load_dotenv()
+import click
+
+from app.db_connect import DB_ERRORS, commit_db, connect_db, db_backend, fetch_listing, get_read_db, require_db
+from app.functions import register_periodic_task
 
 chatbot = Blueprint('chatbot', __name__)
 
@@ -15,6 +18,146 @@ AVAILABLE_MODELS = {
     'gemma2-9b-it': 'Gemma 2 9B (Efficient)'
 }
 
+# History storage: answers are zlib-compressed, the listing reads only the preview columns,
+# and rows are partitioned by month so retention drops whole partitions instead of deleting rows
+CHATBOT_HISTORY_RETENTION_MONTHS = int(os.getenv('CHATBOT_HISTORY_RETENTION_MONTHS', 12))  # 0 keeps everything
+HISTORY_PREVIEW_LENGTH = 300
+HISTORY_PAGE_SIZE = 20
+
+# Partitions start as a single catch-all (pmax); maintain_chatbot_history() splits monthly ones off it
+CREATE_CHATBOT_HISTORY_TABLE = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        id BIGINT AUTO_INCREMENT,
+        question TEXT NOT NULL,
+        question_preview VARCHAR(300) NOT NULL,
+        answer_preview VARCHAR(300) NOT NULL,
+        answer_length INT NOT NULL,
+        answer_zlib MEDIUMBLOB NOT NULL,
+        model VARCHAR(50) DEFAULT 'llama-3.1-8b-instant',
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, created_at)
+    )
+    PARTITION BY RANGE COLUMNS (created_at) (
+        PARTITION pmax VALUES LESS THAN (MAXVALUE)
+    )
+'''
+
+HISTORY_MAINTENANCE_SECONDS = 24 * 3600
+OLD_HISTORY_LAYOUT_MESSAGE = ('Chat history still uses the old table layout. Run "python fix_database_schema.py '
+                              '--migrate" to upgrade it; until then answers are not saved.')
+
+# Set once this process has seen chatbot_history in the current layout
+_HISTORY_STATE = {'layout_ok': False}
+
+def history_row_values(question, answer, model):
+    """Column values for one history row: previews, length and the compressed answer"""
+    return (question, question[:HISTORY_PREVIEW_LENGTH], answer[:HISTORY_PREVIEW_LENGTH], len(answer),
+            zlib.compress(answer.encode('utf-8')), model)
+
+def save_chat(cursor, question, answer, model):
+    """Store one question and its (compressed) answer"""
+    cursor.execute(
+        '''INSERT INTO chatbot_history (question, question_preview, answer_preview, answer_length, answer_zlib, model)
+           VALUES (%s, %s, %s, %s, %s, %s)''',
+        history_row_values(question, answer, model)
+    )
+
+def load_chat(cursor, chat_id):
+    """One history row with its answer decompressed, or None"""
+    cursor.execute('SELECT id, question, answer_zlib, model, created_at FROM chatbot_history WHERE id = %s', (chat_id,))
+    chat = cursor.fetchone()
+    if chat:
+        chat['answer'] = zlib.decompress(chat.pop('answer_zlib')).decode('utf-8')
+    return chat
+
+def add_months(month, count):
+    """First day of the month count months after (or before) month"""
+    year, month_index = divmod(month.year * 12 + month.month - 1 + count, 12)
+    return date(year, month_index + 1, 1)
+
+def maintain_chatbot_history(cursor, table='chatbot_history', oldest=None):
+    """Create monthly partitions through next month and drop those older than the retention period.
+
+    New months are split off the catch-all pmax partition, which is empty in
+    normal operation so the split is instant. Expired months are removed with
+    DROP PARTITION, which discards them without the row locks of a DELETE.
+    oldest (a date) makes the first partition start at that month. Returns
+    (added, dropped) partition names.
+
+    The embedded backends (DB_BACKEND=sqlite/memory) have no partitions, so
+    there expired rows are simply deleted.
+    """
+    cursor.execute('SELECT CURDATE() AS today')
+    this_month = cursor.fetchone()['today'].replace(day=1)
+    if db_backend() != 'mysql':
+        if CHATBOT_HISTORY_RETENTION_MONTHS > 0:
+            cursor.execute(f'DELETE FROM {table} WHERE created_at < %s',
+                           (add_months(this_month, 1 - CHATBOT_HISTORY_RETENTION_MONTHS),))
+        return [], []
+
+    cursor.execute(
+        '''SELECT partition_name AS name FROM information_schema.partitions
+           WHERE table_schema = DATABASE() AND table_name = %s AND partition_name IS NOT NULL
+           ORDER BY partition_ordinal_position''',
+        (table,)
+    )
+    months = [date(int(row['name'][1:5]), int(row['name'][5:7]), 1)
+              for row in cursor.fetchall() if row['name'] != 'pmax']
+
+    month = add_months(months[-1], 1) if months else (oldest or this_month).replace(day=1)
+    added = []
+    while month <= add_months(this_month, 1):
+        added.append(month)
+        month = add_months(month, 1)
+    if added:
+        definitions = ', '.join(f"PARTITION p{month:%Y%m} VALUES LESS THAN ('{add_months(month, 1):%Y-%m-%d}')"
+                                for month in added)
+        cursor.execute(f'''ALTER TABLE {table} REORGANIZE PARTITION pmax INTO
+                           ({definitions}, PARTITION pmax VALUES LESS THAN (MAXVALUE))''')
+
+    expired = []
+    if CHATBOT_HISTORY_RETENTION_MONTHS > 0:
+        cutoff = add_months(this_month, 1 - CHATBOT_HISTORY_RETENTION_MONTHS)
+        expired = [month for month in months + added if month < cutoff]
+    if expired:
+        cursor.execute(f"ALTER TABLE {table} DROP PARTITION {', '.join(f'p{month:%Y%m}' for month in expired)}")
+
+    return [f'p{month:%Y%m}' for month in added], [f'p{month:%Y%m}' for month in expired]
+
+def prepare_history_table(cursor):
+    """Create chatbot_history if needed (partitions are maintained by the worker, not in requests)"""
+    cursor.execute(CREATE_CHATBOT_HISTORY_TABLE.format(table='chatbot_history'))
+
+def history_layout_current(cursor):
+    """False if chatbot_history predates compressed answers (no answer_zlib column) and needs --migrate"""
+    if _HISTORY_STATE['layout_ok'] or db_backend() != 'mysql':
+        return True
+    cursor.execute("SHOW COLUMNS FROM chatbot_history LIKE 'answer_zlib'")
+    _HISTORY_STATE['layout_ok'] = cursor.fetchone() is not None
+    return _HISTORY_STATE['layout_ok']
+
+def maintain_history_task(db):
+    """Periodic worker task: keep chatbot_history's monthly partitions current"""
+    cursor = db.cursor()
+    prepare_history_table(cursor)
+    if history_layout_current(cursor):
+        maintain_chatbot_history(cursor)
+
+register_periodic_task('maintain_chatbot_history', HISTORY_MAINTENANCE_SECONDS, maintain_history_task)
+
+@chatbot.cli.command('maintain-history')
+def maintain_history_command():
+    """Add upcoming monthly partitions and drop expired ones (run daily, e.g. from a scheduler)."""
+    db = connect_db()
+    try:
+        cursor = db.cursor()
+        cursor.execute(CREATE_CHATBOT_HISTORY_TABLE.format(table='chatbot_history'))
+        added, dropped = maintain_chatbot_history(cursor)
+        click.echo(f"Added partitions: {', '.join(added) or 'none'}")
+        click.echo(f"Dropped partitions: {', '.join(dropped) or 'none'}")
+    finally:
+        db.close()
+
 @chatbot.route('/', methods=['GET', 'POST'])
 def show_chatbot():
     response_text = None
@@ -37,20 +180,13 @@ def show_chatbot():
                 flash('Groq API key not configured', 'error')
                 return redirect(url_for('chatbot.show_chatbot'))
 
-            # Initialize Groq client
+            # Initialize Groq client (imported here: the SDK is slow to import and only this route needs it)
+            from groq import Groq
             client = Groq(api_key=api_key)
 
-            # Create table if it doesn't exist (enhanced schema)
-            cursor = g.db.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS chatbot_history (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    question TEXT NOT NULL,
-                    answer TEXT NOT NULL,
-                    model VARCHAR(50) DEFAULT 'llama-3.1-8b-instant',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            # Create the history table if it doesn't exist
+            cursor = require_db().cursor()
+            prepare_history_table(cursor)
 
             # Validate model selection
             if selected_model not in AVAILABLE_MODELS:
@@ -76,46 +212,53 @@ def show_chatbot():
             response_text = chat_completion.choices[0].message.content
 
             # Save to database
-            cursor.execute(
-                'INSERT INTO chatbot_history (question, answer, model) VALUES (%s, %s, %s)',
-                (user_question, response_text, selected_model)
-            )
-            g.db.commit()
+            if history_layout_current(cursor):
+                save_chat(cursor, user_question, response_text, selected_model)
+                commit_db()
+            else:
+                flash(OLD_HISTORY_LAYOUT_MESSAGE, 'error')
 
             flash(f'Question answered successfully using {AVAILABLE_MODELS[selected_model]}!', 'success')
         except Exception as e:
             flash(f'Error getting AI response: {str(e)}', 'error')
             response_text = None
 
-    # Get chat history
+    # Get chat history (previews only; full answers are loaded on demand)
     try:
-        cursor = g.db.cursor()
-        cursor.execute('SELECT * FROM chatbot_history ORDER BY id DESC LIMIT 20')
-        chat_history = cursor.fetchall()
-    except:
+        chat_history = fetch_listing(
+            '''SELECT id, question_preview, answer_preview, answer_length, model, created_at
+               FROM chatbot_history ORDER BY id DESC LIMIT %s''',
+            prepare_history_table, (HISTORY_PAGE_SIZE,)
+        )
+    except DB_ERRORS:
+        if history_layout_current(require_db().cursor()):
+            raise
+        flash(OLD_HISTORY_LAYOUT_MESSAGE, 'error')
         chat_history = []
-        cursor = g.db.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chatbot_history (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                question TEXT NOT NULL,
-                answer TEXT NOT NULL,
-                model VARCHAR(50) DEFAULT 'llama-3.1-8b-instant',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        g.db.commit()
 
     return render_template('chatbot.html', response=response_text, history=chat_history,
                           models=AVAILABLE_MODELS, current_question=current_question)
 
+@chatbot.route('/answer/<int:chat_id>')
+def show_answer(chat_id):
+    """Full question and decompressed answer of one history entry (AJAX use)"""
+    try:
+        chat = load_chat(get_read_db().cursor(), chat_id)
+    except Exception as e:
+        return jsonify({'error': f'Error loading chat message: {str(e)}'}), 500
+
+    if not chat:
+        return jsonify({'error': 'Chat message not found'}), 404
+
+    return jsonify({'id': chat['id'], 'question': chat['question'], 'answer': chat['answer'], 'model': chat['model']})
+
 @chatbot.route('/delete/<int:chat_id>')
 def delete_chat(chat_id):
     """Delete a specific chat message from history"""
     try:
-        cursor = g.db.cursor()
+        cursor = require_db().cursor()
         cursor.execute('DELETE FROM chatbot_history WHERE id = %s', (chat_id,))
-        g.db.commit()
+        commit_db()
         flash('Chat message deleted successfully!', 'success')
     except Exception as e:
         flash(f'Error deleting chat message: {str(e)}', 'error')
@@ -126,9 +269,10 @@ def delete_chat(chat_id):
 def clear_history():
     """Clear all chat history"""
     try:
-        cursor = g.db.cursor()
-        cursor.execute('DELETE FROM chatbot_history')
-        g.db.commit()
+        # TRUNCATE empties every partition at once instead of deleting (and locking) row by row
+        cursor = require_db().cursor()
+        cursor.execute('TRUNCATE TABLE chatbot_history')
+        commit_db()
         flash('Chat history cleared successfully!', 'success')
     except Exception as e:
         flash(f'Error clearing chat history: {str(e)}', 'error')
@@ -0,0 +1,33 @@
+from flask import Blueprint, jsonify
+import json
+
+from app.db_connect import require_db
+from app.functions import get_job
+
+jobs = Blueprint('jobs', __name__)
+
+@jobs.route('/<int:job_id>')
+def show_job(job_id):
+    """Status endpoint for a background job (polled by the templates)"""
+    db = require_db()
+    try:
+        job = get_job(db, job_id)
+    except Exception as e:
+        return jsonify({'error': f'Error loading job: {str(e)}'}), 500
+
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify({
+        'id': job['id'],
+        'type': job['job_type'],
+        'status': job['status'],
+        'attempts': job['attempts'],
+        'max_attempts': job['max_attempts'],
+        'progress': job['progress'],
+        'progress_total': job['progress_total'],
+        'result': json.loads(job['result']) if job['result'] else None,
+        'error': job['last_error'],
+        'run_at': job['run_at'].isoformat() if job['run_at'] else None,
+        'updated_at': job['updated_at'].isoformat() if job['updated_at'] else None
+    })
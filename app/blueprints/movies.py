@@ -1,60 +1,217 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, g, jsonify
-import requests
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+import math
 import os
-from dotenv import load_dotenv
+import re
+import time
+from collections import Counter
 
-load_dotenv()
+import click
 
-movies = Blueprint('movies', __name__)
+from app.db_connect import commit_db, connect_db, fetch_listing, get_read_db, require_db
+from app.functions import (enqueue_job, export_response, fetch_or_stale, get_movie_data, json_response,
+                           register_export, register_job_handler)
 
-# Helper function to get movie data from OMDB API
-def get_movie_data(title, year=None):
-    """Fetch movie data from OMDB API"""
-    api_key = os.getenv('OMDB_API_KEY')
-    if not api_key or api_key == 'your_omdb_api_key_here':
-        return None, "OMDB API key not configured"
+movies = Blueprint('movies', __name__)
 
+CREATE_MOVIES_TABLE = '''
+    CREATE TABLE IF NOT EXISTS movies (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        title VARCHAR(200) NOT NULL,
+        year VARCHAR(10),
+        rated VARCHAR(10),
+        released VARCHAR(50),
+        runtime VARCHAR(50),
+        genre VARCHAR(200),
+        director VARCHAR(200),
+        writer TEXT,
+        actors TEXT,
+        plot TEXT,
+        language VARCHAR(100),
+        country VARCHAR(100),
+        awards TEXT,
+        poster VARCHAR(500),
+        imdb_rating VARCHAR(10),
+        imdb_votes VARCHAR(50),
+        box_office VARCHAR(50),
+        imdb_id VARCHAR(20),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        KEY idx_movies_updated_at (updated_at)
+    )
+'''
+
+def movie_row_to_data(movie):
+    """Convert a stored movies row to the get_movie_data() shape, flagged as stale"""
+    movie_data = {key: value for key, value in movie.items() if key not in ('id', 'created_at', 'updated_at')}
+    movie_data['stale'] = True
+    return movie_data
+
+def store_movie_ratings(movie_data):
+    """Refresh the volatile OMDB fields of stored copies of a movie (runs on a background thread).
+
+    Only ratings, votes, box office and awards are touched so user edits to the
+    other fields are never overwritten.
+    """
+    db = connect_db()
     try:
-        # Build URL with optional year parameter
-        url = f'http://www.omdbapi.com/?t={title}&apikey={api_key}'
-        if year:
-            url += f'&y={year}'
-
-        response = requests.get(url, timeout=10)
-        data = response.json()
-
-        # Check for API errors
-        if data.get('Response') == 'False':
-            error_msg = data.get('Error', 'Unknown error')
-            return None, f"Movie not found: {error_msg}"
-
-        # Extract relevant data
-        movie_data = {
-            'title': data.get('Title', 'N/A'),
-            'year': data.get('Year', 'N/A'),
-            'rated': data.get('Rated', 'N/A'),
-            'released': data.get('Released', 'N/A'),
-            'runtime': data.get('Runtime', 'N/A'),
-            'genre': data.get('Genre', 'N/A'),
-            'director': data.get('Director', 'N/A'),
-            'writer': data.get('Writer', 'N/A'),
-            'actors': data.get('Actors', 'N/A'),
-            'plot': data.get('Plot', 'N/A'),
-            'language': data.get('Language', 'N/A'),
-            'country': data.get('Country', 'N/A'),
-            'awards': data.get('Awards', 'N/A'),
-            'poster': data.get('Poster', 'N/A'),
-            'imdb_rating': data.get('imdbRating', 'N/A'),
-            'imdb_votes': data.get('imdbVotes', 'N/A'),
-            'box_office': data.get('BoxOffice', 'N/A'),
-            'imdb_id': data.get('imdbID', 'N/A')
-        }
-
-        return movie_data, None
-    except requests.Timeout:
-        return None, "API request timed out. Please try again."
+        cursor = db.cursor()
+        cursor.execute(
+            '''UPDATE movies SET imdb_rating = %s, imdb_votes = %s, box_office = %s, awards = %s
+               WHERE imdb_id = %s''',
+            (movie_data['imdb_rating'], movie_data['imdb_votes'], movie_data['box_office'],
+             movie_data['awards'], movie_data['imdb_id'])
+        )
+        db.commit()
+    finally:
+        db.close()
+
+# "Similar in your collection": each movie's top SIMILAR_MOVIES_TOP_K neighbours by cosine
+# similarity over weighted feature blocks, cached so the view page is a single lookup.
+SIMILAR_MOVIES_TOP_K = 6
+SIMILAR_MOVIES_MIN_SCORE = 0.05
+SIMILARITY_FIELDS = {'genre': 1.0, 'director': 0.5, 'actors': 0.75, 'plot': 1.0}
+SIMILARITY_CHUNK_ROWS = 512
+SIMILAR_MOVIES_DEBOUNCE_SECONDS = max(1, int(os.getenv('SIMILAR_MOVIES_DEBOUNCE_SECONDS', 10)))
+PLOT_STOPWORDS = frozenset(
+    'the and for with his her their they them this that from into when who what where while after before '
+    'about over under but not are was were has have had its him she one two out off all any can will must '
+    'being been than then there these those which whose your our'.split()
+)
+
+CREATE_MOVIE_SIMILARITIES_TABLE = '''
+    CREATE TABLE IF NOT EXISTS movie_similarities (
+        movie_id INT NOT NULL,
+        similar_id INT NOT NULL,
+        score FLOAT NOT NULL,
+        PRIMARY KEY (movie_id, similar_id),
+        KEY idx_movie_similarities_similar (similar_id)
+    )
+'''
+
+def movie_feature_tokens(movie):
+    """Tokens for each SIMILARITY_FIELDS block: comma-separated names for genre/director/actors, words for plot"""
+    tokens = {}
+    for field in ('genre', 'director', 'actors'):
+        values = (value.strip().lower() for value in (movie.get(field) or '').split(','))
+        tokens[field] = [value for value in values if value and value != 'n/a']
+    plot = (movie.get('plot') or '').lower()
+    tokens['plot'] = [word for word in re.findall(r"[a-z][a-z']{2,}", plot)
+                      if word not in PLOT_STOPWORDS] if plot != 'n/a' else []
+    return tokens
+
+def movie_feature_matrix(rows):
+    """Unit-length feature vectors (one row per movie) so X @ X.T is the cosine similarity matrix.
+
+    Each block is TF-IDF weighted (one-hot for genre/director/actors, log term
+    frequency for plot), normalised and scaled by its SIMILARITY_FIELDS weight.
+    Tokens used by a single movie can't make two movies similar, so they are dropped.
+    """
+    import numpy as np
+
+    documents = [movie_feature_tokens(row) for row in rows]
+    blocks = []
+    for field, weight in SIMILARITY_FIELDS.items():
+        frequency = Counter(token for document in documents for token in set(document[field]))
+        vocabulary = sorted(token for token, count in frequency.items() if count > 1)
+        columns = {token: column for column, token in enumerate(vocabulary)}
+        block = np.zeros((len(rows), len(vocabulary)), dtype=np.float32)
+        for row, document in enumerate(documents):
+            for token, count in Counter(document[field]).items():
+                if token in columns:
+                    block[row, columns[token]] = 1 + np.log(count)
+        if vocabulary:
+            block *= np.log((1 + len(rows)) / (1 + np.array([frequency[token] for token in vocabulary]))) + 1
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        blocks.append(np.divide(block, norms, out=np.zeros_like(block), where=norms > 0) * weight)
+
+    matrix = np.hstack(blocks)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+def top_similar(scores, ids, own_index):
+    """[(similar_id, score)] for the best SIMILAR_MOVIES_TOP_K entries of one similarity row"""
+    import numpy as np
+
+    scores = scores.copy()
+    scores[own_index] = -1
+    k = min(SIMILAR_MOVIES_TOP_K, len(scores) - 1)
+    if k <= 0:
+        return []
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best])]
+    return [(ids[index], min(float(scores[index]), 1.0)) for index in best
+            if scores[index] >= SIMILAR_MOVIES_MIN_SCORE]
+
+def save_similar_movies(cursor, movie_id, neighbours):
+    """Replace the cached neighbours of one movie"""
+    cursor.execute('DELETE FROM movie_similarities WHERE movie_id = %s', (movie_id,))
+    if neighbours:
+        cursor.executemany(
+            'INSERT INTO movie_similarities (movie_id, similar_id, score) VALUES (%s, %s, %s)',
+            [(movie_id, similar_id, score) for similar_id, score in neighbours]
+        )
+
+def load_movie_features(cursor):
+    """(ids, feature matrix) for every stored movie"""
+    cursor.execute('SELECT id, genre, director, actors, plot FROM movies ORDER BY id')
+    rows = cursor.fetchall()
+    return [row['id'] for row in rows], movie_feature_matrix(rows)
+
+def recompute_similar_movies(cursor, ids, matrix, indexes):
+    """Recompute and save the neighbours of the movies at indexes, SIMILARITY_CHUNK_ROWS at a time"""
+    for start in range(0, len(indexes), SIMILARITY_CHUNK_ROWS):
+        chunk = indexes[start:start + SIMILARITY_CHUNK_ROWS]
+        for index, scores in zip(chunk, matrix[chunk] @ matrix.T):
+            save_similar_movies(cursor, ids[index], top_similar(scores, ids, index))
+
+def rebuild_movie_similarities(db):
+    """Recompute every movie's neighbours from scratch (bulk matrix product); returns the movie count"""
+    cursor = db.cursor()
+    cursor.execute(CREATE_MOVIE_SIMILARITIES_TABLE)
+    ids, matrix = load_movie_features(cursor)
+    cursor.execute('DELETE FROM movie_similarities')
+    recompute_similar_movies(cursor, ids, matrix, list(range(len(ids))))
+    return len(ids)
+
+# Job handler: runs in worker.py, so a movie change never rebuilds feature vectors inside the request.
+# Every change recomputes the whole cache on purpose: the vocabulary and IDF weights are shared by all
+# movies and shift with each one, so patching single vectors would leave every other score drifting.
+# Debouncing keeps that to one vectorised rebuild per burst of changes.
+def refresh_similar_movies_job(db, payload, progress):
+    """Rebuild the similar-movies cache after the movies changed in one debounce window"""
+    count = rebuild_movie_similarities(db)
+    db.commit()
+    return {'movies': count}
+
+register_job_handler('refresh_similar_movies', refresh_similar_movies_job)
+
+def refresh_similar_movies():
+    """Queue a rebuild of the similar-movies cache for the end of the current debounce window.
+
+    Changes within one SIMILAR_MOVIES_DEBOUNCE_SECONDS window share a job (same
+    payload) that can't start before the window closes, so it sees all of them;
+    a change made while it runs falls in a later window and gets its own job.
+    Best effort: a failure never undoes the movie change itself.
+    """
+    window_end = (int(time.time() // SIMILAR_MOVIES_DEBOUNCE_SECONDS) + 1) * SIMILAR_MOVIES_DEBOUNCE_SECONDS
+    try:
+        # One extra second because NOW(), which run_at is compared with, has whole seconds
+        enqueue_job(require_db(), 'refresh_similar_movies', {'window_end': window_end},
+                    delay_seconds=math.ceil(window_end - time.time()) + 1)
     except Exception as e:
-        return None, f"Error fetching movie data: {str(e)}"
+        require_db().rollback()
+        print(f"Could not queue a similar movies update: {e}")
+
+@movies.cli.command('rebuild-similar')
+def rebuild_similar_command():
+    """Recompute the similar-movies cache for the whole collection."""
+    db = connect_db()
+    try:
+        count = rebuild_movie_similarities(db)
+        db.commit()
+        click.echo(f'Rebuilt similar movies for {count} movie(s)')
+    finally:
+        db.close()
 
 @movies.route('/', methods=['GET', 'POST'])
 def show_movies():
@@ -74,33 +231,10 @@ def show_movies():
             return redirect(url_for('movies.show_movies'))
 
         try:
-            cursor = g.db.cursor()
+            cursor = require_db().cursor()
 
             # Create enhanced table if it doesn't exist
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS movies (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    title VARCHAR(200) NOT NULL,
-                    year VARCHAR(10),
-                    rated VARCHAR(10),
-                    released VARCHAR(50),
-                    runtime VARCHAR(50),
-                    genre VARCHAR(200),
-                    director VARCHAR(200),
-                    writer TEXT,
-                    actors TEXT,
-                    plot TEXT,
-                    language VARCHAR(100),
-                    country VARCHAR(100),
-                    awards TEXT,
-                    poster VARCHAR(500),
-                    imdb_rating VARCHAR(10),
-                    imdb_votes VARCHAR(50),
-                    box_office VARCHAR(50),
-                    imdb_id VARCHAR(20),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            cursor.execute(CREATE_MOVIES_TABLE)
 
             # Insert new movie with all data
             cursor.execute(
@@ -113,7 +247,8 @@ def show_movies():
                  movie_data['awards'], movie_data['poster'], movie_data['imdb_rating'], movie_data['imdb_votes'],
                  movie_data['box_office'], movie_data['imdb_id'])
             )
-            g.db.commit()
+            commit_db()
+            refresh_similar_movies()
             flash(f'Movie "{movie_data["title"]}" ({movie_data["year"]}) added successfully!', 'success')
         except Exception as e:
             flash(f'Error adding movie: {str(e)}', 'error')
@@ -121,38 +256,8 @@ def show_movies():
         return redirect(url_for('movies.show_movies'))
 
     # Get all movies
-    try:
-        cursor = g.db.cursor()
-        cursor.execute('SELECT * FROM movies ORDER BY id DESC')
-        movies_list = cursor.fetchall()
-    except:
-        movies_list = []
-        cursor = g.db.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS movies (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                title VARCHAR(200) NOT NULL,
-                year VARCHAR(10),
-                rated VARCHAR(10),
-                released VARCHAR(50),
-                runtime VARCHAR(50),
-                genre VARCHAR(200),
-                director VARCHAR(200),
-                writer TEXT,
-                actors TEXT,
-                plot TEXT,
-                language VARCHAR(100),
-                country VARCHAR(100),
-                awards TEXT,
-                poster VARCHAR(500),
-                imdb_rating VARCHAR(10),
-                imdb_votes VARCHAR(50),
-                box_office VARCHAR(50),
-                imdb_id VARCHAR(20),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        g.db.commit()
+    movies_list = fetch_listing('SELECT * FROM movies ORDER BY id DESC',
+                                lambda cursor: cursor.execute(CREATE_MOVIES_TABLE))
 
     # Check if API key is configured
     api_key = os.getenv('OMDB_API_KEY')
@@ -163,12 +268,12 @@ def show_movies():
 @movies.route('/view/<int:movie_id>')
 def view_movie(movie_id):
     try:
-        cursor = g.db.cursor()
+        cursor = get_read_db().cursor()
         cursor.execute('SELECT * FROM movies WHERE id = %s', (movie_id,))
         movie = cursor.fetchone()
 
         if movie:
-            return render_template('movie_view.html', movie=movie)
+            return render_template('movie_view.html', movie=movie, similar_movies=load_similar_movies(cursor, movie_id))
         else:
             flash('Movie not found', 'error')
             return redirect(url_for('movies.show_movies'))
@@ -176,11 +281,24 @@ def view_movie(movie_id):
         flash(f'Error viewing movie: {str(e)}', 'error')
         return redirect(url_for('movies.show_movies'))
 
+def load_similar_movies(cursor, movie_id):
+    """Cached neighbours of a movie for the view page (empty until the cache exists)"""
+    try:
+        cursor.execute(
+            '''SELECT m.id, m.title, m.year, m.genre, m.poster, s.score
+               FROM movie_similarities s JOIN movies m ON m.id = s.similar_id
+               WHERE s.movie_id = %s ORDER BY s.score DESC''',
+            (movie_id,)
+        )
+        return cursor.fetchall()
+    except Exception:
+        return []
+
 @movies.route('/edit/<int:movie_id>', methods=['GET', 'POST'])
 def edit_movie(movie_id):
     if request.method == 'POST':
         try:
-            cursor = g.db.cursor()
+            cursor = require_db().cursor()
 
             # Get all form fields
             fields = {
@@ -205,7 +323,8 @@ def edit_movie(movie_id):
                  fields['director'], fields['actors'], fields['plot'], fields['awards'], fields['poster'],
                  fields['imdb_rating'], movie_id)
             )
-            g.db.commit()
+            commit_db()
+            refresh_similar_movies()
             flash(f'Movie "{fields["title"]}" updated successfully!', 'success')
             return redirect(url_for('movies.show_movies'))
         except Exception as e:
@@ -218,15 +337,24 @@ def edit_movie(movie_id):
 @movies.route('/delete/<int:movie_id>')
 def delete_movie(movie_id):
     try:
-        cursor = g.db.cursor()
+        cursor = require_db().cursor()
         cursor.execute('DELETE FROM movies WHERE id = %s', (movie_id,))
-        g.db.commit()
+        commit_db()
+        refresh_similar_movies()
         flash('Movie deleted successfully!', 'success')
     except Exception as e:
         flash(f'Error deleting movie: {str(e)}', 'error')
 
     return redirect(url_for('movies.show_movies'))
 
+# Streaming export: /movies/export?format=csv|jsonl|parquet&since=<ISO timestamp>
+register_export('movies', 'movies', 'updated_at')
+
+@movies.route('/export')
+def export_movies():
+    """Download every movie (or those added or edited since=) as CSV, JSON Lines or Parquet"""
+    return export_response('movies', request.args)
+
 @movies.route('/search')
 def search_movie():
     """Quick search endpoint for movie data (AJAX/API use)"""
@@ -236,9 +364,28 @@ def search_movie():
     if not title:
         return jsonify({'error': 'Title is required'}), 400
 
-    movie_data, error = get_movie_data(title, year if year else None)
+    # Stored copy of this movie, served if the API is down or slow
+    stored = None
+    try:
+        cursor = get_read_db().cursor()
+        if year:
+            cursor.execute('SELECT * FROM movies WHERE title = %s AND year = %s ORDER BY id DESC LIMIT 1', (title, year))
+        else:
+            cursor.execute('SELECT * FROM movies WHERE title = %s ORDER BY id DESC LIMIT 1', (title,))
+        stored = cursor.fetchone()
+    except Exception:
+        pass
+
+    movie_data, error, pending = fetch_or_stale(
+        get_movie_data, (title, year if year else None), has_stale=stored is not None,
+        on_late_result=store_movie_ratings
+    )
+
+    if stored and (pending or error):
+        return json_response(movie_row_to_data(stored))
 
     if error:
         return jsonify({'error': error}), 400
 
-    return jsonify(movie_data)
+    movie_data['stale'] = False
+    return json_response(movie_data)
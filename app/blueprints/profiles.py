@@ -0,0 +1,40 @@
+from flask import Blueprint, render_template, abort, session, send_from_directory
+import os
+
+from app.functions import (PROFILE_DIR, PROFILE_SAMPLE_RATE, flamegraph_blocks, list_profiles, load_folded_stacks,
+                           load_profile, profile_token_valid, request_profile_token)
+
+profiles = Blueprint('profiles', __name__)
+
+def require_profile_access():
+    """404 unless this request or session carries a valid profiling token (see `flask profile-token`)"""
+    token = request_profile_token()
+    if profile_token_valid(token):
+        session['profile_token'] = token
+        return
+    if not profile_token_valid(session.get('profile_token')):
+        abort(404)
+
+@profiles.route('/')
+def show_profiles():
+    """Index of stored request profiles, newest first"""
+    require_profile_access()
+    return render_template('profiles.html', profiles=list_profiles(), sample_rate=PROFILE_SAMPLE_RATE)
+
+@profiles.route('/<profile_id>')
+def view_profile(profile_id):
+    """One profile: request details, flamegraph and SQL with EXPLAIN plans for slow statements"""
+    require_profile_access()
+    profile = load_profile(profile_id)
+    if not profile:
+        abort(404)
+    blocks = flamegraph_blocks(load_folded_stacks(profile_id))
+    depth = max((block['depth'] for block in blocks), default=0) + 1
+    return render_template('profile_view.html', profile=profile, blocks=blocks, depth=depth)
+
+@profiles.route('/<profile_id>/folded')
+def download_profile(profile_id):
+    """Collapsed stacks for flamegraph.pl, speedscope or inferno"""
+    require_profile_access()
+    return send_from_directory(os.path.abspath(PROFILE_DIR), f'{profile_id}.folded',
+                               mimetype='text/plain', as_attachment=True)
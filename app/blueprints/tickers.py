@@ -1,50 +1,70 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, g, jsonify
-import requests
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+from app.db_connect import commit_db, connect_db, fetch_listing, get_read_db, require_db
+from app.functions import (enqueue_job, fetch_or_stale, get_stock_data, json_response, record_deletion,
+                           export_response, register_export, register_job_handler, register_stream, stream_events,
+                           upgrade_table)
 
 tickers = Blueprint('tickers', __name__)
 
-# Helper function to get stock data from Alpha Vantage
-def get_stock_data(symbol):
-    """Fetch stock data from Alpha Vantage API"""
-    api_key = os.getenv('STOCK_API_KEY')
-    if not api_key or api_key == 'your_alpha_vantage_api_key_here':
-        return None, "Stock API key not configured"
-
+# One row per symbol: adding an existing symbol updates it instead of duplicating it
+CREATE_TICKERS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS tickers (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        symbol VARCHAR(10) NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        price DECIMAL(10, 2) NOT NULL,
+        change_amount DECIMAL(10, 2) DEFAULT 0,
+        change_percent VARCHAR(20) DEFAULT '0%',
+        volume BIGINT DEFAULT 0,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_tickers_symbol (symbol),
+        KEY idx_tickers_last_updated (last_updated)
+    )
+'''
+
+DUPLICATE_TICKERS_MESSAGE = ('The tickers table still has duplicate symbols from an earlier version. '
+                             'Run "python fix_database_schema.py --migrate" to merge them; '
+                             "until then tickers can't be added.")
+
+def prepare_tickers_table(cursor):
+    """Create tickers if needed, adding the unique symbol key to a table from an earlier version.
+
+    Returns False while duplicate symbols keep the key from being added.
+    """
+    cursor.execute(CREATE_TICKERS_TABLE)
+    return upgrade_table(cursor, 'tickers', unique_keys=[('uq_tickers_symbol', 'symbol')])
+
+def ticker_row_to_quote(ticker):
+    """Convert a stored tickers row to the get_stock_data() shape, flagged as stale"""
+    return {
+        'symbol': ticker['symbol'],
+        'price': float(ticker['price']),
+        'change': float(ticker['change_amount'] or 0),
+        'change_percent': ticker['change_percent'],
+        'volume': ticker['volume'],
+        'latest_trading_day': 'N/A',
+        'stale': True,
+        'last_updated': ticker['last_updated'].isoformat() if ticker['last_updated'] else None
+    }
+
+def store_quote(symbol, stock_data):
+    """Save a quote that arrived after the request stopped waiting (runs on a background thread)"""
+    db = connect_db()
     try:
-        # Get real-time quote
-        url = f'https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={symbol}&apikey={api_key}'
-        response = requests.get(url, timeout=10)
-        data = response.json()
-
-        # Check for API errors
-        if 'Error Message' in data:
-            return None, f"Invalid ticker symbol: {symbol}"
-        elif 'Note' in data:
-            return None, "API rate limit reached. Please try again in a minute."
-        elif 'Global Quote' not in data or not data['Global Quote']:
-            return None, f"No data available for symbol: {symbol}"
-
-        quote = data['Global Quote']
-
-        # Extract relevant data
-        stock_data = {
-            'symbol': quote.get('01. symbol', symbol),
-            'price': float(quote.get('05. price', 0)),
-            'change': float(quote.get('09. change', 0)),
-            'change_percent': quote.get('10. change percent', '0%'),
-            'volume': int(quote.get('06. volume', 0)),
-            'latest_trading_day': quote.get('07. latest trading day', 'N/A')
-        }
-
-        return stock_data, None
-    except requests.Timeout:
-        return None, "API request timed out. Please try again."
-    except Exception as e:
-        return None, f"Error fetching stock data: {str(e)}"
+        cursor = db.cursor()
+        cursor.execute(
+            '''UPDATE tickers
+               SET price = %s, change_amount = %s, change_percent = %s, volume = %s, last_updated = CURRENT_TIMESTAMP
+               WHERE symbol = %s''',
+            (stock_data['price'], stock_data['change'], stock_data['change_percent'],
+             stock_data['volume'], symbol)
+        )
+        db.commit()
+    finally:
+        db.close()
 
 @tickers.route('/', methods=['GET', 'POST'])
 def show_tickers():
@@ -68,70 +88,49 @@ def show_tickers():
             ticker_name = ticker_symbol
 
         try:
-            cursor = g.db.cursor()
-
-            # Create table if it doesn't exist (with enhanced schema)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS tickers (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    symbol VARCHAR(10) NOT NULL,
-                    name VARCHAR(100) NOT NULL,
-                    price DECIMAL(10, 2) NOT NULL,
-                    change_amount DECIMAL(10, 2) DEFAULT 0,
-                    change_percent VARCHAR(20) DEFAULT '0%',
-                    volume BIGINT DEFAULT 0,
-                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            # Insert new ticker with live data
+            cursor = require_db().cursor()
+
+            # Without the unique key the upsert below would quietly insert another duplicate
+            if not prepare_tickers_table(cursor):
+                flash(DUPLICATE_TICKERS_MESSAGE, 'error')
+                return redirect(url_for('tickers.show_tickers'))
+
+            # Insert new ticker with live data, or refresh the existing row for this symbol
             cursor.execute(
                 '''INSERT INTO tickers (symbol, name, price, change_amount, change_percent, volume)
-                   VALUES (%s, %s, %s, %s, %s, %s)''',
+                   VALUES (%s, %s, %s, %s, %s, %s)
+                   ON DUPLICATE KEY UPDATE name = VALUES(name), price = VALUES(price),
+                       change_amount = VALUES(change_amount), change_percent = VALUES(change_percent),
+                       volume = VALUES(volume), last_updated = CURRENT_TIMESTAMP''',
                 (stock_data['symbol'], ticker_name, stock_data['price'],
                  stock_data['change'], stock_data['change_percent'], stock_data['volume'])
             )
-            g.db.commit()
-            flash(f'Ticker {ticker_symbol} added successfully with live price ${stock_data["price"]:.2f}!', 'success')
+            inserted = cursor.rowcount == 1  # MySQL reports 2 affected rows when an upsert updates
+            commit_db()
+            if inserted:
+                flash(f'Ticker {ticker_symbol} added successfully with live price ${stock_data["price"]:.2f}!', 'success')
+            else:
+                flash(f'Ticker {ticker_symbol} is already tracked; updated it with live price ${stock_data["price"]:.2f}.', 'info')
         except Exception as e:
             flash(f'Error adding ticker: {str(e)}', 'error')
 
         return redirect(url_for('tickers.show_tickers'))
 
     # Get all tickers
-    try:
-        cursor = g.db.cursor()
-        cursor.execute('SELECT * FROM tickers ORDER BY id DESC')
-        tickers_list = cursor.fetchall()
-    except:
-        tickers_list = []
-        cursor = g.db.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tickers (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                symbol VARCHAR(10) NOT NULL,
-                name VARCHAR(100) NOT NULL,
-                price DECIMAL(10, 2) NOT NULL,
-                change_amount DECIMAL(10, 2) DEFAULT 0,
-                change_percent VARCHAR(20) DEFAULT '0%',
-                volume BIGINT DEFAULT 0,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        g.db.commit()
+    tickers_list = fetch_listing('SELECT * FROM tickers ORDER BY id DESC',
+                                 lambda cursor: cursor.execute(CREATE_TICKERS_TABLE))
 
     # Check if API key is configured
     api_key = os.getenv('STOCK_API_KEY')
     api_configured = api_key and api_key != 'your_alpha_vantage_api_key_here'
 
-    return render_template('tickers.html', tickers=tickers_list, api_configured=api_configured)
+    return render_template('tickers.html', tickers=tickers_list, api_configured=api_configured,
+                           job_id=request.args.get('job', type=int))
 
 @tickers.route('/update/<int:ticker_id>')
 def update_ticker(ticker_id):
     try:
-        cursor = g.db.cursor()
+        cursor = require_db().cursor()
         cursor.execute('SELECT * FROM tickers WHERE id = %s', (ticker_id,))
         ticker = cursor.fetchone()
 
@@ -139,11 +138,20 @@ def update_ticker(ticker_id):
             flash('Ticker not found', 'error')
             return redirect(url_for('tickers.show_tickers'))
 
-        # Fetch live data from API
-        stock_data, error = get_stock_data(ticker['symbol'])
+        # Fetch live data, but keep showing the stored price if the API is down or slow
+        symbol = ticker['symbol']
+        stock_data, error, pending = fetch_or_stale(
+            get_stock_data, (symbol,), has_stale=True,
+            on_late_result=lambda data: store_quote(symbol, data)
+        )
+
+        if pending:
+            flash(f'Stock API is slow to respond. Showing the last known price for {symbol}; '
+                  'it will refresh in the background.', 'info')
+            return redirect(url_for('tickers.show_tickers'))
 
         if error:
-            flash(error, 'error')
+            flash(f'{error} Showing the last known price for {symbol}.', 'warning')
             return redirect(url_for('tickers.show_tickers'))
 
         # Update ticker with all new data
@@ -154,7 +162,7 @@ def update_ticker(ticker_id):
             (stock_data['price'], stock_data['change'], stock_data['change_percent'],
              stock_data['volume'], ticker_id)
         )
-        g.db.commit()
+        commit_db()
 
         change_indicator = "+" if stock_data['change'] >= 0 else ""
         flash(f'Ticker {ticker["symbol"]} updated: ${stock_data["price"]:.2f} ({change_indicator}${stock_data["change"]:.2f})', 'success')
@@ -167,58 +175,92 @@ def update_ticker(ticker_id):
 @tickers.route('/delete/<int:ticker_id>')
 def delete_ticker(ticker_id):
     try:
-        cursor = g.db.cursor()
+        record_deletion(require_db(), 'tickers', ticker_id)
+        cursor = require_db().cursor()
         cursor.execute('DELETE FROM tickers WHERE id = %s', (ticker_id,))
-        g.db.commit()
+        commit_db()
         flash('Ticker deleted successfully!', 'success')
     except Exception as e:
         flash(f'Error deleting ticker: {str(e)}', 'error')
 
     return redirect(url_for('tickers.show_tickers'))
 
-@tickers.route('/update-all')
-def update_all_tickers():
-    """Update all tickers with live data from API"""
-    try:
-        cursor = g.db.cursor()
-        cursor.execute('SELECT * FROM tickers')
-        all_tickers = cursor.fetchall()
+# Job handler: runs in worker.py, not inside the HTTP request
+def refresh_all_tickers(db, payload, progress):
+    """Update every ticker with live data from the API, reporting progress.
 
-        if not all_tickers:
-            flash('No tickers to update', 'warning')
-            return redirect(url_for('tickers.show_tickers'))
-
-        updated_count = 0
-        failed_count = 0
+    Each distinct symbol costs exactly one API call, even if duplicate rows exist.
+    """
+    cursor = db.cursor()
+    cursor.execute('SELECT DISTINCT symbol FROM tickers')
+    all_tickers = cursor.fetchall()
 
-        for ticker in all_tickers:
-            stock_data, error = get_stock_data(ticker['symbol'])
+    updated_count = 0
+    failed_count = 0
 
-            if error:
-                failed_count += 1
-                continue
+    for index, ticker in enumerate(all_tickers, start=1):
+        stock_data, error = get_stock_data(ticker['symbol'])
 
+        if error:
+            failed_count += 1
+        else:
             cursor.execute(
                 '''UPDATE tickers
                    SET price = %s, change_amount = %s, change_percent = %s, volume = %s, last_updated = CURRENT_TIMESTAMP
-                   WHERE id = %s''',
+                   WHERE symbol = %s''',
                 (stock_data['price'], stock_data['change'], stock_data['change_percent'],
-                 stock_data['volume'], ticker['id'])
+                 stock_data['volume'], ticker['symbol'])
             )
+            db.commit()
             updated_count += 1
 
-        g.db.commit()
+        progress(index, len(all_tickers))
+
+    # Nothing succeeded (API down or rate limited): fail so the job is retried later
+    if failed_count and not updated_count:
+        raise RuntimeError(f'Failed to update all {failed_count} ticker(s)')
+
+    return {'updated': updated_count, 'failed': failed_count}
 
-        if updated_count > 0:
-            flash(f'Successfully updated {updated_count} ticker(s)', 'success')
-        if failed_count > 0:
-            flash(f'Failed to update {failed_count} ticker(s)', 'warning')
+register_job_handler('update_all_tickers', refresh_all_tickers)
+
+@tickers.route('/update-all')
+def update_all_tickers():
+    """Queue a background job that updates all tickers with live data"""
+    try:
+        cursor = require_db().cursor()
+        cursor.execute('SELECT id FROM tickers LIMIT 1')
+
+        if not cursor.fetchone():
+            flash('No tickers to update', 'warning')
+            return redirect(url_for('tickers.show_tickers'))
+
+        job_id = enqueue_job(require_db(), 'update_all_tickers')
+        flash(f'Update queued as job #{job_id}. Prices will refresh in the background.', 'info')
+        return redirect(url_for('tickers.show_tickers', job=job_id))
 
     except Exception as e:
-        flash(f'Error updating tickers: {str(e)}', 'error')
+        flash(f'Error queuing ticker update: {str(e)}', 'error')
 
     return redirect(url_for('tickers.show_tickers'))
 
+# Live updates: rows whose last_updated moved are pushed to /tickers/stream
+register_stream('tickers', 'SELECT * FROM tickers WHERE last_updated >= %s ORDER BY last_updated', 'last_updated')
+
+@tickers.route('/stream')
+def stream_tickers():
+    """Server-Sent Events stream of ticker rows as they are updated"""
+    return Response(stream_events('tickers'), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Streaming export: /tickers/export?format=csv|jsonl|parquet&since=<ISO timestamp>
+register_export('tickers', 'tickers', 'last_updated')
+
+@tickers.route('/export')
+def export_tickers():
+    """Download every ticker (or those updated since=) as CSV, JSON Lines or Parquet"""
+    return export_response('tickers', request.args)
+
 @tickers.route('/lookup')
 def lookup_ticker():
     """Quick lookup endpoint for stock data (AJAX/API use)"""
@@ -227,9 +269,25 @@ def lookup_ticker():
     if not symbol:
         return jsonify({'error': 'Symbol is required'}), 400
 
-    stock_data, error = get_stock_data(symbol)
+    # Last stored quote for this symbol, served if the API is down or slow
+    stored = None
+    try:
+        cursor = get_read_db().cursor()
+        cursor.execute('SELECT * FROM tickers WHERE symbol = %s ORDER BY last_updated DESC LIMIT 1', (symbol,))
+        stored = cursor.fetchone()
+    except Exception:
+        pass
+
+    stock_data, error, pending = fetch_or_stale(
+        get_stock_data, (symbol,), has_stale=stored is not None,
+        on_late_result=lambda data: store_quote(symbol, data)
+    )
+
+    if stored and (pending or error):
+        return json_response(ticker_row_to_quote(stored))
 
     if error:
         return jsonify({'error': error}), 400
 
-    return jsonify(stock_data)
+    stock_data['stale'] = False
+    return json_response(stock_data)
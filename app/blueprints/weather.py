@@ -1,62 +1,327 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, g, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response
 import requests
+import math
 import os
-from dotenv import load_dotenv
+import threading
+import time
 from datetime import datetime
 
-load_dotenv()
+from app.db_connect import DB_ERRORS, commit_db, connect_db, fetch_listing, get_read_db, is_missing_table, require_db
+from app.functions import (breaker_allows, enqueue_job, fetch_or_stale, get_weather_data, json_response,
+                           parse_weather, record_deletion, export_response, register_export, register_job_handler,
+                           register_stream, stream_events, upgrade_table, upstream_get)
 
 weather = Blueprint('weather', __name__)
 
-# Helper function to get weather data from OpenWeatherMap
-def get_weather_data(city, state=''):
-    """Fetch weather data from OpenWeatherMap API"""
+# One row per (city, state): adding a tracked location updates it instead of duplicating it.
+# state is NOT NULL (empty string when omitted) so the unique key also covers city-only entries.
+CREATE_WEATHER_TABLE = '''
+    CREATE TABLE IF NOT EXISTS weather (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        city VARCHAR(100) NOT NULL,
+        state VARCHAR(50) NOT NULL DEFAULT '',
+        temperature DECIMAL(5, 2) NOT NULL,
+        feels_like DECIMAL(5, 2),
+        humidity INT,
+        description VARCHAR(100),
+        icon VARCHAR(10),
+        wind_speed DECIMAL(5, 2),
+        temp_min DECIMAL(5, 2),
+        temp_max DECIMAL(5, 2),
+        owm_id INT,
+        lat DECIMAL(9, 6),
+        lon DECIMAL(9, 6),
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_weather_location (city, state),
+        KEY idx_weather_updated_at (updated_at)
+    )
+'''
+
+DUPLICATE_WEATHER_MESSAGE = ('The weather table still has duplicate locations from an earlier version. '
+                             'Run "python fix_database_schema.py --migrate" to merge them; '
+                             "until then locations can't be added.")
+
+# Columns added after the first version of the table: each location's OpenWeatherMap city id and coordinates
+WEATHER_CACHE_COLUMNS = [
+    ('owm_id', 'INT'),
+    ('lat', 'DECIMAL(9, 6)'),
+    ('lon', 'DECIMAL(9, 6)'),
+]
+
+def prepare_weather_table(cursor):
+    """Create weather if needed, adding the cache columns and unique (city, state) key to a table from an earlier version.
+
+    Returns False while duplicate locations keep the key from being added
+    (the columns are added regardless).
+    """
+    cursor.execute(CREATE_WEATHER_TABLE)
+    return upgrade_table(cursor, 'weather', columns=WEATHER_CACHE_COLUMNS,
+                         unique_keys=[('uq_weather_location', 'city, state')])
+
+# OpenWeatherMap's group endpoint accepts at most 20 city ids per request
+WEATHER_GROUP_SIZE = 20
+
+# Set to False once the group endpoint is refused for our API key, so refreshes stop trying it
+_GROUP_QUERY = {'available': True}
+
+# Helper function to get weather for many cities in one OpenWeatherMap request
+def get_weather_group(owm_ids):
+    """Fetch current weather for up to WEATHER_GROUP_SIZE city ids in one request.
+
+    Returns ({owm_id: weather_data}, None), or (None, error) when the group
+    endpoint can't be used; callers then fall back to per-city requests.
+    """
     api_key = os.getenv('WEATHER_API_KEY')
     if not api_key or api_key == 'your_openweather_api_key_here':
         return None, "Weather API key not configured"
 
-    try:
-        # Build query string
-        if state:
-            query = f'{city},{state},US'
-        else:
-            query = f'{city},US'
+    if not _GROUP_QUERY['available']:
+        return None, "Group query not available for this API key"
 
-        # Get current weather
-        url = f'https://api.openweathermap.org/data/2.5/weather?q={query}&appid={api_key}&units=imperial'
-        response = requests.get(url, timeout=10)
-        data = response.json()
+    if not breaker_allows('openweathermap'):
+        return None, "Weather API is temporarily unavailable."
 
-        # Check for API errors
-        if response.status_code == 404:
-            return None, f"City not found: {city}"
+    try:
+        ids = ','.join(str(owm_id) for owm_id in owm_ids)
+        url = f'https://api.openweathermap.org/data/2.5/group?id={ids}&appid={api_key}&units=imperial'
+        response = upstream_get('openweathermap', url)
+
+        # Plans without access to the group endpoint get 401/403/404; stop trying it
+        if response.status_code in (401, 403, 404):
+            _GROUP_QUERY['available'] = False
+            return None, "Group query not available for this API key"
         elif response.status_code != 200:
-            error_msg = data.get('message', 'Unknown error')
-            return None, f"API error: {error_msg}"
-
-        # Extract relevant data
-        weather_data = {
-            'city': data['name'],
-            'state': state.upper() if state else '',
-            'temperature': round(data['main']['temp'], 1),
-            'feels_like': round(data['main']['feels_like'], 1),
-            'humidity': data['main']['humidity'],
-            'description': data['weather'][0]['description'].title(),
-            'icon': data['weather'][0]['icon'],
-            'wind_speed': round(data['wind']['speed'], 1),
-            'pressure': data['main']['pressure'],
-            'temp_min': round(data['main']['temp_min'], 1),
-            'temp_max': round(data['main']['temp_max'], 1)
-        }
-
-        return weather_data, None
+            return None, f"API error: {response.json().get('message', 'Unknown error')}"
+
+        return {entry['id']: parse_weather(entry) for entry in response.json()['list']}, None
     except requests.Timeout:
         return None, "API request timed out. Please try again."
-    except KeyError as e:
-        return None, f"Unexpected API response format: missing {str(e)}"
+    except (KeyError, ValueError) as e:
+        return None, f"Unexpected API response format: {str(e)}"
     except Exception as e:
         return None, f"Error fetching weather data: {str(e)}"
 
+def save_weather(cursor, city, state, weather_data):
+    """Write fresh weather (and the cached city id and coordinates) to a location's row"""
+    cursor.execute(
+        '''UPDATE weather
+           SET temperature = %s, feels_like = %s, humidity = %s, description = %s,
+               icon = %s, wind_speed = %s, temp_min = %s, temp_max = %s,
+               owm_id = COALESCE(%s, owm_id), lat = COALESCE(%s, lat), lon = COALESCE(%s, lon),
+               updated_at = CURRENT_TIMESTAMP
+           WHERE city = %s AND state = %s''',
+        (weather_data['temperature'], weather_data['feels_like'], weather_data['humidity'],
+         weather_data['description'], weather_data['icon'], weather_data['wind_speed'],
+         weather_data['temp_min'], weather_data['temp_max'],
+         weather_data.get('owm_id'), weather_data.get('lat'), weather_data.get('lon'), city, state)
+    )
+
+def weather_row_to_data(location):
+    """Convert a stored weather row to the get_weather_data() shape, flagged as stale"""
+    return {
+        'city': location['city'],
+        'state': location['state'] or '',
+        'temperature': float(location['temperature']),
+        'feels_like': float(location['feels_like']) if location['feels_like'] is not None else None,
+        'humidity': location['humidity'],
+        'description': location['description'],
+        'icon': location['icon'],
+        'wind_speed': float(location['wind_speed']) if location['wind_speed'] is not None else None,
+        'temp_min': float(location['temp_min']) if location['temp_min'] is not None else None,
+        'temp_max': float(location['temp_max']) if location['temp_max'] is not None else None,
+        'stale': True,
+        'updated_at': location['updated_at'].isoformat() if location['updated_at'] else None
+    }
+
+def store_weather(city, state, weather_data):
+    """Save weather that arrived after the request stopped waiting (runs on a background thread)"""
+    db = connect_db()
+    try:
+        cursor = db.cursor()
+        prepare_weather_table(cursor)
+        save_weather(cursor, city, state, weather_data)
+        db.commit()
+    finally:
+        db.close()
+
+# Nearby answers for /weather/lookup: a fresh observation (from a tracked location or an earlier
+# lookup) within WEATHER_NEARBY_RADIUS_MILES is served instead of calling OpenWeatherMap.
+# Set WEATHER_NEARBY_RADIUS_MILES=0 to always go upstream.
+WEATHER_NEARBY_RADIUS_MILES = float(os.getenv('WEATHER_NEARBY_RADIUS_MILES', 10))
+WEATHER_NEARBY_MAX_AGE_SECONDS = int(os.getenv('WEATHER_NEARBY_MAX_AGE_MINUTES', 15)) * 60
+WEATHER_INDEX_RELOAD_SECONDS = 60
+GEOCODE_CACHE_SIZE = 10000
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LAT = 69.0
+
+# Requested (city, state) -> coordinates learned from earlier API answers, so a repeat
+# lookup can be placed on the map without asking the API where the town is
+CREATE_WEATHER_GEOCODES_TABLE = '''
+    CREATE TABLE IF NOT EXISTS weather_geocodes (
+        city VARCHAR(100) NOT NULL,
+        state VARCHAR(50) NOT NULL DEFAULT '',
+        lat DECIMAL(9, 6) NOT NULL,
+        lon DECIMAL(9, 6) NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (city, state)
+    )
+'''
+
+# Per-process spatial index over recent observations: grid cell -> {(city, state): observation}.
+# Cells are WEATHER_NEARBY_RADIUS_MILES tall, so a search only visits the neighbouring cells.
+_NEARBY_INDEX = {'cells': {}, 'loaded_at': 0.0}
+_GEOCODES = {}
+_NEARBY_LOCK = threading.Lock()
+
+def location_key(city, state):
+    """Normalised (city, state) key shared by the geocode cache and the nearby index"""
+    return city.strip().lower(), (state or '').strip().upper()
+
+def grid_cell(lat, lon):
+    """Grid cell of a coordinate; cells are WEATHER_NEARBY_RADIUS_MILES of latitude on each side"""
+    size = WEATHER_NEARBY_RADIUS_MILES / MILES_PER_DEGREE_LAT
+    return math.floor(lat / size), math.floor(lon / size)
+
+def distance_miles(lat1, lon1, lat2, lon2):
+    """Great-circle (haversine) distance between two coordinates"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+def remember_weather(weather_data, age_seconds=0):
+    """Add an observation with coordinates to the nearby index and its location to the geocode cache"""
+    if WEATHER_NEARBY_RADIUS_MILES <= 0 or weather_data.get('lat') is None or weather_data.get('lon') is None:
+        return
+    lat, lon = float(weather_data['lat']), float(weather_data['lon'])
+    key = location_key(weather_data['city'], weather_data.get('state'))
+    observation = dict(weather_data, lat=lat, lon=lon, observed_at=time.time() - age_seconds)
+
+    with _NEARBY_LOCK:
+        if len(_GEOCODES) >= GEOCODE_CACHE_SIZE:
+            _GEOCODES.clear()
+        _GEOCODES[key] = (lat, lon)
+        cell = _NEARBY_INDEX['cells'].setdefault(grid_cell(lat, lon), {})
+        if key not in cell or cell[key]['observed_at'] < observation['observed_at']:
+            cell[key] = observation
+
+def reload_nearby_index(cursor):
+    """Every WEATHER_INDEX_RELOAD_SECONDS: drop expired observations and add fresh stored rows.
+
+    Stored rows cover refreshes made by other processes (including worker.py).
+    """
+    with _NEARBY_LOCK:
+        if time.monotonic() - _NEARBY_INDEX['loaded_at'] < WEATHER_INDEX_RELOAD_SECONDS:
+            return
+        _NEARBY_INDEX['loaded_at'] = time.monotonic()
+        cutoff = time.time() - WEATHER_NEARBY_MAX_AGE_SECONDS
+        cells = {}
+        for cell, observations in _NEARBY_INDEX['cells'].items():
+            fresh = {key: observation for key, observation in observations.items()
+                     if observation['observed_at'] >= cutoff}
+            if fresh:
+                cells[cell] = fresh
+        _NEARBY_INDEX['cells'] = cells
+
+    try:
+        cursor.execute(
+            '''SELECT *, TIMESTAMPDIFF(SECOND, updated_at, NOW()) AS age_seconds FROM weather
+               WHERE lat IS NOT NULL AND lon IS NOT NULL AND updated_at >= NOW() - INTERVAL %s SECOND''',
+            (WEATHER_NEARBY_MAX_AGE_SECONDS,)
+        )
+    except DB_ERRORS as e:
+        if is_missing_table(e):  # no tracked locations yet; earlier lookups are still indexed
+            return
+        raise
+    for row in cursor.fetchall():
+        remember_weather(dict(weather_row_to_data(row), lat=row['lat'], lon=row['lon'], stale=False),
+                         row['age_seconds'])
+
+def lookup_geocode(cursor, city, state):
+    """Coordinates of a requested location from the geocode cache or weather_geocodes, or None"""
+    key = location_key(city, state)
+    with _NEARBY_LOCK:
+        coordinates = _GEOCODES.get(key)
+    if coordinates:
+        return coordinates
+
+    try:
+        cursor.execute('SELECT lat, lon FROM weather_geocodes WHERE city = %s AND state = %s', key)
+        row = cursor.fetchone()
+    except DB_ERRORS as e:
+        if not is_missing_table(e):  # no table just means nothing has been looked up yet
+            print(f"Could not read the location of {city}: {e}")
+        return None
+    if row is None:
+        return None
+
+    coordinates = float(row['lat']), float(row['lon'])
+    with _NEARBY_LOCK:
+        _GEOCODES[key] = coordinates
+    return coordinates
+
+def save_geocode(cursor, city, state, weather_data):
+    """Remember where a requested location is, from the coordinates in an API answer.
+
+    Returns True if weather_geocodes was written (the caller commits), False if already known.
+    """
+    key = location_key(city, state)
+    coordinates = float(weather_data['lat']), float(weather_data['lon'])
+    with _NEARBY_LOCK:
+        if _GEOCODES.get(key) == coordinates:
+            return False
+        _GEOCODES[key] = coordinates
+
+    cursor.execute(CREATE_WEATHER_GEOCODES_TABLE)
+    cursor.execute(
+        '''INSERT INTO weather_geocodes (city, state, lat, lon) VALUES (%s, %s, %s, %s)
+           ON DUPLICATE KEY UPDATE lat = VALUES(lat), lon = VALUES(lon)''',
+        key + coordinates
+    )
+    return True
+
+def find_nearby_weather(cursor, city, state):
+    """Nearest observation within WEATHER_NEARBY_RADIUS_MILES and WEATHER_NEARBY_MAX_AGE_SECONDS, or None.
+
+    Only possible once the requested location's coordinates are known (from a
+    tracked location or an earlier lookup). The result is flagged nearby=True
+    with the distance and age of the observation it came from.
+    """
+    if WEATHER_NEARBY_RADIUS_MILES <= 0:
+        return None
+    coordinates = lookup_geocode(cursor, city, state)
+    if coordinates is None:
+        return None
+    reload_nearby_index(cursor)
+
+    lat, lon = coordinates
+    cell_lat, cell_lon = grid_cell(lat, lon)
+    # A degree of longitude shrinks towards the poles, so search more columns there
+    lon_cells = math.ceil(1 / max(math.cos(math.radians(lat)), 0.01))
+    cutoff = time.time() - WEATHER_NEARBY_MAX_AGE_SECONDS
+    best_distance, best = None, None
+    with _NEARBY_LOCK:
+        for row in range(cell_lat - 1, cell_lat + 2):
+            for column in range(cell_lon - lon_cells, cell_lon + lon_cells + 1):
+                for observation in _NEARBY_INDEX['cells'].get((row, column), {}).values():
+                    if observation['observed_at'] < cutoff:
+                        continue
+                    distance = distance_miles(lat, lon, observation['lat'], observation['lon'])
+                    if distance <= WEATHER_NEARBY_RADIUS_MILES and (best is None or distance < best_distance):
+                        best_distance, best = distance, observation
+
+    if best is None:
+        return None
+    weather_data = {key: value for key, value in best.items() if key != 'observed_at'}
+    weather_data.update(
+        stale=False,
+        nearby=True,
+        requested={'city': city, 'state': state.upper()},
+        distance_miles=round(best_distance, 1),
+        age_seconds=round(time.time() - best['observed_at'])
+    )
+    return weather_data
+
 @weather.route('/', methods=['GET', 'POST'])
 def show_weather():
     if request.method == 'POST':
@@ -75,79 +340,55 @@ def show_weather():
             return redirect(url_for('weather.show_weather'))
 
         try:
-            cursor = g.db.cursor()
-
-            # Create table if it doesn't exist (with enhanced schema)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS weather (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    city VARCHAR(100) NOT NULL,
-                    state VARCHAR(50),
-                    temperature DECIMAL(5, 2) NOT NULL,
-                    feels_like DECIMAL(5, 2),
-                    humidity INT,
-                    description VARCHAR(100),
-                    icon VARCHAR(10),
-                    wind_speed DECIMAL(5, 2),
-                    temp_min DECIMAL(5, 2),
-                    temp_max DECIMAL(5, 2),
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            # Insert new weather entry with live data
+            cursor = require_db().cursor()
+
+            # Without the unique key the upsert below would quietly insert another duplicate
+            if not prepare_weather_table(cursor):
+                flash(DUPLICATE_WEATHER_MESSAGE, 'error')
+                return redirect(url_for('weather.show_weather'))
+
+            # Insert new weather entry with live data, or refresh the existing row for this location
             cursor.execute(
-                '''INSERT INTO weather (city, state, temperature, feels_like, humidity, description, icon, wind_speed, temp_min, temp_max)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
+                '''INSERT INTO weather (city, state, temperature, feels_like, humidity, description, icon, wind_speed,
+                                       temp_min, temp_max, owm_id, lat, lon)
+                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                   ON DUPLICATE KEY UPDATE temperature = VALUES(temperature), feels_like = VALUES(feels_like),
+                       humidity = VALUES(humidity), description = VALUES(description), icon = VALUES(icon),
+                       wind_speed = VALUES(wind_speed), temp_min = VALUES(temp_min), temp_max = VALUES(temp_max),
+                       owm_id = VALUES(owm_id), lat = VALUES(lat), lon = VALUES(lon),
+                       updated_at = CURRENT_TIMESTAMP''',
                 (weather_data['city'], weather_data['state'], weather_data['temperature'],
                  weather_data['feels_like'], weather_data['humidity'], weather_data['description'],
-                 weather_data['icon'], weather_data['wind_speed'], weather_data['temp_min'], weather_data['temp_max'])
+                 weather_data['icon'], weather_data['wind_speed'], weather_data['temp_min'], weather_data['temp_max'],
+                 weather_data['owm_id'], weather_data['lat'], weather_data['lon'])
             )
-            g.db.commit()
-            flash(f'Weather for {weather_data["city"]} added successfully! Current: {weather_data["temperature"]}°F', 'success')
+            inserted = cursor.rowcount == 1  # MySQL reports 2 affected rows when an upsert updates
+            commit_db()
+            if inserted:
+                flash(f'Weather for {weather_data["city"]} added successfully! Current: {weather_data["temperature"]}°F', 'success')
+            else:
+                flash(f'{weather_data["city"]} is already tracked; updated it. Current: {weather_data["temperature"]}°F', 'info')
         except Exception as e:
             flash(f'Error adding weather location: {str(e)}', 'error')
 
         return redirect(url_for('weather.show_weather'))
 
     # Get all weather entries
-    try:
-        cursor = g.db.cursor()
-        cursor.execute('SELECT * FROM weather ORDER BY id DESC')
-        weather_list = cursor.fetchall()
-    except:
-        weather_list = []
-        cursor = g.db.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS weather (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                city VARCHAR(100) NOT NULL,
-                state VARCHAR(50),
-                temperature DECIMAL(5, 2) NOT NULL,
-                feels_like DECIMAL(5, 2),
-                humidity INT,
-                description VARCHAR(100),
-                icon VARCHAR(10),
-                wind_speed DECIMAL(5, 2),
-                temp_min DECIMAL(5, 2),
-                temp_max DECIMAL(5, 2),
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        g.db.commit()
+    weather_list = fetch_listing('SELECT * FROM weather ORDER BY id DESC',
+                                 lambda cursor: cursor.execute(CREATE_WEATHER_TABLE))
 
     # Check if API key is configured
     api_key = os.getenv('WEATHER_API_KEY')
     api_configured = api_key and api_key != 'your_openweather_api_key_here'
 
-    return render_template('weather.html', weather_list=weather_list, api_configured=api_configured)
+    return render_template('weather.html', weather_list=weather_list, api_configured=api_configured,
+                           job_id=request.args.get('job', type=int))
 
 @weather.route('/update/<int:weather_id>')
 def update_weather(weather_id):
     try:
-        cursor = g.db.cursor()
+        cursor = require_db().cursor()
+        prepare_weather_table(cursor)  # save_weather needs the cache columns
         cursor.execute('SELECT * FROM weather WHERE id = %s', (weather_id,))
         weather_entry = cursor.fetchone()
 
@@ -155,24 +396,26 @@ def update_weather(weather_id):
             flash('Weather location not found', 'error')
             return redirect(url_for('weather.show_weather'))
 
-        # Fetch live weather data from API
-        weather_data, error = get_weather_data(weather_entry['city'], weather_entry.get('state', ''))
+        # Fetch live weather, but keep showing the stored reading if the API is down or slow
+        city = weather_entry['city']
+        state = weather_entry.get('state') or ''
+        weather_data, error, pending = fetch_or_stale(
+            get_weather_data, (city, state, weather_entry.get('owm_id')), has_stale=True,
+            on_late_result=lambda data: store_weather(city, state, data)
+        )
+
+        if pending:
+            flash(f'Weather API is slow to respond. Showing the last known weather for {city}; '
+                  'it will refresh in the background.', 'info')
+            return redirect(url_for('weather.show_weather'))
 
         if error:
-            flash(error, 'error')
+            flash(f'{error} Showing the last known weather for {city}.', 'warning')
             return redirect(url_for('weather.show_weather'))
 
         # Update weather entry with all new data
-        cursor.execute(
-            '''UPDATE weather
-               SET temperature = %s, feels_like = %s, humidity = %s, description = %s,
-                   icon = %s, wind_speed = %s, temp_min = %s, temp_max = %s, updated_at = CURRENT_TIMESTAMP
-               WHERE id = %s''',
-            (weather_data['temperature'], weather_data['feels_like'], weather_data['humidity'],
-             weather_data['description'], weather_data['icon'], weather_data['wind_speed'],
-             weather_data['temp_min'], weather_data['temp_max'], weather_id)
-        )
-        g.db.commit()
+        save_weather(cursor, city, state, weather_data)
+        commit_db()
         flash(f'Weather for {weather_entry["city"]} updated: {weather_data["temperature"]}°F - {weather_data["description"]}', 'success')
 
     except Exception as e:
@@ -183,59 +426,119 @@ def update_weather(weather_id):
 @weather.route('/delete/<int:weather_id>')
 def delete_weather(weather_id):
     try:
-        cursor = g.db.cursor()
+        record_deletion(require_db(), 'weather', weather_id)
+        cursor = require_db().cursor()
         cursor.execute('DELETE FROM weather WHERE id = %s', (weather_id,))
-        g.db.commit()
+        commit_db()
         flash('Weather location deleted successfully!', 'success')
     except Exception as e:
         flash(f'Error deleting weather location: {str(e)}', 'error')
 
     return redirect(url_for('weather.show_weather'))
 
+# Job handler: runs in worker.py, not inside the HTTP request
+def refresh_all_weather(db, payload, progress):
+    """Update every weather location with live data from the API, reporting progress.
+
+    Locations with a cached OpenWeatherMap city id are refreshed up to
+    WEATHER_GROUP_SIZE at a time with the group endpoint. Locations without an
+    id, or any batch the group endpoint can't serve, fall back to one request
+    per distinct (city, state), which also caches the id for next time.
+    """
+    cursor = db.cursor()
+    prepare_weather_table(cursor)  # tables from earlier versions have no owm_id yet
+    db.commit()
+    cursor.execute('SELECT city, state, MAX(owm_id) AS owm_id FROM weather GROUP BY city, state')
+    all_weather = cursor.fetchall()
+
+    updated_count = 0
+    failed_count = 0
+    done_count = 0
+
+    def save(location, weather_data):
+        save_weather(cursor, location['city'], location['state'], weather_data)
+        db.commit()
+
+    # Batched refresh for locations whose city id is already cached
+    with_id = [location for location in all_weather if location['owm_id']]
+    per_city = [location for location in all_weather if not location['owm_id']]
+
+    for start in range(0, len(with_id), WEATHER_GROUP_SIZE):
+        batch = with_id[start:start + WEATHER_GROUP_SIZE]
+        results, error = get_weather_group([location['owm_id'] for location in batch])
+
+        if results is None:
+            per_city.extend(batch)
+            continue
+
+        for location in batch:
+            weather_data = results.get(location['owm_id'])
+            if weather_data:
+                save(location, weather_data)
+                updated_count += 1
+            else:
+                failed_count += 1
+
+        done_count += len(batch)
+        progress(done_count, len(all_weather))
+
+    # One request per remaining location
+    for location in per_city:
+        weather_data, error = get_weather_data(location['city'], location['state'], location['owm_id'])
+
+        if error:
+            failed_count += 1
+        else:
+            save(location, weather_data)
+            updated_count += 1
+
+        done_count += 1
+        progress(done_count, len(all_weather))
+
+    # Nothing succeeded (API down or rate limited): fail so the job is retried later
+    if failed_count and not updated_count:
+        raise RuntimeError(f'Failed to update all {failed_count} location(s)')
+
+    return {'updated': updated_count, 'failed': failed_count}
+
+register_job_handler('update_all_weather', refresh_all_weather)
+
 @weather.route('/update-all')
 def update_all_weather():
-    """Update all weather locations with live data from API"""
+    """Queue a background job that updates all weather locations with live data"""
     try:
-        cursor = g.db.cursor()
-        cursor.execute('SELECT * FROM weather')
-        all_weather = cursor.fetchall()
+        cursor = require_db().cursor()
+        cursor.execute('SELECT id FROM weather LIMIT 1')
 
-        if not all_weather:
+        if not cursor.fetchone():
             flash('No locations to update', 'warning')
             return redirect(url_for('weather.show_weather'))
 
-        updated_count = 0
-        failed_count = 0
+        job_id = enqueue_job(require_db(), 'update_all_weather')
+        flash(f'Update queued as job #{job_id}. Locations will refresh in the background.', 'info')
+        return redirect(url_for('weather.show_weather', job=job_id))
 
-        for location in all_weather:
-            weather_data, error = get_weather_data(location['city'], location.get('state', ''))
+    except Exception as e:
+        flash(f'Error queuing weather update: {str(e)}', 'error')
 
-            if error:
-                failed_count += 1
-                continue
+    return redirect(url_for('weather.show_weather'))
 
-            cursor.execute(
-                '''UPDATE weather
-                   SET temperature = %s, feels_like = %s, humidity = %s, description = %s,
-                       icon = %s, wind_speed = %s, temp_min = %s, temp_max = %s, updated_at = CURRENT_TIMESTAMP
-                   WHERE id = %s''',
-                (weather_data['temperature'], weather_data['feels_like'], weather_data['humidity'],
-                 weather_data['description'], weather_data['icon'], weather_data['wind_speed'],
-                 weather_data['temp_min'], weather_data['temp_max'], location['id'])
-            )
-            updated_count += 1
+# Live updates: rows whose updated_at moved are pushed to /weather/stream
+register_stream('weather', 'SELECT * FROM weather WHERE updated_at >= %s ORDER BY updated_at', 'updated_at')
 
-        g.db.commit()
+@weather.route('/stream')
+def stream_weather():
+    """Server-Sent Events stream of weather rows as they are updated"""
+    return Response(stream_events('weather'), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-        if updated_count > 0:
-            flash(f'Successfully updated {updated_count} location(s)', 'success')
-        if failed_count > 0:
-            flash(f'Failed to update {failed_count} location(s)', 'warning')
+# Streaming export: /weather/export?format=csv|jsonl|parquet&since=<ISO timestamp>
+register_export('weather', 'weather', 'updated_at')
 
-    except Exception as e:
-        flash(f'Error updating weather locations: {str(e)}', 'error')
-
-    return redirect(url_for('weather.show_weather'))
+@weather.route('/export')
+def export_weather():
+    """Download every weather location (or those updated since=) as CSV, JSON Lines or Parquet"""
+    return export_response('weather', request.args)
 
 @weather.route('/lookup')
 def lookup_weather():
@@ -246,9 +549,51 @@ def lookup_weather():
     if not city:
         return jsonify({'error': 'City is required'}), 400
 
-    weather_data, error = get_weather_data(city, state)
+    # A fresh observation close enough to this location answers without calling the API
+    if request.args.get('nearby') != '0':
+        try:
+            nearby = find_nearby_weather(get_read_db().cursor(), city, state)
+        except Exception as e:
+            print(f"Nearby weather lookup failed: {e}")
+            nearby = None
+        if nearby:
+            return json_response(nearby)
+
+    # Last stored reading for this location, served if the API is down or slow
+    stored = None
+    try:
+        cursor = get_read_db().cursor()
+        cursor.execute(
+            '''SELECT * FROM weather WHERE city = %s AND state = %s
+               ORDER BY updated_at DESC LIMIT 1''',
+            (city, state.upper())
+        )
+        stored = cursor.fetchone()
+    except Exception:
+        pass
+
+    weather_data, error, pending = fetch_or_stale(
+        get_weather_data, (city, state, stored.get('owm_id') if stored else None), has_stale=stored is not None,
+        on_late_result=lambda data: store_weather(stored['city'], stored['state'] or '', data)
+    )
+
+    if stored and (pending or error):
+        return json_response(weather_row_to_data(stored))
 
     if error:
         return jsonify({'error': error}), 400
 
-    return jsonify(weather_data)
+    # Learn where this location is, so the next lookup here or nearby can skip the API
+    if weather_data.get('lat') is not None:
+        try:
+            # A plain commit: caching a location isn't a write this session needs to read back from the
+            # primary, and commit_db() would pin its reads there
+            if save_geocode(require_db().cursor(), city, state, weather_data):
+                require_db().commit()
+        except Exception as e:
+            print(f"Could not cache the location of {city}: {e}")
+    remember_weather(weather_data)
+
+    weather_data['stale'] = False
+    weather_data['nearby'] = False
+    return json_response(weather_data)
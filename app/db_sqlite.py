@@ -0,0 +1,333 @@
+"""Embedded SQLite storage behind the same connection interface as PyMySQL.
+
+Selected with DB_BACKEND=sqlite (a WAL-mode database file at DB_SQLITE_PATH)
+or DB_BACKEND=memory (a process-wide in-memory database, for benchmarks and
+test runs). connect_sqlite() returns a connection exposing the subset of the
+PyMySQL API the app uses: cursor() with dict rows (tuple rows for SSCursor),
+execute/executemany with %s or %(name)s parameters, fetchone/fetchmany/
+fetchall, rowcount, lastrowid, description, commit, rollback, autocommit,
+ping and close.
+
+The blueprints keep writing MySQL. translate_sql() rewrites the MySQL
+dialect they use (AUTO_INCREMENT and inline KEYs in CREATE TABLE,
+ON UPDATE CURRENT_TIMESTAMP, ON DUPLICATE KEY UPDATE, INSERT IGNORE, NOW(),
+INTERVAL arithmetic, TIMESTAMPDIFF, LEAST/GREATEST, TRUNCATE, FOR UPDATE)
+into SQLite once per distinct statement. Connections are pooled, so
+SQLite's per-connection prepared statement cache stays warm across requests.
+"""
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pymysql.cursors
+
+DB_SQLITE_POOL_SIZE = int(os.getenv('DB_SQLITE_POOL_SIZE', 8))
+SQLITE_BUSY_TIMEOUT_SECONDS = 5
+SQLITE_CACHED_STATEMENTS = 256
+MEMORY_DATABASE_URI = 'file:app_memory?mode=memory&cache=shared'
+
+# Idle connections per database target; the in-memory database lives as long as its anchor connection
+_SQLITE_POOLS = {}
+_SQLITE_LOCK = threading.Lock()
+_MEMORY_ANCHOR = {'connection': None}
+
+NOW_SQL = "datetime('now', 'localtime')"
+NOW_PRECISE_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"
+INTERVAL_UNITS = {'MICROSECOND': 'seconds', 'SECOND': 'seconds', 'MINUTE': 'minutes', 'HOUR': 'hours',
+                  'DAY': 'days', 'MONTH': 'months', 'YEAR': 'years'}
+TIMESTAMPDIFF_UNITS = {'MICROSECOND': timedelta(microseconds=1), 'SECOND': timedelta(seconds=1),
+                       'MINUTE': timedelta(minutes=1), 'HOUR': timedelta(hours=1), 'DAY': timedelta(days=1)}
+
+def parse_datetime(value):
+    """SQLite converter for TIMESTAMP/DATETIME columns"""
+    return datetime.fromisoformat(value.decode())
+
+def parse_date(value):
+    """SQLite converter for DATE columns"""
+    return date.fromisoformat(value.decode()[:10])
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_converter('TIMESTAMP', parse_datetime)
+sqlite3.register_converter('DATETIME', parse_datetime)
+sqlite3.register_converter('DATE', parse_date)
+
+def timestampdiff(unit, start, end):
+    """MySQL TIMESTAMPDIFF(unit, start, end) as a SQLite function (whole units, truncated)"""
+    if start is None or end is None:
+        return None
+    delta = datetime.fromisoformat(str(end)) - datetime.fromisoformat(str(start))
+    return int(delta / TIMESTAMPDIFF_UNITS[unit.upper()])
+
+def split_top_level(body, closing=False):
+    """Split a CREATE TABLE body on the commas that separate its columns and constraints.
+
+    With closing=True, body is the text after the opening parenthesis and
+    parsing stops at the matching closing one (table options are ignored).
+    """
+    parts, depth, quote, start = [], 0, None, 0
+    for index, char in enumerate(body):
+        if quote:
+            quote = None if char == quote else quote
+        elif char in "'\"`":
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            if depth == 0 and closing:
+                body = body[:index]
+                break
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(body[start:index].strip())
+            start = index + 1
+    parts.append(body[start:].strip())
+    return [part for part in parts if part]
+
+def translate_create_table(sql):
+    """MySQL CREATE TABLE -> SQLite CREATE TABLE plus CREATE INDEX / trigger statements.
+
+    Inline KEY/INDEX definitions become separate indexes, AUTO_INCREMENT
+    becomes INTEGER PRIMARY KEY AUTOINCREMENT, ON UPDATE CURRENT_TIMESTAMP
+    becomes an AFTER UPDATE trigger, and table options (ENGINE, PARTITION BY)
+    are dropped.
+    """
+    match = re.match(r'\s*CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?`?(\w+)`?\s*\(', sql, re.I)
+    if match is None:
+        return [sql]
+    if_not_exists, table = match.group(1) or '', match.group(2)
+    body = split_top_level(sql[match.end():], closing=True)
+
+    parts = [re.sub(r'\b(?:BIG|SMALL|TINY|MEDIUM)?INT\b(?:\s+UNSIGNED)?(?:\s+NOT\s+NULL)?\s+AUTO_INCREMENT'
+                    r'(?:\s+PRIMARY\s+KEY)?', 'INTEGER PRIMARY KEY AUTOINCREMENT', part, flags=re.I)
+             for part in body]
+    has_autoincrement = any('AUTOINCREMENT' in part for part in parts)
+
+    definitions, extra = [], []
+    for part in parts:
+        index = re.match(r'(UNIQUE\s+)?(?:KEY|INDEX)\s+`?(\w+)`?\s*\((.*)\)$', part, re.S | re.I)
+        if index:
+            extra.append(f"CREATE {'UNIQUE ' if index.group(1) else ''}INDEX IF NOT EXISTS {index.group(2)} "
+                         f"ON {table} ({index.group(3)})")
+            continue
+        if has_autoincrement and re.match(r'PRIMARY\s+KEY\s*\(', part, re.I):
+            continue  # the AUTOINCREMENT column is the key; SQLite allows only one
+        if re.search(r'\s+ON\s+UPDATE\s+CURRENT_TIMESTAMP', part, re.I):
+            part = re.sub(r'\s+ON\s+UPDATE\s+CURRENT_TIMESTAMP(\(\d?\))?', '', part, flags=re.I)
+            column = part.split()[0].strip('`')
+            extra.append(f'''CREATE TRIGGER IF NOT EXISTS {table}_{column}_on_update AFTER UPDATE ON {table}
+                             FOR EACH ROW WHEN NEW.{column} IS OLD.{column}
+                             BEGIN UPDATE {table} SET {column} = {NOW_SQL} WHERE rowid = NEW.rowid; END''')
+        definitions.append(part)
+
+    create = f"CREATE TABLE {if_not_exists}{table} (\n    " + ',\n    '.join(definitions) + '\n)'
+    return [create] + extra
+
+@functools.lru_cache(maxsize=512)
+def translate_sql(sql, paramstyle):
+    """Rewrite one MySQL statement for SQLite.
+
+    paramstyle is None (no parameters), 'format' (%s) or 'pyformat'
+    (%(name)s). Returns (statements, lock, upsert): statements is empty for
+    MySQL session settings that have no SQLite equivalent, lock is True for
+    SELECT ... FOR UPDATE, which must run in an immediate transaction, and
+    upsert is None except for INSERT ... ON DUPLICATE KEY UPDATE, where it is
+    (the insert with ON CONFLICT DO NOTHING, number of ? in the update clause).
+    """
+    if re.match(r'\s*SET\s+(SESSION|GLOBAL|@@)', sql, re.I):
+        return (), False, None
+
+    # Placeholders first, so the %-formats introduced below aren't mistaken for parameters
+    if paramstyle == 'pyformat':
+        sql = re.sub(r'%\((\w+)\)s', r':\1', sql)
+    elif paramstyle == 'format':
+        sql = sql.replace('%s', '?')
+    if paramstyle:
+        sql = sql.replace('%%', '%')
+
+    sql, lock = re.subn(r'\s+FOR\s+UPDATE(\s+SKIP\s+LOCKED|\s+NOWAIT)?', '', sql, flags=re.I)
+    sql = re.sub(r'^\s*TRUNCATE\s+(TABLE\s+)?', 'DELETE FROM ', sql, flags=re.I)
+    sql = re.sub(r'^\s*EXPLAIN\s+', 'EXPLAIN QUERY PLAN ', sql, flags=re.I)
+    sql = re.sub(r'\bINSERT\s+IGNORE\b', 'INSERT OR IGNORE', sql, flags=re.I)
+    upsert = re.search(r'\bON\s+DUPLICATE\s+KEY\s+UPDATE\b', sql, re.I)
+    if upsert:
+        sql = (sql[:upsert.start()] + 'ON CONFLICT DO UPDATE SET'
+               + re.sub(r'\bVALUES\((\w+)\)', r'excluded.\1', sql[upsert.end():], flags=re.I))
+
+    # Date and time functions. NOW()/CURDATE() selected under an alias keep their type via PARSE_COLNAMES.
+    sql = re.sub(r'\b(NOW\(\d?\))\s+AS\s+(\w+)', r'\1 AS "\2 [timestamp]"', sql, flags=re.I)
+    sql = re.sub(r'\b(CURDATE\(\))\s+AS\s+(\w+)', r'\1 AS "\2 [date]"', sql, flags=re.I)
+    sql = re.sub(r'\bNOW\(\d?\)\s*([+-])\s*INTERVAL\s+(\?|:\w+|\d+)\s+(\w+)',
+                 lambda match: f"datetime('now', 'localtime', '{match.group(1)}' || {match.group(2)} || "
+                               f"' {INTERVAL_UNITS[match.group(3).upper()]}')",
+                 sql, flags=re.I)
+    sql = re.sub(r'\bNOW\([1-6]\)', NOW_PRECISE_SQL, sql, flags=re.I)
+    sql = re.sub(r'\bNOW\(\)', NOW_SQL, sql, flags=re.I)
+    sql = re.sub(r'\bCURDATE\(\)', "date('now', 'localtime')", sql, flags=re.I)
+    sql = re.sub(r'\bTIMESTAMPDIFF\(\s*(\w+)\s*,', r"TIMESTAMPDIFF('\1',", sql, flags=re.I)
+    sql = re.sub(r'\bLEAST\(', 'MIN(', sql, flags=re.I)
+    sql = re.sub(r'\bGREATEST\(', 'MAX(', sql, flags=re.I)
+
+    statements = translate_create_table(sql) if re.match(r'\s*CREATE\s+TABLE\b', sql, re.I) else [sql]
+    statements = tuple(re.sub(r'\bCURRENT_TIMESTAMP\b(\(\d?\))?', f'({NOW_SQL})', statement, flags=re.I)
+                       if not statement.lstrip().upper().startswith('CREATE TRIGGER') else statement
+                       for statement in statements)
+    if upsert:
+        insert, update = statements[0].split('ON CONFLICT DO UPDATE SET', 1)
+        upsert = (insert + 'ON CONFLICT DO NOTHING', update.count('?'))
+    return statements, bool(lock), upsert
+
+def _paramstyle(args):
+    """Parameter style of a PyMySQL-style args value, and the value SQLite expects"""
+    if args is None:
+        return None, ()
+    if isinstance(args, dict):
+        return 'pyformat', args
+    if isinstance(args, (tuple, list)):
+        return 'format', tuple(args)
+    return 'format', (args,)
+
+def _dict_row(cursor, row):
+    """row_factory matching PyMySQL's DictCursor"""
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+def _retry_locked(run):
+    """Run a statement, retrying while a shared-cache (in-memory) table is locked by another connection.
+
+    File databases wait in SQLite's busy handler instead; shared-cache
+    table locks bypass it and fail immediately.
+    """
+    deadline = time.monotonic() + SQLITE_BUSY_TIMEOUT_SECONDS
+    while True:
+        try:
+            return run()
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or time.monotonic() > deadline:
+                raise
+            time.sleep(0.005)
+
+def _wrap_cursor(connection, raw_connection, dict_rows):
+    """PyMySQL-like cursor over a sqlite3 cursor"""
+    raw = raw_connection.cursor()
+    raw.row_factory = _dict_row if dict_rows else None
+    cursor = SimpleNamespace(connection=connection, description=None, rowcount=-1, lastrowid=None,
+                             fetchone=raw.fetchone, fetchall=raw.fetchall, close=raw.close)
+
+    def run(method, sql, args, many=False):
+        if many:
+            args = list(args)
+            paramstyle = _paramstyle(args[0])[0] if args else None
+            params = [_paramstyle(row)[1] for row in args]
+        else:
+            paramstyle, params = _paramstyle(args)
+        statements, lock, upsert = translate_sql(sql, paramstyle)
+        if not statements:
+            return 0
+        # Like MySQL, CREATE TABLE IF NOT EXISTS leaves the unique keys of an existing table alone:
+        # adding one can fail on old duplicates, so app.functions.upgrade_table does it when it's safe
+        create = re.match(r'CREATE\s+TABLE\s+IF\s+NOT\s+EXISTS\s+(\w+)', statements[0], re.I)
+        existed = create is not None and len(statements) > 1 and raw_connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (create.group(1),)).fetchone() is not None
+        if lock and not raw_connection.in_transaction and raw_connection.isolation_level is not None:
+            _retry_locked(lambda: raw_connection.execute('BEGIN IMMEDIATE'))
+        if upsert and not many:
+            # Try a plain insert first so an insert reports 1 row and an update 2, like MySQL
+            insert, update_params = upsert
+            insert_params = params[:len(params) - update_params] if paramstyle == 'format' else params
+            _retry_locked(lambda: method(insert, insert_params))
+            inserted = raw.rowcount == 1
+        else:
+            inserted = False
+
+        if not inserted:
+            _retry_locked(lambda: method(statements[0], params))
+        cursor.description, cursor.rowcount, cursor.lastrowid = raw.description, raw.rowcount, raw.lastrowid
+        if upsert and not many and not inserted and cursor.rowcount == 1:
+            cursor.rowcount = 2  # the upsert updated an existing row; MySQL reports that as 2 affected rows
+        for statement in statements[1:]:
+            if existed and statement.startswith('CREATE UNIQUE INDEX'):
+                continue
+            _retry_locked(lambda: raw_connection.execute(statement))
+        return max(cursor.rowcount, 0)
+
+    def execute(query, args=None):
+        """Run one statement; returns the affected row count like PyMySQL"""
+        return run(raw.execute, query, args)
+
+    def executemany(query, args):
+        """Run one statement for each parameter set"""
+        return run(raw.executemany, query, args, many=True)
+
+    def fetchmany(size=None):
+        return raw.fetchmany(size or raw.arraysize)
+
+    cursor.execute, cursor.executemany, cursor.fetchmany = execute, executemany, fetchmany
+    return cursor
+
+def _open_raw(target):
+    """Open and configure a sqlite3 connection for target (a file path or the in-memory URI)"""
+    raw = sqlite3.connect(target, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, uri=target.startswith('file:'),
+                          detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                          cached_statements=SQLITE_CACHED_STATEMENTS, check_same_thread=False)
+    raw.create_function('TIMESTAMPDIFF', 3, timestampdiff, deterministic=True)
+    if target == MEMORY_DATABASE_URI:
+        raw.execute('PRAGMA read_uncommitted = 1')  # fewer shared-cache table locks between connections
+    else:
+        raw.execute('PRAGMA journal_mode = WAL')  # readers don't block the writer (or each other)
+        raw.execute('PRAGMA synchronous = NORMAL')  # durable at checkpoints; safe with WAL
+    return raw
+
+def connect_sqlite(memory=False):
+    """Connection to the embedded database, reusing an idle pooled one when available"""
+    target = MEMORY_DATABASE_URI if memory else os.getenv('DB_SQLITE_PATH', 'app.sqlite3')
+    with _SQLITE_LOCK:
+        if memory and _MEMORY_ANCHOR['connection'] is None:
+            _MEMORY_ANCHOR['connection'] = _open_raw(target)
+        pool = _SQLITE_POOLS.setdefault(target, [])
+        raw = pool.pop() if pool else None
+    if raw is None:
+        raw = _open_raw(target)
+
+    connection = SimpleNamespace(open=True, _closed=False)
+
+    def cursor(cursorclass=None):
+        """Dict rows by default, like the app's DictCursor; tuples for SSCursor and plain Cursor"""
+        dict_rows = cursorclass is None or issubclass(cursorclass, pymysql.cursors.DictCursorMixin)
+        return _wrap_cursor(connection, raw, dict_rows)
+
+    def autocommit(value):
+        raw.isolation_level = None if value else ''
+
+    def ping(reconnect=True):
+        if connection._closed:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return True
+
+    def close():
+        """Roll back anything uncommitted and return the connection to the pool"""
+        if connection._closed:
+            return
+        connection.open, connection._closed = False, True
+        try:
+            raw.rollback()
+            raw.isolation_level = ''
+        except sqlite3.Error:
+            raw.close()
+            return
+        with _SQLITE_LOCK:
+            pool = _SQLITE_POOLS.setdefault(target, [])
+            if len(pool) < DB_SQLITE_POOL_SIZE:
+                pool.append(raw)
+                return
+        raw.close()
+
+    connection.cursor, connection.autocommit, connection.ping, connection.close = cursor, autocommit, ping, close
+    connection.commit, connection.rollback = raw.commit, raw.rollback
+    return connection
@@ -1 +1,1751 @@
 # Function will go in here for the entire site to use
+import _thread
+import csv
+import gzip
+import hashlib
+import importlib.util
+import io
+import itertools
+import json
+import math
+import os
+import queue
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout,
+                                wait as wait_futures)
+from datetime import datetime
+
+import pymysql.cursors
+import requests
+from flask import Response, current_app, g, jsonify, render_template, request
+from pymysql.constants import FIELD_TYPE
+
+from app.db_connect import DB_ERRORS, DB_INTEGRITY_ERRORS, connect_db, db_backend, get_db
+
+# ---------------------------------------------------------------------------
+# Background job queue
+#
+# Long-running work (refreshing every ticker or weather location) is stored as
+# a row in the `jobs` table and executed by worker.py instead of inside the
+# HTTP request. Workers claim rows with SELECT ... FOR UPDATE SKIP LOCKED so
+# several workers can share one queue without double-running a job.
+# ---------------------------------------------------------------------------
+
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_BASE_SECONDS = int(os.getenv('JOB_RETRY_BASE_SECONDS', 30))
+JOB_RETRY_MAX_SECONDS = 3600
+JOB_STALE_LOCK_SECONDS = int(os.getenv('JOB_STALE_LOCK_SECONDS', 600))
+JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', 2))
+
+CREATE_JOBS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        job_type VARCHAR(50) NOT NULL,
+        payload TEXT,
+        status VARCHAR(20) NOT NULL DEFAULT 'queued',
+        attempts INT NOT NULL DEFAULT 0,
+        max_attempts INT NOT NULL DEFAULT 3,
+        progress INT NOT NULL DEFAULT 0,
+        progress_total INT NOT NULL DEFAULT 0,
+        result TEXT,
+        last_error TEXT,
+        run_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        locked_at DATETIME NULL,
+        active_key CHAR(40) NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        INDEX idx_jobs_claim (status, run_at),
+        UNIQUE KEY uq_jobs_active (active_key)
+    )
+'''
+
+_JOBS_STATE = {'table_ready': False, 'inline_worker': None}
+_JOBS_LOCK = threading.Lock()
+
+# job_type -> handler(db, payload, progress) registered by the blueprints
+JOB_HANDLERS = {}
+
+# name -> {'every': seconds, 'task': task(db), 'next_at': monotonic time} run by the worker loop
+PERIODIC_TASKS = {}
+
+def register_job_handler(job_type, handler):
+    """Register the function the worker runs for a job type.
+
+    The handler is called as handler(db, payload, progress) where progress is a
+    callback progress(done, total). Its return value is stored as the job result;
+    raising an exception marks the attempt as failed and schedules a retry.
+    """
+    JOB_HANDLERS[job_type] = handler
+
+def prepare_jobs_table(db):
+    """Create the jobs table, adding the active_key column to tables from before it existed"""
+    if _JOBS_STATE['table_ready']:
+        return
+    cursor = db.cursor()
+    cursor.execute(CREATE_JOBS_TABLE)
+    if db_backend() == 'mysql':
+        cursor.execute("SHOW COLUMNS FROM jobs LIKE 'active_key'")
+        if cursor.fetchone() is None:
+            cursor.execute('ALTER TABLE jobs ADD COLUMN active_key CHAR(40) NULL, '
+                           'ADD UNIQUE KEY uq_jobs_active (active_key)')
+    db.commit()
+    _JOBS_STATE['table_ready'] = True
+
+def register_periodic_task(name, every_seconds, task):
+    """Have the worker run task(db) when it starts and then every every_seconds.
+
+    For housekeeping that must not run inside HTTP requests. Every worker
+    process runs it, so the task must be safe to repeat.
+    """
+    PERIODIC_TASKS[name] = {'every': every_seconds, 'task': task, 'next_at': 0.0}
+
+def run_periodic_tasks(db):
+    """Run the periodic tasks that are due; a failing task is logged and retried on schedule"""
+    now = time.monotonic()
+    for name, entry in PERIODIC_TASKS.items():
+        if now < entry['next_at']:
+            continue
+        entry['next_at'] = now + entry['every']
+        try:
+            entry['task'](db)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Periodic task {name} failed: {e}")
+
+def enqueue_job(db, job_type, payload=None, delay_seconds=0):
+    """Queue a job that may run delay_seconds from now and return its id.
+
+    If a job of the same type with the same payload is already queued or running
+    its id is returned instead, so repeated clicks don't pile up duplicate work.
+    Active jobs carry a unique active_key (cleared when they finish or give up),
+    so concurrent requests can't both insert one.
+    """
+    payload_json = json.dumps(payload or {}, sort_keys=True)
+    active_key = hashlib.sha1(f'{job_type}:{payload_json}'.encode()).hexdigest()
+    prepare_jobs_table(db)
+    cursor = db.cursor()
+    while True:
+        cursor.execute(
+            '''INSERT IGNORE INTO jobs (job_type, payload, max_attempts, active_key, run_at)
+               VALUES (%s, %s, %s, %s, NOW() + INTERVAL %s SECOND)''',
+            (job_type, payload_json, JOB_MAX_ATTEMPTS, active_key, delay_seconds)
+        )
+        if cursor.rowcount:
+            db.commit()
+            if db_backend() == 'memory':
+                start_inline_worker()
+            return cursor.lastrowid
+
+        cursor.execute('SELECT id FROM jobs WHERE active_key = %s', (active_key,))
+        existing = cursor.fetchone()
+        db.commit()
+        if existing:
+            return existing['id']
+        # The duplicate finished between the two statements; insert again
+
+def start_inline_worker():
+    """Run the worker loop on a thread of this process (once).
+
+    Used with DB_BACKEND=memory, whose database exists only inside the web
+    process, so worker.py could never see the queued jobs.
+    """
+    with _JOBS_LOCK:
+        if _JOBS_STATE['inline_worker'] is not None:
+            return
+        app = current_app._get_current_object()
+
+        def work():
+            with app.app_context():
+                run_worker(connect_db)
+
+        _JOBS_STATE['inline_worker'] = threading.Thread(target=work, name='inline-worker', daemon=True)
+        _JOBS_STATE['inline_worker'].start()
+
+def get_job(db, job_id):
+    """Return the jobs row for job_id as a dict, or None"""
+    cursor = db.cursor()
+    cursor.execute('SELECT * FROM jobs WHERE id = %s', (job_id,))
+    return cursor.fetchone()
+
+def claim_job(db):
+    """Atomically claim the next runnable job, or return None.
+
+    Queued jobs whose run_at has passed are eligible, as are running jobs whose
+    lock is older than JOB_STALE_LOCK_SECONDS (their worker died mid-run).
+    SKIP LOCKED lets concurrent workers pass over rows another worker is claiming.
+    """
+    cursor = db.cursor()
+    try:
+        cursor.execute(
+            '''SELECT * FROM jobs
+               WHERE (status = 'queued' AND run_at <= NOW())
+                  OR (status = 'running' AND locked_at < NOW() - INTERVAL %s SECOND)
+               ORDER BY run_at, id
+               LIMIT 1
+               FOR UPDATE SKIP LOCKED''',
+            (JOB_STALE_LOCK_SECONDS,)
+        )
+        job = cursor.fetchone()
+        if not job:
+            db.commit()
+            return None
+
+        cursor.execute(
+            '''UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_at = NOW()
+               WHERE id = %s''',
+            (job['id'],)
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    job['attempts'] += 1
+    return job
+
+def report_job_progress(db, job_id, done, total):
+    """Record how far a running job has got (polled by the /jobs/<id> endpoint)"""
+    cursor = db.cursor()
+    cursor.execute(
+        'UPDATE jobs SET progress = %s, progress_total = %s, locked_at = NOW() WHERE id = %s',
+        (done, total, job_id)
+    )
+    db.commit()
+
+def finish_job(db, job_id, result):
+    """Mark a job as done and store its JSON-encoded result"""
+    cursor = db.cursor()
+    cursor.execute(
+        '''UPDATE jobs SET status = 'done', result = %s, last_error = NULL, locked_at = NULL,
+               active_key = NULL
+           WHERE id = %s''',
+        (json.dumps(result, default=str), job_id)
+    )
+    db.commit()
+
+def fail_job(db, job, error):
+    """Record a failed attempt; requeue with exponential backoff or give up"""
+    cursor = db.cursor()
+    if job['attempts'] < job['max_attempts']:
+        delay = min(JOB_RETRY_BASE_SECONDS * 2 ** (job['attempts'] - 1), JOB_RETRY_MAX_SECONDS)
+        cursor.execute(
+            '''UPDATE jobs SET status = 'queued', last_error = %s, locked_at = NULL,
+                   run_at = NOW() + INTERVAL %s SECOND
+               WHERE id = %s''',
+            (error, delay, job['id'])
+        )
+    else:
+        cursor.execute(
+            '''UPDATE jobs SET status = 'failed', last_error = %s, locked_at = NULL, active_key = NULL
+               WHERE id = %s''',
+            (error, job['id'])
+        )
+    db.commit()
+
+def run_next_job(db):
+    """Claim and execute one job. Returns True if a job was run."""
+    job = claim_job(db)
+    if not job:
+        return False
+
+    handler = JOB_HANDLERS.get(job['job_type'])
+    if handler is None:
+        fail_job(db, dict(job, attempts=job['max_attempts']), f"Unknown job type: {job['job_type']}")
+        return True
+
+    def progress(done, total):
+        report_job_progress(db, job['id'], done, total)
+
+    try:
+        result = handler(db, json.loads(job['payload'] or '{}'), progress)
+    except Exception as e:
+        db.rollback()
+        print(f"Job {job['id']} ({job['job_type']}) attempt {job['attempts']} failed: {e}")
+        fail_job(db, job, str(e))
+        return True
+
+    finish_job(db, job['id'], result)
+    return True
+
+def run_worker(connect, poll_seconds=JOB_POLL_SECONDS):
+    """Worker loop: run jobs (and due periodic tasks) until interrupted, sleeping when the queue is empty.
+
+    connect is a zero-argument function returning a new database connection;
+    the loop reconnects with it whenever the connection is lost.
+    """
+    db = None
+    while True:
+        try:
+            if db is None:
+                db = connect()
+                prepare_jobs_table(db)
+                print("Worker connected, waiting for jobs.")
+            run_periodic_tasks(db)
+            if not run_next_job(db):
+                time.sleep(poll_seconds)
+        except KeyboardInterrupt:
+            break
+        except Exception as e:
+            print(f"Worker error: {e}")
+            if db is not None:
+                try:
+                    db.close()
+                except Exception:
+                    pass
+            db = None
+            time.sleep(poll_seconds)
+
+    if db is not None:
+        db.close()
+
+
+# ---------------------------------------------------------------------------
+# Tables from earlier versions
+#
+# CREATE TABLE IF NOT EXISTS leaves an existing table as it was, so a table
+# made before a column or unique key was introduced is brought up to date the
+# first time a process writes to it. Nullable columns are added directly. A
+# unique key can't be added while the table holds duplicates; removing those
+# is left to `python fix_database_schema.py --migrate`.
+# ---------------------------------------------------------------------------
+
+_UPGRADED_TABLES = set()
+
+def table_columns(cursor, table):
+    """Lowercased column names of table"""
+    cursor.execute(f'SELECT * FROM {table} LIMIT 0')
+    cursor.fetchall()
+    return {column[0].lower() for column in cursor.description}
+
+def index_exists(cursor, table, index_name):
+    """True if table has an index called index_name"""
+    if db_backend() == 'mysql':
+        cursor.execute(f'SHOW INDEX FROM {table} WHERE Key_name = %s', (index_name,))
+    else:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s",
+                       (table, index_name))
+    return bool(cursor.fetchall())
+
+def upgrade_table(cursor, table, columns=(), unique_keys=()):
+    """Add the columns and unique keys an older table is missing (checked once per process).
+
+    columns is [(name, definition)] and unique_keys is [(index name, 'column, ...')].
+    Returns False if a unique key can't be added because the table holds
+    duplicates; callers relying on the key should then refuse the write.
+    """
+    if table in _UPGRADED_TABLES:
+        return True
+
+    existing = table_columns(cursor, table)
+    for name, definition in columns:
+        if name in existing:
+            continue
+        try:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+            print(f"Added {table}.{name} to a table from an earlier version")
+        except DB_ERRORS:
+            if name not in table_columns(cursor, table):  # not just added by another process
+                raise
+
+    for index_name, key_columns in unique_keys:
+        if index_exists(cursor, table, index_name):
+            continue
+        try:
+            cursor.execute(f'CREATE UNIQUE INDEX {index_name} ON {table} ({key_columns})')
+            print(f"Added unique key {index_name} to {table}")
+        except DB_INTEGRITY_ERRORS as e:
+            print(f"Can't add unique key {index_name} to {table} while it holds duplicates: {e}")
+            return False
+        except DB_ERRORS:
+            if not index_exists(cursor, table, index_name):
+                raise
+
+    _UPGRADED_TABLES.add(table)
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Upstream API protection (Alpha Vantage, OpenWeatherMap, OMDB)
+#
+# Each upstream has a circuit breaker. After BREAKER_FAILURE_THRESHOLD
+# consecutive failures (errors, 5xx/429 responses or calls slower than
+# BREAKER_SLOW_SECONDS) the breaker opens and calls fail immediately. After
+# BREAKER_COOLDOWN_SECONDS one half-open probe is let through; its outcome
+# closes or re-opens the breaker.
+#
+# fetch_or_stale() lets routes that already hold a stored row answer from it
+# when the upstream is down or slow, finishing the refresh in the background.
+#
+# Hedged requests (upstreams listed in HEDGE_UPSTREAMS): if a GET hasn't
+# answered within that upstream's recent p95 latency, an identical second GET
+# goes out and whichever answers first wins; the other is cancelled if it
+# hasn't started, otherwise its response is discarded when it lands. Hedges
+# spend from a per-process budget that grows by HEDGE_BUDGET_PERCENT of each
+# eligible call, so they add at most that share of extra upstream traffic.
+# ---------------------------------------------------------------------------
+
+UPSTREAM_TIMEOUT_SECONDS = 10
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 3))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv('BREAKER_COOLDOWN_SECONDS', 30))
+BREAKER_SLOW_SECONDS = float(os.getenv('BREAKER_SLOW_SECONDS', 3))
+STALE_WAIT_SECONDS = float(os.getenv('STALE_WAIT_MS', 50)) / 1000
+
+HEDGE_UPSTREAMS = {name.strip() for name in os.getenv('HEDGE_UPSTREAMS', 'omdb,openweathermap').split(',')
+                   if name.strip()}
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 95))
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv('HEDGE_MIN_DELAY_MS', 50)) / 1000
+HEDGE_BUDGET_PERCENT = float(os.getenv('HEDGE_BUDGET_PERCENT', 5))
+HEDGE_BUDGET_BURST = 5
+HEDGE_MIN_SAMPLES = 20
+HEDGE_LATENCY_WINDOW = 200
+
+_BREAKERS = {}
+_BREAKER_LOCK = threading.Lock()
+_UPSTREAM_POOL = ThreadPoolExecutor(max_workers=int(os.getenv('UPSTREAM_POOL_SIZE', 8)),
+                                    thread_name_prefix='upstream')
+
+# Recent successful call latencies per upstream, and the hedge budget shared by all upstreams.
+# Hedged calls run on their own pool: fetches already running on _UPSTREAM_POOL wait on them.
+_UPSTREAM_LATENCIES = {}
+_HEDGE_BUDGET = {'tokens': float(HEDGE_BUDGET_BURST)}
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=int(os.getenv('HEDGE_POOL_SIZE', 16)), thread_name_prefix='hedge')
+
+def _get_breaker(upstream):
+    """Return the mutable breaker state for upstream (caller holds _BREAKER_LOCK)"""
+    return _BREAKERS.setdefault(upstream, {'state': 'closed', 'failures': 0, 'opened_at': 0.0, 'probing': False})
+
+def breaker_allows(upstream):
+    """Return True if a call to upstream may go out now.
+
+    Closed breakers always allow. Open breakers refuse until the cooldown has
+    passed, then switch to half-open and allow a single probe at a time.
+    """
+    with _BREAKER_LOCK:
+        breaker = _get_breaker(upstream)
+        if breaker['state'] == 'closed':
+            return True
+        if breaker['state'] == 'open' and time.monotonic() - breaker['opened_at'] >= BREAKER_COOLDOWN_SECONDS:
+            breaker['state'] = 'half_open'
+            breaker['probing'] = False
+        if breaker['state'] == 'half_open' and not breaker['probing']:
+            breaker['probing'] = True
+            return True
+        return False
+
+def record_upstream_result(upstream, ok, elapsed):
+    """Feed one call outcome into upstream's breaker; slow successes count as failures"""
+    with _BREAKER_LOCK:
+        breaker = _get_breaker(upstream)
+        if ok and elapsed < BREAKER_SLOW_SECONDS:
+            breaker.update(state='closed', failures=0, probing=False)
+            return
+
+        breaker['failures'] += 1
+        if breaker['state'] == 'half_open' or breaker['failures'] >= BREAKER_FAILURE_THRESHOLD:
+            if breaker['state'] != 'open':
+                print(f"Circuit breaker for {upstream} opened after {breaker['failures']} failure(s)")
+            breaker.update(state='open', opened_at=time.monotonic(), probing=False)
+
+def hedge_delay(upstream):
+    """Seconds to wait before hedging a call to upstream, or None to not hedge it.
+
+    The delay is the HEDGE_PERCENTILE latency of recent successful calls (at
+    least HEDGE_MIN_DELAY_MS). Calls aren't hedged while the breaker isn't
+    closed or before HEDGE_MIN_SAMPLES latencies have been seen.
+    """
+    if upstream not in HEDGE_UPSTREAMS:
+        return None
+    with _BREAKER_LOCK:
+        if _get_breaker(upstream)['state'] != 'closed':
+            return None
+        samples = sorted(_UPSTREAM_LATENCIES.get(upstream, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    index = min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE / 100))
+    return max(HEDGE_MIN_DELAY_SECONDS, samples[index])
+
+def take_hedge_token():
+    """Spend one unit of the global hedge budget; False when it is used up"""
+    with _BREAKER_LOCK:
+        if _HEDGE_BUDGET['tokens'] < 1:
+            return False
+        _HEDGE_BUDGET['tokens'] -= 1
+        return True
+
+def _timed_get(url, timeout):
+    """requests.get returning (response, seconds taken)"""
+    started = time.monotonic()
+    response = requests.get(url, timeout=timeout)
+    return response, time.monotonic() - started
+
+def _discard_response(future):
+    """Done-callback for a losing hedge attempt: release its connection"""
+    if not future.cancelled() and future.exception() is None:
+        future.result()[0].close()
+
+def _hedged_get(url, timeout, delay):
+    """GET url, sending a duplicate if no answer arrives within delay; returns (response, seconds taken).
+
+    The first attempt to answer without a network error wins. If both fail,
+    the first attempt's error is raised.
+    """
+    primary = _HEDGE_POOL.submit(_timed_get, url, timeout)
+    done, _ = wait_futures([primary], timeout=delay)
+    if done or not take_hedge_token():
+        return primary.result()
+
+    attempts = [primary, _HEDGE_POOL.submit(_timed_get, url, timeout)]
+    pending = set(attempts)
+    while pending:
+        done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+        winner = next((future for future in attempts if future in done and future.exception() is None), None)
+        if winner is not None:
+            for loser in pending:
+                if not loser.cancel():
+                    loser.add_done_callback(_discard_response)
+            return winner.result()
+    return primary.result()
+
+def upstream_get(upstream, url, timeout=UPSTREAM_TIMEOUT_SECONDS):
+    """GET url and record the outcome against upstream's circuit breaker.
+
+    Callers check breaker_allows(upstream) first. Network errors are recorded
+    and re-raised; 5xx and 429 responses are recorded as failures and returned.
+    Calls to HEDGE_UPSTREAMS may be hedged (see above).
+    """
+    delay = hedge_delay(upstream)
+    if delay is not None:
+        with _BREAKER_LOCK:
+            _HEDGE_BUDGET['tokens'] = min(HEDGE_BUDGET_BURST, _HEDGE_BUDGET['tokens'] + HEDGE_BUDGET_PERCENT / 100)
+
+    started = time.monotonic()
+    try:
+        if delay is None:
+            response, elapsed = _timed_get(url, timeout)
+        else:
+            response, elapsed = _hedged_get(url, timeout, delay)
+    except requests.RequestException:
+        record_upstream_result(upstream, False, time.monotonic() - started)
+        raise
+
+    ok = response.status_code < 500 and response.status_code != 429
+    record_upstream_result(upstream, ok, time.monotonic() - started)
+    if ok and upstream in HEDGE_UPSTREAMS:
+        # Latency of the attempt that answered, not counting the wait before its hedge was sent
+        with _BREAKER_LOCK:
+            _UPSTREAM_LATENCIES.setdefault(upstream, deque(maxlen=HEDGE_LATENCY_WINDOW)).append(elapsed)
+    return response
+
+def _deliver_late_result(future, on_late_result):
+    """Done-callback: hand fresh data that arrived after the route gave up waiting to on_late_result"""
+    try:
+        data, error = future.result()
+        if data:
+            on_late_result(data)
+    except Exception as e:
+        print(f"Background refresh failed: {e}")
+
+def fetch_or_stale(fetch, args, has_stale, on_late_result):
+    """Call fetch(*args) -> (data, error), bounding the wait when a stale value exists.
+
+    Without a stale value the call runs inline as before. With one, the call
+    runs on the upstream pool and the route waits at most STALE_WAIT_SECONDS.
+    Returns (data, error, pending); pending=True means the caller should serve
+    its stale value, and on_late_result(data) will be called from a background
+    thread when the fetch completes successfully.
+    """
+    if not has_stale:
+        data, error = fetch(*args)
+        return data, error, False
+
+    future = _UPSTREAM_POOL.submit(fetch, *args)
+    try:
+        data, error = future.result(timeout=STALE_WAIT_SECONDS)
+        return data, error, False
+    except FutureTimeout:
+        future.add_done_callback(lambda done: _deliver_late_result(done, on_late_result))
+        return None, None, True
+
+def fetch_all(calls, timeout):
+    """Run [(fetch, args)] concurrently on the upstream pool under one shared deadline.
+
+    Returns one (data, error) pair per call, in order. Calls not started by the
+    deadline are cancelled; calls still running report a timeout error and
+    finish in the background (their outcome still feeds the circuit breaker).
+    """
+    futures = [_UPSTREAM_POOL.submit(fetch, *args) for fetch, args in calls]
+    done, _ = wait_futures(futures, timeout=timeout)
+
+    results = []
+    for future in futures:
+        if future not in done:
+            future.cancel()
+            results.append((None, 'Timed out waiting for the upstream API.'))
+        elif future.exception() is not None:
+            results.append((None, f'Error: {str(future.exception())}'))
+        else:
+            results.append(future.result())
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Upstream API clients
+#
+# One fetch per upstream (Alpha Vantage quotes, OpenWeatherMap current weather,
+# OMDB movies), shared by the blueprint that stores the results and by the
+# batch API. Each returns (data, None) or (None, error message) and goes
+# through the circuit breaker and upstream_get() above.
+# ---------------------------------------------------------------------------
+
+# Helper function to get stock data from Alpha Vantage
+def get_stock_data(symbol):
+    """Fetch stock data from Alpha Vantage API"""
+    api_key = os.getenv('STOCK_API_KEY')
+    if not api_key or api_key == 'your_alpha_vantage_api_key_here':
+        return None, "Stock API key not configured"
+
+    # Fail fast while Alpha Vantage is known to be down
+    if not breaker_allows('alpha_vantage'):
+        return None, "Stock API is temporarily unavailable."
+
+    try:
+        # Get real-time quote
+        url = f'https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={symbol}&apikey={api_key}'
+        response = upstream_get('alpha_vantage', url)
+        data = response.json()
+
+        # Check for API errors
+        if 'Error Message' in data:
+            return None, f"Invalid ticker symbol: {symbol}"
+        elif 'Note' in data:
+            return None, "API rate limit reached. Please try again in a minute."
+        elif 'Global Quote' not in data or not data['Global Quote']:
+            return None, f"No data available for symbol: {symbol}"
+
+        quote = data['Global Quote']
+
+        # Extract relevant data
+        stock_data = {
+            'symbol': quote.get('01. symbol', symbol),
+            'price': float(quote.get('05. price', 0)),
+            'change': float(quote.get('09. change', 0)),
+            'change_percent': quote.get('10. change percent', '0%'),
+            'volume': int(quote.get('06. volume', 0)),
+            'latest_trading_day': quote.get('07. latest trading day', 'N/A')
+        }
+
+        return stock_data, None
+    except requests.Timeout:
+        return None, "API request timed out. Please try again."
+    except Exception as e:
+        return None, f"Error fetching stock data: {str(e)}"
+
+def parse_weather(data, state=''):
+    """Extract our weather fields from an OpenWeatherMap current-weather payload"""
+    return {
+        'city': data['name'],
+        'state': state.upper() if state else '',
+        'temperature': round(data['main']['temp'], 1),
+        'feels_like': round(data['main']['feels_like'], 1),
+        'humidity': data['main']['humidity'],
+        'description': data['weather'][0]['description'].title(),
+        'icon': data['weather'][0]['icon'],
+        'wind_speed': round(data['wind']['speed'], 1),
+        'pressure': data['main']['pressure'],
+        'temp_min': round(data['main']['temp_min'], 1),
+        'temp_max': round(data['main']['temp_max'], 1),
+        'owm_id': data.get('id'),
+        'lat': data.get('coord', {}).get('lat'),
+        'lon': data.get('coord', {}).get('lon')
+    }
+
+# Helper function to get weather data from OpenWeatherMap
+def get_weather_data(city, state='', owm_id=None):
+    """Fetch weather data from OpenWeatherMap API.
+
+    When the location's OpenWeatherMap city id is known it is queried by id,
+    which skips the provider's name geocoding.
+    """
+    api_key = os.getenv('WEATHER_API_KEY')
+    if not api_key or api_key == 'your_openweather_api_key_here':
+        return None, "Weather API key not configured"
+
+    # Fail fast while OpenWeatherMap is known to be down
+    if not breaker_allows('openweathermap'):
+        return None, "Weather API is temporarily unavailable."
+
+    try:
+        # Build query string
+        if owm_id:
+            query = f'id={owm_id}'
+        elif state:
+            query = f'q={city},{state},US'
+        else:
+            query = f'q={city},US'
+
+        # Get current weather
+        url = f'https://api.openweathermap.org/data/2.5/weather?{query}&appid={api_key}&units=imperial'
+        response = upstream_get('openweathermap', url)
+        data = response.json()
+
+        # Check for API errors
+        if response.status_code == 404:
+            return None, f"City not found: {city}"
+        elif response.status_code != 200:
+            error_msg = data.get('message', 'Unknown error')
+            return None, f"API error: {error_msg}"
+
+        return parse_weather(data, state), None
+    except requests.Timeout:
+        return None, "API request timed out. Please try again."
+    except KeyError as e:
+        return None, f"Unexpected API response format: missing {str(e)}"
+    except Exception as e:
+        return None, f"Error fetching weather data: {str(e)}"
+
+# Helper function to get movie data from OMDB API
+def get_movie_data(title, year=None):
+    """Fetch movie data from OMDB API"""
+    api_key = os.getenv('OMDB_API_KEY')
+    if not api_key or api_key == 'your_omdb_api_key_here':
+        return None, "OMDB API key not configured"
+
+    # Fail fast while OMDB is known to be down
+    if not breaker_allows('omdb'):
+        return None, "OMDB API is temporarily unavailable."
+
+    try:
+        # Build URL with optional year parameter
+        url = f'http://www.omdbapi.com/?t={title}&apikey={api_key}'
+        if year:
+            url += f'&y={year}'
+
+        response = upstream_get('omdb', url)
+        data = response.json()
+
+        # Check for API errors
+        if data.get('Response') == 'False':
+            error_msg = data.get('Error', 'Unknown error')
+            return None, f"Movie not found: {error_msg}"
+
+        # Extract relevant data
+        movie_data = {
+            'title': data.get('Title', 'N/A'),
+            'year': data.get('Year', 'N/A'),
+            'rated': data.get('Rated', 'N/A'),
+            'released': data.get('Released', 'N/A'),
+            'runtime': data.get('Runtime', 'N/A'),
+            'genre': data.get('Genre', 'N/A'),
+            'director': data.get('Director', 'N/A'),
+            'writer': data.get('Writer', 'N/A'),
+            'actors': data.get('Actors', 'N/A'),
+            'plot': data.get('Plot', 'N/A'),
+            'language': data.get('Language', 'N/A'),
+            'country': data.get('Country', 'N/A'),
+            'awards': data.get('Awards', 'N/A'),
+            'poster': data.get('Poster', 'N/A'),
+            'imdb_rating': data.get('imdbRating', 'N/A'),
+            'imdb_votes': data.get('imdbVotes', 'N/A'),
+            'box_office': data.get('BoxOffice', 'N/A'),
+            'imdb_id': data.get('imdbID', 'N/A')
+        }
+
+        return movie_data, None
+    except requests.Timeout:
+        return None, "API request timed out. Please try again."
+    except Exception as e:
+        return None, f"Error fetching movie data: {str(e)}"
+
+
+# ---------------------------------------------------------------------------
+# Live update streams (Server-Sent Events)
+#
+# Blueprints register a channel with the query that finds rows changed since a
+# timestamp. While at least one client is subscribed, a single watcher thread
+# per channel (per process) polls that query and publishes each changed row to
+# every subscriber's queue, so one refresh fans out to all open pages without
+# a DB poll per client. Changes made by any process (including worker.py) are
+# picked up because the watcher reads the database, not local state; deletes
+# leave a row in stream_deletions for the same reason.
+# ---------------------------------------------------------------------------
+
+STREAM_POLL_SECONDS = float(os.getenv('STREAM_POLL_SECONDS', 2))
+STREAM_KEEPALIVE_SECONDS = 15
+STREAM_MAX_SECONDS = int(os.getenv('STREAM_MAX_SECONDS', 300))
+STREAM_QUEUE_SIZE = 100
+STREAM_DELETION_RETENTION_SECONDS = 3600
+
+CREATE_STREAM_DELETIONS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS stream_deletions (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        channel VARCHAR(50) NOT NULL,
+        row_id INT NOT NULL,
+        deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_stream_deletions_channel (channel, id)
+    )
+'''
+
+_STREAM_SOURCES = {}      # channel -> {'sql': ..., 'ts_column': ...}
+_STREAM_SUBSCRIBERS = {}  # channel -> set of queue.Queue
+_STREAM_WATCHERS = {}     # channel -> watcher thread
+_STREAM_LOCK = threading.Lock()
+
+def register_stream(channel, sql, ts_column):
+    """Register a live-update channel.
+
+    sql selects rows changed since a timestamp (one %s placeholder, compared
+    with >=) and ts_column names the row's last-modified column.
+    """
+    _STREAM_SOURCES[channel] = {'sql': sql, 'ts_column': ts_column}
+
+def publish(channel, event_type, data):
+    """Send an event to every subscriber of channel in this process"""
+    with _STREAM_LOCK:
+        subscribers = list(_STREAM_SUBSCRIBERS.get(channel, ()))
+    for subscriber in subscribers:
+        try:
+            subscriber.put_nowait((event_type, data))
+        except queue.Full:
+            pass  # Slow client; it will catch up on its next reload
+
+def record_deletion(db, channel, row_id):
+    """Tell channel's subscribers in every process that row_id was deleted.
+
+    Call before the DELETE itself so both are committed together; watchers
+    pick the row up from stream_deletions on their next poll.
+    """
+    cursor = db.cursor()
+    cursor.execute(CREATE_STREAM_DELETIONS_TABLE)
+    cursor.execute('DELETE FROM stream_deletions WHERE deleted_at < NOW() - INTERVAL %s SECOND',
+                   (STREAM_DELETION_RETENTION_SECONDS,))
+    cursor.execute('INSERT INTO stream_deletions (channel, row_id) VALUES (%s, %s)', (channel, row_id))
+
+def _run_stream_watcher(channel):
+    """Poll channel's change query and deletions and publish them until nobody is subscribed"""
+    source = _STREAM_SOURCES[channel]
+    db = None
+    since = None
+    last_deletion = None
+    last_seen = {}
+
+    while True:
+        with _STREAM_LOCK:
+            if not _STREAM_SUBSCRIBERS.get(channel):
+                _STREAM_WATCHERS.pop(channel, None)
+                break
+
+        try:
+            if db is None:
+                db = connect_db()
+                db.autocommit(True)  # Each poll must see rows committed by other connections
+            cursor = db.cursor()
+            if since is None:
+                cursor.execute('SELECT NOW() AS now')
+                since = cursor.fetchone()['now']
+            if last_deletion is None:
+                cursor.execute(CREATE_STREAM_DELETIONS_TABLE)
+                cursor.execute('SELECT COALESCE(MAX(id), 0) AS last_id FROM stream_deletions')
+                last_deletion = cursor.fetchone()['last_id']
+
+            cursor.execute(source['sql'], (since,))
+            for row in cursor.fetchall():
+                stamp = row[source['ts_column']]
+                if last_seen.get(row['id']) == stamp:
+                    continue
+                last_seen[row['id']] = stamp
+                since = max(since, stamp)
+                publish(channel, 'update', row)
+
+            cursor.execute('SELECT id, row_id FROM stream_deletions WHERE channel = %s AND id > %s ORDER BY id',
+                           (channel, last_deletion))
+            for row in cursor.fetchall():
+                last_deletion = row['id']
+                last_seen.pop(row['row_id'], None)
+                publish(channel, 'delete', {'id': row['row_id']})
+        except Exception as e:
+            print(f"Stream watcher for {channel} failed: {e}")
+            if db is not None:
+                try:
+                    db.close()
+                except Exception:
+                    pass
+            db = None
+
+        time.sleep(STREAM_POLL_SECONDS)
+
+    if db is not None:
+        db.close()
+
+def stream_events(channel):
+    """Generator of SSE-formatted text for one client subscribed to channel.
+
+    Sends keepalive comments while idle and ends after STREAM_MAX_SECONDS so the
+    browser's EventSource reconnects and long-lived connections get recycled.
+    """
+    subscriber = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    with _STREAM_LOCK:
+        _STREAM_SUBSCRIBERS.setdefault(channel, set()).add(subscriber)
+        if channel not in _STREAM_WATCHERS:
+            watcher = threading.Thread(target=_run_stream_watcher, args=(channel,),
+                                       name=f'stream-{channel}', daemon=True)
+            _STREAM_WATCHERS[channel] = watcher
+            watcher.start()
+
+    deadline = time.monotonic() + STREAM_MAX_SECONDS
+    try:
+        yield f'retry: {int(STREAM_POLL_SECONDS * 1000)}\n\n'
+        while time.monotonic() < deadline:
+            try:
+                event_type, data = subscriber.get(timeout=STREAM_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            yield f'event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n'
+    finally:
+        with _STREAM_LOCK:
+            _STREAM_SUBSCRIBERS.get(channel, set()).discard(subscriber)
+
+
+# ---------------------------------------------------------------------------
+# Static asset pipeline
+#
+# `flask build-assets` copies everything under app/static (except dist/) to
+# app/static/dist/ with a content hash in the filename, writes gzip and
+# brotli variants of text assets, and records the mapping in
+# dist/manifest.json. The app rewrites url_for('static', ...)
+# to the hashed names and serves them precompressed with immutable caching.
+# Images are fingerprinted but not resized; there are no responsive variants.
+# Without a build, static files are served unchanged.
+# ---------------------------------------------------------------------------
+
+STATIC_DIST_DIR = 'dist'
+STATIC_MANIFEST_FILE = 'manifest.json'
+STATIC_CACHE_SECONDS = 365 * 24 * 3600
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map'}
+
+def _write_compressed_variants(path, content):
+    """Write path.gz and, when brotli is available, path.br next to path"""
+    with open(path + '.gz', 'wb') as gz_file:
+        gz_file.write(gzip.compress(content, compresslevel=9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        return
+    with open(path + '.br', 'wb') as br_file:
+        br_file.write(brotli.compress(content, quality=11))
+
+def build_static_assets(static_folder):
+    """Fingerprint and precompress static assets into static_folder/dist.
+
+    Returns the manifest: {'files': {name: hashed name}}.
+    """
+    dist_folder = os.path.join(static_folder, STATIC_DIST_DIR)
+    shutil.rmtree(dist_folder, ignore_errors=True)
+    manifest = {'files': {}}
+
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [name for name in dirs if os.path.join(root, name) != dist_folder]
+        for name in sorted(files):
+            source_path = os.path.join(root, name)
+            relative = os.path.relpath(source_path, static_folder).replace(os.sep, '/')
+            with open(source_path, 'rb') as source_file:
+                content = source_file.read()
+
+            stem, extension = os.path.splitext(relative)
+            hashed = f'{STATIC_DIST_DIR}/{stem}.{hashlib.sha256(content).hexdigest()[:12]}'
+            output_base = os.path.join(static_folder, *hashed.split('/'))
+            os.makedirs(os.path.dirname(output_base), exist_ok=True)
+            with open(output_base + extension, 'wb') as output_file:
+                output_file.write(content)
+            manifest['files'][relative] = hashed + extension
+
+            if extension.lower() in COMPRESSIBLE_EXTENSIONS:
+                _write_compressed_variants(output_base + extension, content)
+
+    with open(os.path.join(dist_folder, STATIC_MANIFEST_FILE), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    return manifest
+
+def load_static_manifest(static_folder):
+    """Return the manifest written by build_static_assets, or an empty one if assets weren't built"""
+    try:
+        with open(os.path.join(static_folder, STATIC_DIST_DIR, STATIC_MANIFEST_FILE)) as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {'files': {}}
+
+def precompressed_variant(static_folder, filename, accept_encodings):
+    """Pick the best prebuilt .br/.gz file for filename that the client accepts.
+
+    Returns (filename to send, content encoding) or (filename, None).
+    """
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if accept_encodings.quality(encoding) > 0 and os.path.isfile(os.path.join(static_folder, filename + suffix)):
+            return filename + suffix, encoding
+    return filename, None
+
+
+# ---------------------------------------------------------------------------
+# Response compression and fast JSON
+#
+# compress_response() (installed as an after_request hook by the app factory)
+# gzip/brotli-encodes text responses above COMPRESS_MIN_SIZE according to the
+# client's Accept-Encoding, including streamed responses. json_response() is
+# a leaner replacement for jsonify() on hot AJAX endpoints.
+# ---------------------------------------------------------------------------
+
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 500))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 6))
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript', 'application/javascript',
+    'application/json', 'application/x-ndjson', 'image/svg+xml'
+}
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def choose_content_encoding(accept_encodings):
+    """Return 'br', 'gzip' or None: the best encoding we support that the client accepts"""
+    candidates = [('br', accept_encodings.quality('br'))] if brotli else []
+    candidates.append(('gzip', accept_encodings.quality('gzip')))
+    encoding, quality = max(candidates, key=lambda candidate: candidate[1])
+    return encoding if quality > 0 else None
+
+def _new_compressor(encoding):
+    """Return (compress(chunk) -> bytes, finish() -> bytes) for encoding"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    return compressor.compress, compressor.flush
+
+def compress_stream(chunks, encoding):
+    """Compress an iterable of str/bytes chunks lazily, keeping memory flat for streamed responses"""
+    compress, finish = _new_compressor(encoding)
+    try:
+        for chunk in chunks:
+            output = compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            if output:
+                yield output
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def compress_response(response):
+    """after_request hook: negotiate and apply gzip/brotli to compressible responses.
+
+    Skips files served by send_file (precompressed or binary), already encoded
+    bodies, event streams (which must not be buffered), HEAD requests and
+    small bodies below COMPRESS_MIN_SIZE.
+    """
+    if (response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 304)):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_content_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        compress, finish = _new_compressor(encoding)
+        response.set_data(compress(body) + finish())
+
+    response.headers['Content-Encoding'] = encoding
+    if response.headers.get('ETag'):
+        response.set_etag(response.get_etag()[0], weak=True)
+    return response
+
+def select_fields(data, fields):
+    """Keep only the comma-separated fields requested (plus the 'stale' and 'nearby' flags when present)"""
+    if not fields:
+        return data
+    wanted = {field.strip() for field in fields.split(',') if field.strip()} | {'stale', 'nearby'}
+    return {key: value for key, value in data.items() if key in wanted}
+
+def json_response(data, status=200):
+    """Fast JSON response for lookup endpoints.
+
+    Honours ?fields=a,b so callers receive only what they render, and skips
+    jsonify's key sorting and pretty-printing (using orjson when installed).
+    """
+    data = select_fields(data, request.args.get('fields'))
+    if orjson is not None:
+        body = orjson.dumps(data, default=str)
+    else:
+        body = json.dumps(data, separators=(',', ':'), default=str)
+    return Response(body, status=status, mimetype='application/json')
+
+# ---------------------------------------------------------------------------
+# Streaming exports
+#
+# Blueprints register a table together with the timestamp column that moves
+# whenever a row changes. Exports read through an unbuffered server-side
+# cursor (SSCursor) EXPORT_BATCH_SIZE rows at a time and write each batch
+# straight to the response or file, so memory stays flat however large the
+# table is. Each export reports the database time it started at; passing that
+# back as since= pulls only rows changed from then on (a row changed while an
+# export runs may appear in both, never in neither).
+# ---------------------------------------------------------------------------
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+EXPORT_NET_WRITE_TIMEOUT = 600  # seconds MySQL waits on a slow reader before aborting the query
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+_EXPORT_SOURCES = {}  # name -> {'table': ..., 'ts_column': ...}
+
+def register_export(name, table, ts_column):
+    """Make table exportable as name; ts_column drives since= incremental pulls"""
+    _EXPORT_SOURCES[name] = {'table': table, 'ts_column': ts_column}
+
+def parquet_available():
+    """True if pyarrow (the Parquet engine pandas uses) is installed"""
+    return importlib.util.find_spec('pyarrow') is not None
+
+def parse_since(value):
+    """Parse a since= value as an ISO 8601 timestamp; None if empty, ValueError if malformed"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value.strip())
+
+def open_export(name, since=None):
+    """Start an unbuffered export query; returns (cursor, started_at).
+
+    Uses its own connection because a streamed response outlives the request's
+    g.db. Iterate the cursor with export_chunks(), which closes the connection.
+    Raises ValueError for an unknown export name.
+    """
+    if name not in _EXPORT_SOURCES:
+        raise ValueError(f"Unknown export '{name}' (choose from {', '.join(sorted(_EXPORT_SOURCES))})")
+    source = _EXPORT_SOURCES[name]
+
+    db = connect_db()
+    try:
+        cursor = db.cursor()
+        cursor.execute('SET SESSION net_write_timeout = %s', (EXPORT_NET_WRITE_TIMEOUT,))
+        cursor.execute('SELECT NOW() AS started_at')
+        started_at = cursor.fetchone()['started_at']
+        cursor.close()
+
+        sql = f"SELECT * FROM {source['table']}"
+        params = ()
+        if since is not None:
+            sql += f" WHERE {source['ts_column']} >= %s"
+            params = (since,)
+        cursor = db.cursor(pymysql.cursors.SSCursor)
+        cursor.execute(sql, params)
+        return cursor, started_at
+    except Exception:
+        db.close()
+        raise
+
+def _export_batches(cursor):
+    """Yield lists of row tuples from an unbuffered cursor"""
+    while True:
+        rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+        if not rows:
+            return
+        yield rows
+
+def _csv_chunks(cursor):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(column[0] for column in cursor.description)
+    yield buffer.getvalue()
+    for rows in _export_batches(cursor):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+def _jsonl_chunks(cursor):
+    columns = [column[0] for column in cursor.description]
+    for rows in _export_batches(cursor):
+        if orjson is not None:
+            yield b''.join(orjson.dumps(dict(zip(columns, row)), default=str) + b'\n' for row in rows)
+        else:
+            yield ''.join(json.dumps(dict(zip(columns, row)), separators=(',', ':'), default=str) + '\n'
+                          for row in rows)
+
+def _arrow_schema(pa, description, rows):
+    """Arrow schema for a result, so every row group gets the same column types.
+
+    MySQL reports each column's type. SQLite (DB_BACKEND=sqlite/memory)
+    doesn't, so there the types are inferred from the first batch of rows.
+    """
+    if all(type_code is None for _, type_code, *_ in description):
+        columns = list(zip(*rows)) if rows else [()] * len(description)
+        inferred = [pa.array(values).type for values in columns]
+        return pa.schema([pa.field(name, pa.string() if pa.types.is_null(arrow_type) else arrow_type)
+                          for (name, *_), arrow_type in zip(description, inferred)])
+
+    fields = []
+    for name, type_code, _, _, _, scale, _ in description:
+        if type_code in (FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.INT24, FIELD_TYPE.LONG,
+                         FIELD_TYPE.LONGLONG, FIELD_TYPE.YEAR):
+            arrow_type = pa.int64()
+        elif type_code in (FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE):
+            arrow_type = pa.float64()
+        elif type_code in (FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL):
+            arrow_type = pa.decimal128(38, scale)
+        elif type_code in (FIELD_TYPE.TIMESTAMP, FIELD_TYPE.DATETIME):
+            arrow_type = pa.timestamp('us')
+        elif type_code == FIELD_TYPE.DATE:
+            arrow_type = pa.date32()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+def _parquet_chunks(cursor):
+    """Write one row group per batch to a temp file, then stream it (Parquet's footer comes last)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    batches = _export_batches(cursor)
+    first = next(batches, [])
+    schema = _arrow_schema(pa, cursor.description, first)
+    with tempfile.TemporaryFile() as spool:
+        with pq.ParquetWriter(spool, schema, compression='snappy') as writer:
+            for rows in itertools.chain([first] if first else [], batches):
+                columns = zip(*rows)
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                    schema=schema
+                ))
+        cursor.connection.close()  # everything is spooled; free the connection before the slow part
+
+        spool.seek(0)
+        while True:
+            chunk = spool.read(EXPORT_CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
+
+def export_chunks(cursor, fmt):
+    """Yield the export as str/bytes chunks in fmt (csv, jsonl or parquet), then close the connection.
+
+    The connection is closed rather than the cursor so a client that
+    disconnects mid-export doesn't make SSCursor drain the remaining rows.
+    """
+    writers = {'csv': _csv_chunks, 'jsonl': _jsonl_chunks, 'parquet': _parquet_chunks}
+    try:
+        yield from writers[fmt](cursor)
+    finally:
+        if cursor.connection is not None and cursor.connection.open:
+            cursor.connection.close()
+
+def export_response(name, args):
+    """Streamed download of export name, honouring ?format= (default csv) and ?since=.
+
+    The X-Export-Next-Since header carries the value to pass as since= on the
+    next incremental pull.
+    """
+    fmt = args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    if fmt == 'parquet' and not parquet_available():
+        return jsonify({'error': 'Parquet export needs pyarrow installed on the server'}), 400
+
+    try:
+        since = parse_since(args.get('since'))
+    except ValueError:
+        return jsonify({'error': 'since must be an ISO 8601 timestamp, e.g. 2025-01-31T09:30:00'}), 400
+
+    try:
+        cursor, started_at = open_export(name, since)
+    except Exception as e:
+        return jsonify({'error': f'Export failed: {str(e)}'}), 500
+
+    filename = f"{name}-{started_at:%Y%m%dT%H%M%S}.{fmt}"
+    return Response(export_chunks(cursor, fmt), mimetype=EXPORT_FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Export-Next-Since': started_at.isoformat(),
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    })
+
+# ---------------------------------------------------------------------------
+# Request profiling
+#
+# Opt-in: a PROFILE_SAMPLE_RATE fraction of requests, plus any request that
+# carries a signed token (?profile=<token> or an X-Profile header; create one
+# with `flask profile-token`). A profiled request is sampled by a background
+# OS thread that records the handling thread's stack (the handling greenlet's
+# under the gevent worker) every PROFILE_INTERVAL_MS, which costs far less
+# than tracing every call. SQL run through g.db is timed,
+# and slow SELECTs are EXPLAINed. Each profile is written to PROFILE_DIR as
+# <id>.folded (collapsed stacks for flamegraph.pl or speedscope) and
+# <id>.json (request details and SQL), browsable at /profiles/.
+# Profiling stays off unless SECRET_KEY is set: tokens signed with the
+# app's public fallback key could be forged by anyone.
+# ---------------------------------------------------------------------------
+
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL_SECONDS = float(os.getenv('PROFILE_INTERVAL_MS', 5)) / 1000
+PROFILE_SLOW_SQL_SECONDS = float(os.getenv('PROFILE_SLOW_SQL_MS', 100)) / 1000
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 200))
+PROFILE_TOKEN_MAX_AGE = 24 * 3600
+PROFILE_SKIP_BLUEPRINTS = {'profiles'}
+PLACEHOLDER_SECRET_KEYS = {'your-secret', 'change_me'}
+
+def profiling_enabled():
+    """True if SECRET_KEY is explicitly set to a real value, so profiling tokens can't be forged"""
+    return os.getenv('SECRET_KEY', '') not in PLACEHOLDER_SECRET_KEYS | {''}
+
+def _profile_serializer():
+    from itsdangerous import URLSafeTimedSerializer
+    return URLSafeTimedSerializer(current_app.secret_key, salt='request-profiler')
+
+def make_profile_token():
+    """Signed token that turns profiling on for a request (valid PROFILE_TOKEN_MAX_AGE seconds).
+
+    Raises RuntimeError if SECRET_KEY isn't set.
+    """
+    if not profiling_enabled():
+        raise RuntimeError('Set SECRET_KEY to a long random value before enabling profiling')
+    return _profile_serializer().dumps('profile')
+
+def profile_token_valid(token):
+    """True if token was made by make_profile_token() with this app's secret and hasn't expired"""
+    if not token or not profiling_enabled():
+        return False
+    try:
+        _profile_serializer().loads(token, max_age=PROFILE_TOKEN_MAX_AGE)
+        return True
+    except Exception:
+        return False
+
+def request_profile_token():
+    """The profiling token sent with the current request, if any"""
+    return request.args.get('profile') or request.headers.get('X-Profile')
+
+def _gevent_patched():
+    """True under gevent's monkey-patching (the gevent gunicorn worker), where each request is a greenlet"""
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('threading')
+
+def _os_thread_primitives():
+    """(start_new_thread, allocate_lock, sleep, get_ident) backed by real OS threads.
+
+    Under gevent the patched threading module hands out greenlets, which can't
+    sample a request: they only run while the request itself is switched out.
+    """
+    if _gevent_patched():
+        monkey = sys.modules['gevent.monkey']
+        start_new_thread, allocate_lock, get_ident = monkey.get_original(
+            '_thread', ['start_new_thread', 'allocate_lock', 'get_ident'])
+        return start_new_thread, allocate_lock, monkey.get_original('time', 'sleep'), get_ident
+    return _thread.start_new_thread, _thread.allocate_lock, time.sleep, _thread.get_ident
+
+def _handler_frame(profile):
+    """Current frame of the thread (or, under gevent, the greenlet) handling the profiled request"""
+    handler = profile['greenlet']
+    if handler is not None:
+        if handler.dead:
+            return None
+        if handler.gr_frame is not None:  # switched out, e.g. waiting on I/O
+            return handler.gr_frame
+    return sys._current_frames().get(profile['thread_id'])
+
+def _sample_stacks(profile, sleep):
+    """Sampler (an OS thread): count the request handler's current stack every PROFILE_INTERVAL_SECONDS"""
+    stacks = profile['stacks']
+    try:
+        while not profile['stopped']:
+            sleep(PROFILE_INTERVAL_SECONDS)
+            frame = _handler_frame(profile)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if names and not profile['stopped']:
+                stack = ';'.join(reversed(names))
+                stacks[stack] = stacks.get(stack, 0) + 1
+    finally:
+        profile['sampler_done'].release()
+
+def start_profile():
+    """before_request hook: start profiling this request if it is sampled or carries a valid token"""
+    if request.blueprint in PROFILE_SKIP_BLUEPRINTS or request.endpoint == 'static' or not profiling_enabled():
+        return
+
+    if profile_token_valid(request_profile_token()):
+        trigger = 'token'
+    elif PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        trigger = 'sampled'
+    else:
+        return
+
+    handler = None
+    if _gevent_patched():
+        from greenlet import getcurrent
+        handler = getcurrent()
+    start_new_thread, allocate_lock, sleep, get_ident = _os_thread_primitives()
+    sampler_done = allocate_lock()
+    sampler_done.acquire()
+    g.profile = {
+        'trigger': trigger,
+        'started_at': datetime.now(),
+        'started': time.perf_counter(),
+        'thread_id': get_ident(),
+        'greenlet': handler,
+        'stopped': False,
+        'sampler_done': sampler_done,
+        'stacks': {},
+        'queries': [],
+    }
+    start_new_thread(_sample_stacks, (g.profile, sleep))
+
+def profile_connection(db):
+    """Time every statement run on db's cursors for the current profile.
+
+    Wraps the connection's cursor() so each new cursor's execute() records the
+    SQL text (not the parameters), duration and row count. The parameters of
+    slow statements are held until finish_profile() EXPLAINs them.
+    """
+    queries = g.profile['queries']
+    make_cursor = db.cursor
+    g.profile['explain_cursor'] = make_cursor
+
+    def cursor(*cursor_args, **cursor_kwargs):
+        new_cursor = make_cursor(*cursor_args, **cursor_kwargs)
+        execute = new_cursor.execute
+
+        def timed_execute(query, args=None):
+            started = time.perf_counter()
+            try:
+                return execute(query, args)
+            finally:
+                elapsed = time.perf_counter() - started
+                entry = {'sql': ' '.join(query.split()), 'ms': round(elapsed * 1000, 2), 'rows': new_cursor.rowcount}
+                if elapsed >= PROFILE_SLOW_SQL_SECONDS:
+                    entry['held'] = (query, args)
+                queries.append(entry)
+
+        new_cursor.execute = timed_execute
+        return new_cursor
+
+    db.cursor = cursor
+
+def _explain_slow_queries(profile):
+    """Attach EXPLAIN output to slow SELECTs, dropping the held parameters afterwards"""
+    for entry in profile['queries']:
+        if 'held' not in entry:
+            continue
+        query, args = entry.pop('held')
+        entry['slow'] = True
+        if not entry['sql'].lower().startswith('select') or 'explain_cursor' not in profile:
+            continue
+        try:
+            cursor = profile['explain_cursor']()
+            cursor.execute('EXPLAIN ' + query, args)
+            entry['explain'] = cursor.fetchall()
+            cursor.close()
+        except Exception as e:
+            entry['explain_error'] = str(e)
+
+def stop_profile(exception=None):
+    """teardown_request hook: make sure the sampler thread never outlives its request"""
+    profile = g.get('profile')
+    if profile is not None:
+        profile['stopped'] = True
+
+def finish_profile(response):
+    """after_request hook: stop sampling, EXPLAIN slow SQL and write the profile files"""
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+
+    duration = time.perf_counter() - profile['started']
+    profile['stopped'] = True
+    profile['sampler_done'].acquire()  # the sampler notices within one interval
+    _explain_slow_queries(profile)
+
+    profile_id = f"{profile['started_at']:%Y%m%d-%H%M%S}-{os.urandom(3).hex()}"
+    details = {
+        'id': profile_id,
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'trigger': profile['trigger'],
+        'started_at': profile['started_at'].isoformat(timespec='seconds'),
+        'duration_ms': round(duration * 1000, 1),
+        'samples': sum(profile['stacks'].values()),
+        'interval_ms': PROFILE_INTERVAL_SECONDS * 1000,
+        'sql_ms': round(sum(entry['ms'] for entry in profile['queries']), 1),
+        'queries': profile['queries'],
+    }
+
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, f'{profile_id}.folded'), 'w') as folded:
+            for stack, count in sorted(profile['stacks'].items()):
+                folded.write(f'{stack} {count}\n')
+        with open(os.path.join(PROFILE_DIR, f'{profile_id}.json'), 'w') as details_file:
+            json.dump(details, details_file, default=str)
+        prune_profiles()
+        response.headers['X-Profile-Id'] = profile_id
+    except OSError as e:
+        print(f"Could not write profile {profile_id}: {e}")
+    return response
+
+def prune_profiles():
+    """Delete the oldest profiles beyond PROFILE_KEEP"""
+    profile_ids = sorted(name[:-len('.json')] for name in os.listdir(PROFILE_DIR) if name.endswith('.json'))
+    for profile_id in profile_ids[:-PROFILE_KEEP]:
+        for extension in ('.json', '.folded'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, profile_id + extension))
+            except FileNotFoundError:
+                pass
+
+def list_profiles():
+    """Details of stored profiles, newest first (without their SQL lists)"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if name.endswith('.json'):
+            details = load_profile(name[:-len('.json')])
+            if details:
+                details.pop('queries', None)
+                profiles.append(details)
+    return profiles
+
+def load_profile(profile_id):
+    """Details and SQL of one stored profile, or None"""
+    try:
+        with open(os.path.join(PROFILE_DIR, f'{os.path.basename(profile_id)}.json')) as details_file:
+            return json.load(details_file)
+    except (OSError, ValueError):
+        return None
+
+def load_folded_stacks(profile_id):
+    """Collapsed stacks of one stored profile as [(stack, count)]"""
+    stacks = []
+    try:
+        with open(os.path.join(PROFILE_DIR, f'{os.path.basename(profile_id)}.folded')) as folded:
+            for line in folded:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                stacks.append((stack, int(count)))
+    except (OSError, ValueError):
+        pass
+    return stacks
+
+def flamegraph_blocks(stacks, limit=2000):
+    """Lay out collapsed stacks as icicle-graph blocks for the profile page.
+
+    Returns [{'name', 'depth', 'left', 'width', 'count'}] with left/width as
+    percentages of all samples; the widest `limit` blocks are kept.
+    """
+    total = sum(count for _, count in stacks)
+    if not total:
+        return []
+
+    # Merge stacks into a tree of {'children': {name: node}, 'count': n}
+    root = {'children': {}, 'count': total}
+    for stack, count in stacks:
+        node = root
+        for name in stack.split(';'):
+            node = node['children'].setdefault(name, {'children': {}, 'count': 0})
+            node['count'] += count
+
+    blocks = []
+    pending = [(root, 0, 0)]
+    while pending:
+        node, depth, offset = pending.pop()
+        for name, child in sorted(node['children'].items()):
+            blocks.append({'name': name, 'depth': depth, 'count': child['count'],
+                           'left': 100 * offset / total, 'width': 100 * child['count'] / total})
+            pending.append((child, depth + 1, offset))
+            offset += child['count']
+
+    blocks.sort(key=lambda block: block['width'], reverse=True)
+    return blocks[:limit]
+
+# ---------------------------------------------------------------------------
+# Admission control for expensive endpoints
+#
+# Routes listed in ADMISSION_RULES call upstream APIs or queue bulk work, so
+# one client hammering them can use up worker threads and API quotas for
+# everyone. admit_request() (a before_request hook installed by the app
+# factory) applies two limits to them:
+#
+# - Per-route concurrency: each worker process runs at most `concurrency`
+#   requests of a route at once. Up to ADMISSION_QUEUE_SIZE more wait at most
+#   ADMISSION_QUEUE_WAIT_MS for a slot; beyond that the request is refused at
+#   once with 503 and Retry-After instead of tying up a thread.
+# - Per-client rate: a token bucket per (client address, route) in the
+#   `rate_limits` table, refilled at `per_minute` up to `burst`. Buckets live
+#   in MySQL so the limit holds across gunicorn workers and hosts; each check
+#   is one conditional UPDATE. Over the limit, the answer is 429 with
+#   Retry-After set to when the next token arrives.
+#
+# If the database is unavailable the rate limit fails open.
+# ---------------------------------------------------------------------------
+
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', '1') != '0'
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 4))
+ADMISSION_QUEUE_WAIT_SECONDS = int(os.getenv('ADMISSION_QUEUE_WAIT_MS', 250)) / 1000
+ADMISSION_RETRY_AFTER_SECONDS = 2
+DB_RETRY_AFTER_SECONDS = 30
+RATE_LIMIT_PRUNE_SECONDS = 3600
+
+# endpoint -> methods limited, concurrent requests per worker, requests per minute per client, burst
+ADMISSION_RULES = {
+    'tickers.update_all_tickers': {'methods': {'GET'}, 'concurrency': 1, 'per_minute': 2, 'burst': 2},
+    'weather.update_all_weather': {'methods': {'GET'}, 'concurrency': 1, 'per_minute': 2, 'burst': 2},
+    'chatbot.show_chatbot': {'methods': {'POST'}, 'concurrency': 4, 'per_minute': 10, 'burst': 5},
+    'tickers.lookup_ticker': {'methods': {'GET'}, 'concurrency': 8, 'per_minute': 60, 'burst': 20},
+    'weather.lookup_weather': {'methods': {'GET'}, 'concurrency': 8, 'per_minute': 60, 'burst': 20},
+    'movies.search_movie': {'methods': {'GET'}, 'concurrency': 8, 'per_minute': 60, 'burst': 20},
+    'batches.batch_lookup': {'methods': {'POST'}, 'concurrency': 4, 'per_minute': 20, 'burst': 10},
+}
+
+CREATE_RATE_LIMITS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        bucket VARCHAR(191) PRIMARY KEY,
+        tokens DOUBLE NOT NULL,
+        refilled_at TIMESTAMP(6) NOT NULL,
+        KEY idx_rate_limits_refilled_at (refilled_at)
+    )
+'''
+
+# Tokens a bucket holds now: its stored tokens plus the refill since refilled_at, capped at the burst
+_REFILLED_TOKENS = 'LEAST(%(burst)s, tokens + TIMESTAMPDIFF(MICROSECOND, refilled_at, NOW(6)) / 1000000 * %(rate)s)'
+
+# Per-process slots and queue lengths for each limited route
+_ADMISSION_SLOTS = {endpoint: threading.BoundedSemaphore(rule['concurrency'])
+                    for endpoint, rule in ADMISSION_RULES.items()}
+_ADMISSION_WAITING = dict.fromkeys(ADMISSION_RULES, 0)
+_ADMISSION_LOCK = threading.Lock()
+_RATE_LIMIT_STATE = {'table_ready': False, 'pruned_at': 0.0}
+
+def acquire_admission_slot(endpoint):
+    """Take a concurrency slot for endpoint, waiting briefly in a bounded queue. Returns True if admitted."""
+    slots = _ADMISSION_SLOTS[endpoint]
+    if slots.acquire(blocking=False):
+        return True
+
+    with _ADMISSION_LOCK:
+        if _ADMISSION_WAITING[endpoint] >= ADMISSION_QUEUE_SIZE:
+            return False
+        _ADMISSION_WAITING[endpoint] += 1
+    try:
+        return slots.acquire(timeout=ADMISSION_QUEUE_WAIT_SECONDS)
+    finally:
+        with _ADMISSION_LOCK:
+            _ADMISSION_WAITING[endpoint] -= 1
+
+def release_admission_slot(exception=None):
+    """teardown_request hook: give back the slot taken by admit_request()"""
+    endpoint = g.pop('admission_slot', None)
+    if endpoint is not None:
+        _ADMISSION_SLOTS[endpoint].release()
+
+def take_rate_token(db, bucket, per_minute, burst):
+    """Spend one token from a shared token bucket.
+
+    Returns 0 if the request may proceed, otherwise the seconds until the
+    bucket holds a token again. The refill and spend happen in a single
+    conditional UPDATE, so concurrent workers can't both spend the last token.
+    """
+    params = {'bucket': bucket, 'burst': burst, 'rate': per_minute / 60}
+    cursor = db.cursor()
+    if not _RATE_LIMIT_STATE['table_ready']:
+        cursor.execute(CREATE_RATE_LIMITS_TABLE)
+        _RATE_LIMIT_STATE['table_ready'] = True
+
+    spend = (f'UPDATE rate_limits SET tokens = {_REFILLED_TOKENS} - 1, refilled_at = NOW(6) '
+             f'WHERE bucket = %(bucket)s AND {_REFILLED_TOKENS} >= 1')
+    cursor.execute(spend, params)
+    allowed = cursor.rowcount == 1
+    if not allowed:
+        # New client: start with a full bucket (less this request). If another worker created
+        # the row first, spend from it instead.
+        cursor.execute('INSERT IGNORE INTO rate_limits (bucket, tokens, refilled_at) '
+                       'VALUES (%(bucket)s, %(burst)s - 1, NOW(6))', params)
+        allowed = cursor.rowcount == 1
+        if not allowed:
+            cursor.execute(spend, params)
+            allowed = cursor.rowcount == 1
+
+    retry_after = 0
+    if not allowed:
+        cursor.execute(f'SELECT {_REFILLED_TOKENS} AS tokens FROM rate_limits WHERE bucket = %(bucket)s', params)
+        row = cursor.fetchone()
+        retry_after = max(1, math.ceil((1 - row['tokens']) / params['rate'])) if row else 1
+
+    # Idle buckets are full again after burst / rate, so old rows can go
+    if time.monotonic() - _RATE_LIMIT_STATE['pruned_at'] > RATE_LIMIT_PRUNE_SECONDS:
+        _RATE_LIMIT_STATE['pruned_at'] = time.monotonic()
+        cursor.execute('DELETE FROM rate_limits WHERE refilled_at < NOW() - INTERVAL 1 DAY')
+
+    # Plain commit: rate limiting is not a user write, so it must not pin reads to the primary
+    db.commit()
+    return retry_after
+
+def retry_later_response(status, message, retry_after):
+    """503/429 response with Retry-After, as JSON for API clients and as a page for browsers"""
+    if request.accept_mimetypes.best_match(['application/json', 'text/html']) == 'text/html':
+        response = Response(render_template('busy.html', message=message, retry_after=retry_after), status=status)
+    else:
+        response = json_response({'error': message, 'retry_after': retry_after}, status)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def admit_request():
+    """before_request hook: enforce the per-client rate and per-route concurrency limits"""
+    rule = ADMISSION_RULES.get(request.endpoint)
+    if not ADMISSION_CONTROL or rule is None or request.method not in rule['methods']:
+        return None
+
+    # Rate first, so a refused request never holds a concurrency slot
+    db = get_db()
+    if db is not None:
+        try:
+            retry_after = take_rate_token(db, f'{request.remote_addr}:{request.endpoint}',
+                                          rule['per_minute'], rule['burst'])
+        except Exception as e:
+            print(f"Rate limit check failed, allowing request: {e}")
+            retry_after = 0
+        if retry_after:
+            return retry_later_response(429, 'Too many requests. Please slow down and try again shortly.', retry_after)
+
+    if not acquire_admission_slot(request.endpoint):
+        return retry_later_response(503, 'This feature is busy right now. Please try again in a moment.',
+                                 ADMISSION_RETRY_AFTER_SECONDS)
+    g.admission_slot = request.endpoint
+    return None
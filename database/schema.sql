@@ -13,4 +13,83 @@ CREATE TABLE sample_table (
 
 -- Add indexes for common queries
 CREATE INDEX idx_sample_table_name ON sample_table (last_name, first_name);
-CREATE INDEX idx_sample_table_dob ON sample_table (date_of_birth);
\ No newline at end of file
+CREATE INDEX idx_sample_table_dob ON sample_table (date_of_birth);
+
+-- Background job queue (see worker.py)
+-- Workers claim rows with SELECT ... FOR UPDATE SKIP LOCKED (MySQL 8.0+)
+CREATE TABLE IF NOT EXISTS jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    job_type VARCHAR(50) NOT NULL,
+    payload TEXT,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 3,
+    progress INT NOT NULL DEFAULT 0,
+    progress_total INT NOT NULL DEFAULT 0,
+    result TEXT,
+    last_error TEXT,
+    run_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_at DATETIME NULL,
+    active_key CHAR(40) NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_jobs_claim (status, run_at),
+    UNIQUE KEY uq_jobs_active (active_key)
+);
+
+-- Similar-movies cache: top neighbours of each movie by cosine similarity
+-- (created on first use and kept up to date by the movies blueprint)
+CREATE TABLE IF NOT EXISTS movie_similarities (
+    movie_id INT NOT NULL,
+    similar_id INT NOT NULL,
+    score FLOAT NOT NULL,
+    PRIMARY KEY (movie_id, similar_id),
+    KEY idx_movie_similarities_similar (similar_id)
+);
+
+-- Rows deleted from tables with a live-update stream (/tickers/stream, /weather/stream),
+-- polled by every web process so open pages drop them (created on first use)
+CREATE TABLE IF NOT EXISTS stream_deletions (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    channel VARCHAR(50) NOT NULL,
+    row_id INT NOT NULL,
+    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_stream_deletions_channel (channel, id)
+);
+
+-- Coordinates of locations requested from /weather/lookup, learned from earlier API answers
+-- (created on first use); lets a lookup be answered from a fresh observation nearby
+CREATE TABLE IF NOT EXISTS weather_geocodes (
+    city VARCHAR(100) NOT NULL,
+    state VARCHAR(50) NOT NULL DEFAULT '',
+    lat DECIMAL(9, 6) NOT NULL,
+    lon DECIMAL(9, 6) NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (city, state)
+);
+
+-- AI chatbot history: answers stored zlib-compressed with short previews for the listing,
+-- partitioned by month so old months are dropped instead of deleted row by row
+-- (created on first use; the chatbot blueprint adds upcoming months and drops expired ones)
+CREATE TABLE IF NOT EXISTS chatbot_history (
+    id BIGINT AUTO_INCREMENT,
+    question TEXT NOT NULL,
+    question_preview VARCHAR(300) NOT NULL,
+    answer_preview VARCHAR(300) NOT NULL,
+    answer_length INT NOT NULL,
+    answer_zlib MEDIUMBLOB NOT NULL,
+    model VARCHAR(50) DEFAULT 'llama-3.1-8b-instant',
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+)
+PARTITION BY RANGE COLUMNS (created_at) (
+    PARTITION pmax VALUES LESS THAN (MAXVALUE)
+);
+
+-- Per-client token buckets for rate-limited endpoints, shared by all app workers (created on first use)
+CREATE TABLE IF NOT EXISTS rate_limits (
+    bucket VARCHAR(191) PRIMARY KEY,
+    tokens DOUBLE NOT NULL,
+    refilled_at TIMESTAMP(6) NOT NULL,
+    KEY idx_rate_limits_refilled_at (refilled_at)
+);
@@ -1,17 +1,26 @@
 """
 Script to update database tables with new schema
 Run this once to migrate existing tables to the new enhanced schema
+
+    python fix_database_schema.py            # DROP and recreate all tables (destroys data)
+    python fix_database_schema.py --migrate  # apply in-place migrations, keeping data
 """
 import pymysql
 import os
+import sys
+from datetime import datetime
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def fix_database_schema():
-    """Drop and recreate tables with enhanced schema"""
+# Rows deleted/updated per statement during online migrations (keeps locks short)
+MIGRATION_BATCH_SIZE = 500
+
+# Ids left free in a swapped-in table for rows still being written to the old one
+MIGRATION_ID_GAP = 10000
 
-    # Connect directly to database
+def connect_database():
+    """Connect directly to the database, or return None on failure"""
     try:
         db = pymysql.connect(
             host=os.getenv('DB_HOST'),
@@ -22,8 +31,228 @@ def fix_database_schema():
             cursorclass=pymysql.cursors.DictCursor
         )
         print("[OK] Connected to database")
+        return db
     except Exception as e:
         print(f"Error: Could not connect to database: {e}")
+        return None
+
+def index_exists(cursor, table, index_name):
+    """Return True if table already has an index called index_name"""
+    cursor.execute(
+        '''SELECT 1 FROM information_schema.statistics
+           WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1''',
+        (table, index_name)
+    )
+    return cursor.fetchone() is not None
+
+def column_exists(cursor, table, column):
+    """Return True if table already has the given column"""
+    cursor.execute(
+        '''SELECT 1 FROM information_schema.columns
+           WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s LIMIT 1''',
+        (table, column)
+    )
+    return cursor.fetchone() is not None
+
+def add_columns(cursor, table, columns):
+    """Add any of columns ([(name, definition)]) that table doesn't have yet"""
+    for name, definition in columns:
+        if column_exists(cursor, table, name):
+            print(f"[OK] {table}.{name} already exists")
+            continue
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+        print(f"[OK] Added {table}.{name}")
+
+def add_index(cursor, table, index_name, columns):
+    """Add a secondary index online (reads and writes continue) unless it already exists"""
+    if index_exists(cursor, table, index_name):
+        print(f"[OK] {table}.{index_name} already exists")
+        return
+    cursor.execute(f'ALTER TABLE {table} ADD INDEX {index_name} ({columns}), ALGORITHM=INPLACE, LOCK=NONE')
+    print(f"[OK] Added index {index_name} on {table}")
+
+def delete_in_batches(db, cursor, table, ids):
+    """Delete rows by id in small committed batches so no long lock is held"""
+    for start in range(0, len(ids), MIGRATION_BATCH_SIZE):
+        batch = ids[start:start + MIGRATION_BATCH_SIZE]
+        placeholders = ', '.join(['%s'] * len(batch))
+        cursor.execute(f'DELETE FROM {table} WHERE id IN ({placeholders})', batch)
+        db.commit()
+
+def dedupe_and_add_unique_key(db, cursor, table, key_columns, ts_column, index_name):
+    """Remove duplicate rows (keeping the most recently updated one) and add a unique key.
+
+    Duplicates are deleted in batches, then the key is added with an online
+    ALTER (ALGORITHM=INPLACE, LOCK=NONE) so reads and writes continue. If new
+    duplicates are inserted in between, the ALTER fails and the pass is retried.
+    """
+    if index_exists(cursor, table, index_name):
+        print(f"[OK] {table}.{index_name} already exists")
+        return
+
+    partition = ', '.join(key_columns)
+    for attempt in range(3):
+        # Single sorted pass: every row after the newest one in its key group is a duplicate
+        cursor.execute(
+            f'''SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY {partition}
+                                                  ORDER BY {ts_column} DESC, id DESC) AS row_rank
+                    FROM {table}
+                ) ranked
+                WHERE row_rank > 1'''
+        )
+        duplicate_ids = [row['id'] for row in cursor.fetchall()]
+        delete_in_batches(db, cursor, table, duplicate_ids)
+        print(f"Removed {len(duplicate_ids)} duplicate row(s) from {table}")
+
+        try:
+            cursor.execute(
+                f'''ALTER TABLE {table} ADD UNIQUE KEY {index_name} ({partition}),
+                    ALGORITHM=INPLACE, LOCK=NONE'''
+            )
+            print(f"[OK] Added unique key {index_name} on {table}")
+            return
+        except pymysql.err.IntegrityError:
+            print(f"New duplicates appeared in {table}, retrying (attempt {attempt + 1})")
+
+    raise RuntimeError(f"Could not add unique key {index_name} to {table}")
+
+def migrate_unique_locations(db, cursor):
+    """One row per ticker symbol and per weather (city, state)"""
+    dedupe_and_add_unique_key(db, cursor, 'tickers', ['symbol'], 'last_updated', 'uq_tickers_symbol')
+
+    # NULL states would bypass the unique key, so normalise them to '' first
+    while True:
+        cursor.execute(f"UPDATE weather SET state = '' WHERE state IS NULL LIMIT {MIGRATION_BATCH_SIZE}")
+        db.commit()
+        if cursor.rowcount < MIGRATION_BATCH_SIZE:
+            break
+    cursor.execute("ALTER TABLE weather MODIFY state VARCHAR(50) NOT NULL DEFAULT '', ALGORITHM=INPLACE, LOCK=NONE")
+    dedupe_and_add_unique_key(db, cursor, 'weather', ['city', 'state'], 'updated_at', 'uq_weather_location')
+
+def migrate_weather_geocode_cache(db, cursor):
+    """Cache each location's OpenWeatherMap city id and coordinates"""
+    from app.blueprints.weather import WEATHER_CACHE_COLUMNS
+
+    add_columns(cursor, 'weather', WEATHER_CACHE_COLUMNS)
+
+def migrate_export_timestamps(db, cursor):
+    """Track when movies change and index every table's change timestamp for since= exports"""
+    add_columns(cursor, 'movies', [
+        ('updated_at', 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP'),
+    ])
+    add_index(cursor, 'movies', 'idx_movies_updated_at', 'updated_at')
+    add_index(cursor, 'tickers', 'idx_tickers_last_updated', 'last_updated')
+    add_index(cursor, 'weather', 'idx_weather_updated_at', 'updated_at')
+
+def copy_chat_history(db, cursor, source, target, after_id, keep_from):
+    """Copy rows with id > after_id from the old chatbot_history layout into target, compressing answers.
+
+    Rows older than keep_from (already past retention) are skipped.
+    Returns (last id seen, rows copied).
+    """
+    from app.blueprints.chatbot import history_row_values
+
+    copied = 0
+    while True:
+        cursor.execute(
+            f'SELECT id, question, answer, model, created_at FROM {source} WHERE id > %s ORDER BY id LIMIT %s',
+            (after_id, MIGRATION_BATCH_SIZE)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return after_id, copied
+        kept = [row for row in rows if keep_from is None or row['created_at'] >= keep_from]
+        if kept:
+            cursor.executemany(
+                f'''INSERT INTO {target} (id, question, question_preview, answer_preview, answer_length,
+                                          answer_zlib, model, created_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)''',
+                [(row['id'],) + history_row_values(row['question'], row['answer'], row['model']) + (row['created_at'],)
+                 for row in kept]
+            )
+        db.commit()
+        after_id = rows[-1]['id']
+        copied += len(kept)
+
+def migrate_chatbot_history(db, cursor):
+    """Compressed answers, preview columns and monthly partitions for chatbot_history.
+
+    The new table is filled alongside the old one in batches, then the two are
+    swapped with an atomic RENAME; rows written during the copy are carried over.
+    New ids start MIGRATION_ID_GAP past the old table's, so chats saved right after
+    the swap can't take the ids of rows still waiting to be carried over.
+    """
+    from app.blueprints.chatbot import (CHATBOT_HISTORY_RETENTION_MONTHS, CREATE_CHATBOT_HISTORY_TABLE, add_months,
+                                        maintain_chatbot_history)
+
+    cursor.execute("SHOW TABLES LIKE 'chatbot_history'")
+    if cursor.fetchone() is None:
+        print("[OK] chatbot_history doesn't exist yet; it is created partitioned on first use")
+        return
+    if column_exists(cursor, 'chatbot_history', 'answer_zlib'):
+        added, dropped = maintain_chatbot_history(cursor)
+        print(f"[OK] chatbot_history already partitioned (added {len(added)}, dropped {len(dropped)} partition(s))")
+        return
+
+    # Rows already past the retention period are not copied
+    keep_from = None
+    if CHATBOT_HISTORY_RETENTION_MONTHS > 0:
+        cursor.execute('SELECT CURDATE() AS today')
+        cutoff = add_months(cursor.fetchone()['today'], 1 - CHATBOT_HISTORY_RETENTION_MONTHS)
+        keep_from = datetime.combine(cutoff, datetime.min.time())
+    cursor.execute('SELECT MIN(created_at) AS oldest FROM chatbot_history')
+    oldest = cursor.fetchone()['oldest']
+    if oldest and keep_from:
+        oldest = max(oldest, keep_from)
+
+    cursor.execute('DROP TABLE IF EXISTS chatbot_history_new')
+    cursor.execute(CREATE_CHATBOT_HISTORY_TABLE.format(table='chatbot_history_new'))
+    maintain_chatbot_history(cursor, 'chatbot_history_new', oldest.date() if oldest else None)
+
+    last_id, copied = copy_chat_history(db, cursor, 'chatbot_history', 'chatbot_history_new', 0, keep_from)
+    cursor.execute('SELECT MAX(id) AS last_id FROM chatbot_history')
+    next_id = (cursor.fetchone()['last_id'] or 0) + MIGRATION_ID_GAP
+    cursor.execute(f'ALTER TABLE chatbot_history_new AUTO_INCREMENT = {next_id}')
+    cursor.execute('RENAME TABLE chatbot_history TO chatbot_history_old, chatbot_history_new TO chatbot_history')
+    last_id, late = copy_chat_history(db, cursor, 'chatbot_history_old', 'chatbot_history', last_id, keep_from)
+    cursor.execute('DROP TABLE chatbot_history_old')
+    print(f"[OK] Moved {copied + late} chat(s) into the compressed, partitioned chatbot_history")
+
+# In-place migrations, applied in order by --migrate. Each must be safe to re-run.
+MIGRATIONS = [
+    ('Unique tickers.symbol and weather (city, state)', migrate_unique_locations),
+    ('Weather city id and coordinate cache', migrate_weather_geocode_cache),
+    ('Change timestamps for incremental exports', migrate_export_timestamps),
+    ('Compressed, monthly-partitioned chatbot_history', migrate_chatbot_history),
+]
+
+def migrate_database_schema():
+    """Apply MIGRATIONS to the existing tables without dropping data"""
+    db = connect_database()
+    if db is None:
+        return
+
+    cursor = db.cursor()
+    try:
+        for description, migration in MIGRATIONS:
+            print(f"Migrating: {description}...")
+            migration(db, cursor)
+            db.commit()
+        print("\n[SUCCESS] All migrations applied!")
+    except Exception as e:
+        print(f"\n[ERROR] Error migrating database: {e}")
+        db.rollback()
+    finally:
+        cursor.close()
+        db.close()
+        print("Database connection closed.")
+
+def fix_database_schema():
+    """Drop and recreate tables with enhanced schema"""
+
+    db = connect_database()
+    if db is None:
         return
 
     cursor = db.cursor()
@@ -42,7 +271,9 @@ def fix_database_schema():
                 change_percent VARCHAR(20) DEFAULT '0%',
                 volume BIGINT DEFAULT 0,
                 last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE KEY uq_tickers_symbol (symbol),
+                KEY idx_tickers_last_updated (last_updated)
             )
         ''')
         print("[OK] Tickers table updated")
@@ -54,7 +285,7 @@ def fix_database_schema():
             CREATE TABLE weather (
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 city VARCHAR(100) NOT NULL,
-                state VARCHAR(50),
+                state VARCHAR(50) NOT NULL DEFAULT '',
                 temperature DECIMAL(5, 2) NOT NULL,
                 feels_like DECIMAL(5, 2),
                 humidity INT,
@@ -63,8 +294,13 @@ def fix_database_schema():
                 wind_speed DECIMAL(5, 2),
                 temp_min DECIMAL(5, 2),
                 temp_max DECIMAL(5, 2),
+                owm_id INT,
+                lat DECIMAL(9, 6),
+                lon DECIMAL(9, 6),
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE KEY uq_weather_location (city, state),
+                KEY idx_weather_updated_at (updated_at)
             )
         ''')
         print("[OK] Weather table updated")
@@ -93,7 +329,9 @@ def fix_database_schema():
                 imdb_votes VARCHAR(50),
                 box_office VARCHAR(50),
                 imdb_id VARCHAR(20),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                KEY idx_movies_updated_at (updated_at)
             )
         ''')
         print("[OK] Movies table updated")
@@ -103,11 +341,18 @@ def fix_database_schema():
         cursor.execute('DROP TABLE IF EXISTS chatbot_history')
         cursor.execute('''
             CREATE TABLE chatbot_history (
-                id INT AUTO_INCREMENT PRIMARY KEY,
+                id BIGINT AUTO_INCREMENT,
                 question TEXT NOT NULL,
-                answer TEXT NOT NULL,
-                model VARCHAR(50) DEFAULT 'llama3-8b-8192',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                question_preview VARCHAR(300) NOT NULL,
+                answer_preview VARCHAR(300) NOT NULL,
+                answer_length INT NOT NULL,
+                answer_zlib MEDIUMBLOB NOT NULL,
+                model VARCHAR(50) DEFAULT 'llama-3.1-8b-instant',
+                created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (id, created_at)
+            )
+            PARTITION BY RANGE COLUMNS (created_at) (
+                PARTITION pmax VALUES LESS THAN (MAXVALUE)
             )
         ''')
         print("[OK] Chatbot history table updated")
@@ -128,6 +373,11 @@ if __name__ == '__main__':
     print("=" * 60)
     print("Database Schema Update Script")
     print("=" * 60)
+
+    if '--migrate' in sys.argv:
+        print("\nApplying in-place migrations (existing data is kept).\n")
+        migrate_database_schema()
+        sys.exit(0)
     print("\nThis will DROP and RECREATE all tables with the new schema.")
     print("WARNING: This will DELETE all existing data!\n")
 
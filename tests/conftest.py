@@ -0,0 +1,74 @@
+"""Shared fixtures: the app runs on the in-memory database (DB_BACKEND=memory), emptied before each test"""
+import os
+import time
+
+# Settings are read when app modules are imported, so they are set first
+os.environ['DB_BACKEND'] = 'memory'
+os.environ['SECRET_KEY'] = 'test-secret-key'
+os.environ['JOB_POLL_SECONDS'] = '0.05'
+os.environ['STREAM_POLL_SECONDS'] = '0.05'
+os.environ['PROXY_FIX_HOPS'] = '1'
+
+import pytest
+
+import app.functions as functions
+from app import app as flask_app
+from app.db_connect import connect_db
+
+def empty_database():
+    """Delete every row from every table, keeping the tables (and the per-process caches that know about them)"""
+    db = connect_db()
+    try:
+        cursor = db.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite%'")
+        for row in cursor.fetchall():
+            cursor.execute(f"DELETE FROM {row['name']}")
+        db.commit()
+    finally:
+        db.close()
+
+@pytest.fixture
+def app():
+    flask_app.testing = True
+    empty_database()
+    yield flask_app
+
+@pytest.fixture
+def client(app):
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture
+def db(app):
+    """A connection of its own, like the worker's"""
+    connection = connect_db()
+    yield connection
+    connection.close()
+
+@pytest.fixture
+def old_table(db, monkeypatch):
+    """old_table(table, create_sql) swaps table for one created by an earlier version; it is dropped afterwards"""
+    monkeypatch.setattr(functions, '_UPGRADED_TABLES', set())
+    replaced = []
+
+    def replace(table, create_sql):
+        cursor = db.cursor()
+        cursor.execute(f'DROP TABLE IF EXISTS {table}')
+        cursor.execute(create_sql)
+        db.commit()
+        replaced.append(table)
+
+    yield replace
+    for table in replaced:
+        db.cursor().execute(f'DROP TABLE IF EXISTS {table}')
+    db.commit()
+
+@pytest.fixture
+def wait_for():
+    """wait_for(condition) polls condition() until it is true, failing the test after a few seconds"""
+    def wait(condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, 'timed out waiting for condition'
+            time.sleep(0.02)
+    return wait
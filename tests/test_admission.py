@@ -0,0 +1,60 @@
+"""Admission control: per-client rate limits (429) and per-route concurrency slots (503)"""
+import pytest
+from flask import request
+
+import app.functions as functions
+from app.app_factory import create_app
+from app.functions import acquire_admission_slot, take_rate_token
+
+def test_rate_token_bucket(app, db):
+    assert take_rate_token(db, 'test:bucket', per_minute=6, burst=2) == 0
+    assert take_rate_token(db, 'test:bucket', per_minute=6, burst=2) == 0
+    assert take_rate_token(db, 'test:bucket', per_minute=6, burst=2) == 10  # one token every 10 seconds
+    assert take_rate_token(db, 'test:other', per_minute=6, burst=2) == 0
+
+def test_rate_limit_is_429_per_client(client):
+    burst = functions.ADMISSION_RULES['batches.batch_lookup']['burst']
+    for _ in range(burst):
+        assert client.post('/api/batch', json={}).status_code == 400
+
+    resp = client.post('/api/batch', json={})
+    assert resp.status_code == 429
+    assert int(resp.headers['Retry-After']) >= 1
+    assert resp.get_json()['retry_after'] == int(resp.headers['Retry-After'])
+
+    # Behind the router each client is told apart by X-Forwarded-For
+    other = client.post('/api/batch', json={}, headers={'X-Forwarded-For': '203.0.113.7'})
+    assert other.status_code == 400
+
+def test_unlimited_methods_pass(client):
+    for _ in range(5):
+        assert client.get('/chatbot/').status_code == 200
+
+def test_busy_route_is_503(client, monkeypatch):
+    monkeypatch.setattr(functions, 'ADMISSION_QUEUE_SIZE', 0)
+    endpoint = 'tickers.update_all_tickers'
+    assert acquire_admission_slot(endpoint)
+    try:
+        resp = client.get('/tickers/update-all', headers={'Accept': 'text/html'})
+        assert resp.status_code == 503
+        assert resp.headers['Retry-After'] == str(functions.ADMISSION_RETRY_AFTER_SECONDS)
+        assert resp.mimetype == 'text/html'
+    finally:
+        functions._ADMISSION_SLOTS[endpoint].release()
+
+    # The slot is back, and a finished request returns its own
+    assert client.get('/tickers/update-all').status_code != 503
+    assert acquire_admission_slot(endpoint)
+    functions._ADMISSION_SLOTS[endpoint].release()
+
+@pytest.mark.parametrize('hops, client_address', [(None, '127.0.0.1'), ('1', '203.0.113.7')])
+def test_forwarded_for_is_trusted_only_when_configured(monkeypatch, hops, client_address):
+    if hops is None:
+        monkeypatch.delenv('PROXY_FIX_HOPS')  # the default: no proxy, so the header could be spoofed
+    else:
+        monkeypatch.setenv('PROXY_FIX_HOPS', hops)
+    bare = create_app()
+    bare.add_url_rule('/address', 'address', lambda: request.remote_addr)
+
+    resp = bare.test_client().get('/address', headers={'X-Forwarded-For': '203.0.113.7'})
+    assert resp.get_data(as_text=True) == client_address
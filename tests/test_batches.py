@@ -0,0 +1,95 @@
+"""Batched lookups (/api/batch)"""
+import threading
+
+import pytest
+
+import app.blueprints.batches as batches_blueprint
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Stub the three upstream lookups; returns the list of calls made"""
+    calls = []
+    lock = threading.Lock()
+
+    def record(call):
+        with lock:
+            calls.append(call)
+
+    def get_stock_data(symbol):
+        record(('ticker', symbol))
+        if symbol == 'NOPE':
+            return None, 'Unknown symbol'
+        return {'symbol': symbol, 'price': 1.0}, None
+
+    def get_weather_data(city, state):
+        record(('weather', city))
+        return {'city': city, 'state': state}, None
+
+    def get_movie_data(title, year):
+        record(('movie', title))
+        return {'title': title, 'year': year}, None
+
+    monkeypatch.setattr(batches_blueprint, 'get_stock_data', get_stock_data)
+    monkeypatch.setattr(batches_blueprint, 'get_weather_data', get_weather_data)
+    monkeypatch.setattr(batches_blueprint, 'get_movie_data', get_movie_data)
+    return calls
+
+def test_results_come_back_in_request_order(client, upstream):
+    resp = client.post('/api/batch', json={'lookups': [
+        {'type': 'movie', 'title': 'Heat', 'year': '1995'},
+        {'type': 'ticker', 'symbol': 'aapl'},
+        {'type': 'weather', 'city': 'Atlanta', 'state': 'GA'},
+    ]})
+    assert resp.status_code == 200
+    results = resp.get_json()['results']
+    assert [item['type'] for item in results] == ['movie', 'ticker', 'weather']
+    assert all(item['ok'] for item in results)
+    assert results[1]['data'] == {'symbol': 'AAPL', 'price': 1.0, 'stale': False}
+
+def test_a_failing_item_fails_alone(client, upstream):
+    results = client.post('/api/batch', json={'lookups': [
+        {'type': 'ticker', 'symbol': 'NOPE'},
+        {'type': 'ticker'},
+        {'type': 'stock', 'symbol': 'AAPL'},
+        {'type': 'ticker', 'symbol': 'MSFT'},
+    ]}).get_json()['results']
+    assert [item['ok'] for item in results] == [False, False, False, True]
+    assert results[0]['error'] == 'Unknown symbol'
+    assert results[1]['error'] == 'Symbol is required'
+
+def test_identical_lookups_share_one_call(client, upstream):
+    results = client.post('/api/batch', json={'lookups': [
+        {'type': 'ticker', 'symbol': 'AAPL'},
+        {'type': 'ticker', 'symbol': 'aapl '},
+    ]}).get_json()['results']
+    assert results[0] == results[1]
+    assert upstream == [('ticker', 'AAPL')]
+
+@pytest.mark.parametrize('body', [
+    None,
+    [],
+    {'lookups': []},
+    {'lookups': 'AAPL'},
+    {'lookups': [{'type': 'ticker', 'symbol': f'T{i}'} for i in range(batches_blueprint.BATCH_MAX_LOOKUPS + 1)]},
+])
+def test_malformed_batches_are_400(client, upstream, body):
+    assert client.post('/api/batch', json=body).status_code == 400
+    assert upstream == []
+
+def test_slow_lookup_times_out_alone(client, upstream, monkeypatch):
+    release = threading.Event()
+
+    def get_movie_data(title, year):
+        release.wait(5)
+        return {'title': title}, None
+    monkeypatch.setattr(batches_blueprint, 'get_movie_data', get_movie_data)
+
+    try:
+        results = client.post('/api/batch', json={'timeout_ms': 100, 'lookups': [
+            {'type': 'movie', 'title': 'Heat'},
+            {'type': 'ticker', 'symbol': 'AAPL'},
+        ]}).get_json()['results']
+    finally:
+        release.set()
+    assert results[0] == {'type': 'movie', 'ok': False, 'error': 'Timed out waiting for the upstream API.'}
+    assert results[1]['ok']
@@ -0,0 +1,66 @@
+"""Circuit breakers around upstream APIs and serving stored rows while a refresh finishes"""
+import threading
+
+import pytest
+
+import app.blueprints.tickers as tickers_blueprint
+import app.functions as functions
+from app.functions import breaker_allows, record_upstream_result
+
+@pytest.fixture
+def breakers(monkeypatch):
+    monkeypatch.setattr(functions, '_BREAKERS', {})
+
+def test_breaker_opens_after_consecutive_failures(breakers):
+    for _ in range(functions.BREAKER_FAILURE_THRESHOLD - 1):
+        record_upstream_result('omdb', False, 0)
+    assert breaker_allows('omdb')
+    record_upstream_result('omdb', True, 0)  # a success resets the count
+    for _ in range(functions.BREAKER_FAILURE_THRESHOLD - 1):
+        record_upstream_result('omdb', False, 0)
+    assert breaker_allows('omdb')
+
+    record_upstream_result('omdb', True, functions.BREAKER_SLOW_SECONDS)  # too slow counts as a failure
+    assert not breaker_allows('omdb')
+    assert breaker_allows('openweathermap')
+
+def test_half_open_breaker_lets_one_probe_through(breakers, monkeypatch):
+    monkeypatch.setattr(functions, 'BREAKER_COOLDOWN_SECONDS', 0)
+    for _ in range(functions.BREAKER_FAILURE_THRESHOLD):
+        record_upstream_result('omdb', False, 0)
+
+    assert breaker_allows('omdb')
+    assert not breaker_allows('omdb')  # the probe is still out
+    record_upstream_result('omdb', False, 0)
+    assert functions._BREAKERS['omdb']['state'] == 'open'
+
+    assert breaker_allows('omdb')
+    record_upstream_result('omdb', True, 0)
+    assert functions._BREAKERS['omdb']['state'] == 'closed'
+    assert breaker_allows('omdb') and breaker_allows('omdb')
+
+def test_lookup_serves_the_stored_quote_while_the_api_is_slow(client, db, monkeypatch, wait_for):
+    release = threading.Event()
+
+    def get_stock_data(symbol):
+        release.wait(5)
+        return {'symbol': symbol, 'price': 200.0, 'change': 2.0, 'change_percent': '1%', 'volume': 10,
+                'latest_trading_day': '2026-10-16'}, None
+    monkeypatch.setattr(tickers_blueprint, 'get_stock_data', get_stock_data)
+
+    assert client.get('/tickers/').status_code == 200  # creates the tickers table
+    cursor = db.cursor()
+    cursor.execute("INSERT INTO tickers (symbol, name, price) VALUES ('AAPL', 'Apple', 100)")
+    db.commit()
+
+    resp = client.get('/tickers/lookup?symbol=aapl')
+    release.set()
+    assert resp.status_code == 200
+    assert resp.get_json()['price'] == 100.0
+    assert resp.get_json()['stale'] is True
+
+    # The fresh quote lands in the background and is stored for the next request
+    def refreshed():
+        cursor.execute("SELECT price FROM tickers WHERE symbol = 'AAPL'")
+        return float(cursor.fetchone()['price']) == 200.0
+    wait_for(refreshed)
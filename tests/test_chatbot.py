@@ -0,0 +1,49 @@
+"""Chatbot history: compressed answers, preview-only listing, /chatbot/answer/<id> and retention"""
+import pytest
+
+from app.blueprints.chatbot import HISTORY_PREVIEW_LENGTH, maintain_history_task, prepare_history_table, save_chat
+
+@pytest.fixture
+def history(db):
+    """Save one long answer; returns its id and text"""
+    answer = 'Paris is the capital of France. ' + 'x' * 2000 + ' The end.'
+    cursor = db.cursor()
+    prepare_history_table(cursor)
+    save_chat(cursor, 'What is the capital of France?', answer, 'llama-3.1-8b-instant')
+    db.commit()
+    return cursor.lastrowid, answer
+
+def test_listing_shows_previews_only(client, history):
+    _, answer = history
+    resp = client.get('/chatbot/')
+    assert resp.status_code == 200
+    assert b'What is the capital of France?' in resp.data
+    assert answer[:HISTORY_PREVIEW_LENGTH].encode() in resp.data
+    assert b'The end.' not in resp.data
+
+def test_answer_endpoint_returns_the_full_answer(client, history):
+    chat_id, answer = history
+    resp = client.get(f'/chatbot/answer/{chat_id}')
+    assert resp.status_code == 200
+    assert resp.get_json() == {'id': chat_id, 'question': 'What is the capital of France?', 'answer': answer,
+                               'model': 'llama-3.1-8b-instant'}
+
+def test_unknown_answer_is_404(client, history):
+    assert client.get('/chatbot/answer/999999').status_code == 404
+
+def test_delete_chat(client, db, history):
+    chat_id, _ = history
+    assert client.get(f'/chatbot/delete/{chat_id}').status_code == 302
+    assert client.get(f'/chatbot/answer/{chat_id}').status_code == 404
+
+def test_maintenance_drops_expired_history(db, history):
+    chat_id, _ = history
+    cursor = db.cursor()
+    save_chat(cursor, 'Old question', 'Old answer', 'llama-3.1-8b-instant')
+    cursor.execute("UPDATE chatbot_history SET created_at = '2000-01-01 00:00:00' WHERE question = 'Old question'")
+    db.commit()
+
+    maintain_history_task(db)
+    db.commit()
+    cursor.execute('SELECT id FROM chatbot_history')
+    assert cursor.fetchall() == [{'id': chat_id}]
@@ -0,0 +1,47 @@
+"""Response compression and the lean JSON responses of the lookup endpoints"""
+import gzip
+
+import app.blueprints.tickers as tickers_blueprint
+
+def test_pages_are_gzipped_when_accepted(client):
+    plain = client.get('/chatbot/')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    resp = client.get('/chatbot/', headers={'Accept-Encoding': 'gzip'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(resp.data) == plain.data
+
+def test_small_responses_are_sent_as_is(client):
+    resp = client.get('/tickers/lookup', headers={'Accept-Encoding': 'gzip'})
+    assert resp.status_code == 400
+    assert 'Content-Encoding' not in resp.headers
+    assert resp.get_json() == {'error': 'Symbol is required'}
+
+def test_streamed_exports_are_compressed(client, db):
+    assert client.get('/tickers/').status_code == 200  # creates the tickers table
+    cursor = db.cursor()
+    cursor.executemany('INSERT INTO tickers (symbol, name, price) VALUES (%s, %s, 1)',
+                       [(f'T{i}', f'Ticker {i}') for i in range(50)])
+    db.commit()
+
+    resp = client.get('/tickers/export', headers={'Accept-Encoding': 'gzip'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in resp.headers
+    assert gzip.decompress(resp.data).decode().count('\n') == 51
+
+def test_event_streams_are_never_compressed(client):
+    assert client.get('/weather/').status_code == 200  # creates the weather table
+    resp = client.get('/weather/stream', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in resp.headers
+    resp.close()
+
+def test_lookup_returns_only_requested_fields(client, monkeypatch):
+    monkeypatch.setattr(tickers_blueprint, 'get_stock_data', lambda symbol: (
+        {'symbol': symbol, 'price': 1.5, 'change': 0, 'change_percent': '0%', 'volume': 1,
+         'latest_trading_day': '2026-10-16'}, None))
+    resp = client.get('/tickers/lookup?symbol=AAPL&fields=symbol,price')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/json'
+    assert set(resp.get_json()) <= {'symbol', 'price', 'stale', 'nearby'}
+    assert resp.get_json()['price'] == 1.5
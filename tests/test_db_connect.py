@@ -0,0 +1,38 @@
+"""Per-request connections: lazily opened primary, listing reads and the 503 when the database is down"""
+import pytest
+from flask import g
+
+import app.db_connect as db_connect
+from app.db_connect import DB_ERRORS, fetch_listing
+
+def test_listing_pages_200_on_an_empty_database(client):
+    for url in ('/tickers/', '/weather/', '/movies/', '/chatbot/'):
+        assert client.get(url).status_code == 200
+
+def test_fetch_listing_creates_a_missing_table(app):
+    with app.test_request_context('/'):
+        create = lambda cursor: cursor.execute('CREATE TABLE IF NOT EXISTS listing_test (id INT AUTO_INCREMENT PRIMARY KEY)')
+        assert fetch_listing('SELECT * FROM listing_test', create) == []
+        assert fetch_listing('SELECT * FROM listing_test', create) == []
+
+def test_fetch_listing_raises_other_errors(app, db):
+    db.cursor().execute('CREATE TABLE IF NOT EXISTS listing_test (id INT AUTO_INCREMENT PRIMARY KEY)')
+    db.commit()
+    with app.test_request_context('/'):
+        with pytest.raises(DB_ERRORS):
+            fetch_listing('SELECT no_such_column FROM listing_test', lambda cursor: pytest.fail('must not create'))
+
+def test_requests_open_the_primary_only_when_used(app):
+    with app.test_request_context('/'):
+        app.preprocess_request()
+        assert g.get('db') is None
+
+def test_database_unavailable_is_503(client, monkeypatch):
+    def refuse():
+        raise ConnectionRefusedError('database is down')
+    monkeypatch.setattr(db_connect, 'connect_db', refuse)
+
+    assert client.get('/').status_code == 200  # the home page doesn't need the database
+    resp = client.get('/tickers/')
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After'] == '30'
@@ -0,0 +1,93 @@
+"""The embedded SQLite backend: MySQL translation and the PyMySQL-like connection"""
+import pymysql.cursors
+import pytest
+
+from app.db_sqlite import connect_sqlite, translate_sql
+
+CREATE_ITEMS = '''
+    CREATE TABLE IF NOT EXISTS items (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(50) NOT NULL,
+        hits INT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_items_name (name),
+        KEY idx_items_updated_at (updated_at)
+    ) ENGINE=InnoDB
+'''
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_SQLITE_PATH', str(tmp_path / 'test.sqlite3'))
+    connection = connect_sqlite()
+    connection.cursor().execute(CREATE_ITEMS)
+    connection.commit()
+    yield connection
+    connection.close()
+
+def test_translate_create_table():
+    statements, lock, upsert = translate_sql(CREATE_ITEMS, None)
+    assert 'id INTEGER PRIMARY KEY AUTOINCREMENT' in statements[0]
+    assert 'ENGINE' not in statements[0] and 'ON UPDATE' not in statements[0]
+    assert 'CREATE UNIQUE INDEX IF NOT EXISTS uq_items_name ON items (name)' in statements
+    assert any(statement.lstrip().startswith('CREATE TRIGGER IF NOT EXISTS items_updated_at_on_update')
+               for statement in statements)
+    assert (lock, upsert) == (False, None)
+
+def test_translate_dialect():
+    statements, lock, _ = translate_sql('SELECT * FROM jobs WHERE run_at <= NOW() - INTERVAL %s MINUTE FOR UPDATE',
+                                        'format')
+    assert statements == ("SELECT * FROM jobs WHERE run_at <= datetime('now', 'localtime', '-' || ? || ' minutes')",)
+    assert lock
+    assert translate_sql('INSERT IGNORE INTO t (a) VALUES (%(a)s)', 'pyformat')[0] == (
+        'INSERT OR IGNORE INTO t (a) VALUES (:a)',)
+    assert translate_sql('TRUNCATE TABLE t', None)[0] == ('DELETE FROM t',)
+    assert translate_sql('SET SESSION net_write_timeout = %s', 'format')[0] == ()
+
+def test_translate_upsert():
+    statements, _, upsert = translate_sql(
+        'INSERT INTO t (a, b) VALUES (%s, %s) ON DUPLICATE KEY UPDATE b = VALUES(b) + %s', 'format')
+    assert statements == ('INSERT INTO t (a, b) VALUES (?, ?) ON CONFLICT DO UPDATE SET b = excluded.b + ?',)
+    assert upsert == ('INSERT INTO t (a, b) VALUES (?, ?) ON CONFLICT DO NOTHING', 1)
+
+def test_rowcounts_match_mysql(sqlite_db):
+    cursor = sqlite_db.cursor()
+    upsert = 'INSERT INTO items (name, hits) VALUES (%s, 1) ON DUPLICATE KEY UPDATE hits = hits + %s'
+    assert cursor.execute(upsert, ('a', 1)) == 1
+    first_id = cursor.lastrowid
+    assert cursor.execute(upsert, ('a', 5)) == 2
+    assert cursor.execute('INSERT IGNORE INTO items (name) VALUES (%s)', ('a',)) == 0
+    assert cursor.execute('INSERT IGNORE INTO items (name) VALUES (%s)', ('b',)) == 1
+
+    cursor.execute('SELECT id, hits FROM items WHERE name = %(name)s', {'name': 'a'})
+    assert cursor.fetchone() == {'id': first_id, 'hits': 6}
+
+def test_on_update_timestamp(sqlite_db):
+    cursor = sqlite_db.cursor()
+    cursor.execute("INSERT INTO items (name, updated_at) VALUES ('a', '2000-01-01 00:00:00')")
+    cursor.execute("UPDATE items SET hits = 1 WHERE name = 'a'")
+    cursor.execute("SELECT TIMESTAMPDIFF(SECOND, updated_at, NOW()) AS age FROM items WHERE name = 'a'")
+    assert cursor.fetchone()['age'] < 60
+
+def test_cursor_classes_and_close(sqlite_db):
+    cursor = sqlite_db.cursor()
+    cursor.executemany('INSERT INTO items (name) VALUES (%s)', [('a',), ('b',)])
+    sqlite_db.commit()
+    cursor.execute("INSERT INTO items (name) VALUES ('uncommitted')")
+
+    rows = sqlite_db.cursor(pymysql.cursors.SSCursor)
+    rows.execute('SELECT name FROM items ORDER BY id')
+    assert rows.fetchmany(10) == [('a',), ('b',), ('uncommitted',)]
+
+    sqlite_db.close()
+    assert not sqlite_db.open
+    with pytest.raises(Exception):
+        sqlite_db.ping()
+
+    # Closing rolled back the uncommitted insert before the connection went back to the pool
+    other = connect_sqlite()
+    try:
+        other_cursor = other.cursor()
+        other_cursor.execute('SELECT COUNT(*) AS n FROM items')
+        assert other_cursor.fetchone() == {'n': 2}
+    finally:
+        other.close()
@@ -0,0 +1,54 @@
+"""Streaming exports (/tickers/export, /weather/export, /movies/export)"""
+import csv
+import io
+import json
+
+import pytest
+
+def add_tickers(db, *symbols):
+    cursor = db.cursor()
+    for symbol in symbols:
+        cursor.execute('INSERT INTO tickers (symbol, name, price) VALUES (%s, %s, %s)', (symbol, symbol.title(), 10))
+    db.commit()
+
+@pytest.fixture
+def tickers_table(client):
+    assert client.get('/tickers/').status_code == 200  # creates the tickers table
+
+def test_csv_export(client, db, tickers_table):
+    add_tickers(db, 'AAPL', 'MSFT')
+    resp = client.get('/tickers/export')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/csv'
+    assert resp.headers['Content-Disposition'].startswith('attachment; filename="tickers-')
+    rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+    assert sorted(row['symbol'] for row in rows) == ['AAPL', 'MSFT']
+
+def test_jsonl_export(client, db, tickers_table):
+    add_tickers(db, 'AAPL')
+    resp = client.get('/tickers/export?format=jsonl')
+    assert resp.status_code == 200
+    lines = resp.get_data(as_text=True).splitlines()
+    assert [json.loads(line)['symbol'] for line in lines] == ['AAPL']
+
+def test_since_exports_only_newer_rows(client, db, tickers_table):
+    add_tickers(db, 'AAPL', 'MSFT')
+    cursor = db.cursor()
+    cursor.execute("UPDATE tickers SET last_updated = '2020-01-01 00:00:00' WHERE symbol = 'AAPL'")
+    db.commit()
+
+    resp = client.get('/tickers/export', query_string={'format': 'jsonl', 'since': '2024-01-01T00:00:00'})
+    assert resp.status_code == 200
+    assert [json.loads(line)['symbol'] for line in resp.get_data(as_text=True).splitlines()] == ['MSFT']
+    assert resp.headers['X-Export-Next-Since'] > '2024-01-01T00:00:00'
+
+@pytest.mark.parametrize('query', ['format=xml', 'since=yesterday'])
+def test_bad_arguments_are_400(client, tickers_table, query):
+    resp = client.get(f'/tickers/export?{query}')
+    assert resp.status_code == 400
+    assert 'error' in resp.get_json()
+
+def test_parquet_without_pyarrow_is_400(client, tickers_table, monkeypatch):
+    import app.functions as functions
+    monkeypatch.setattr(functions, 'parquet_available', lambda: False)
+    assert client.get('/tickers/export?format=parquet').status_code == 400
@@ -0,0 +1,87 @@
+"""Hedged upstream GETs: delay from recent latencies, the hedge budget, and the faster attempt winning"""
+import threading
+import time
+from collections import deque
+
+import pytest
+
+import app.functions as functions
+from app.functions import HEDGE_MIN_SAMPLES, hedge_delay, record_upstream_result, upstream_get
+
+class FakeResponse:
+    def __init__(self, attempt):
+        self.attempt = attempt
+        self.status_code = 200
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Fresh breakers, latencies and budget, and a fake requests.get whose delay per attempt is set by the test"""
+    monkeypatch.setattr(functions, '_BREAKERS', {})
+    monkeypatch.setattr(functions, '_UPSTREAM_LATENCIES', {})
+    monkeypatch.setattr(functions, '_HEDGE_BUDGET', {'tokens': float(functions.HEDGE_BUDGET_BURST)})
+
+    state = {'delays': [], 'responses': []}
+    lock = threading.Lock()
+
+    def get(url, timeout):
+        with lock:
+            attempt = len(state['responses'])
+            response = FakeResponse(attempt)
+            state['responses'].append(response)
+        time.sleep(state['delays'][attempt] if attempt < len(state['delays']) else 0)
+        return response
+    monkeypatch.setattr(functions.requests, 'get', get)
+    return state
+
+def warm_up(name, latency=0.01):
+    """Record enough fast calls for upstream name to be hedged"""
+    functions._UPSTREAM_LATENCIES[name] = deque([latency] * HEDGE_MIN_SAMPLES)
+
+def test_hedge_delay(upstream):
+    assert hedge_delay('omdb') is None  # no samples yet
+    assert hedge_delay('alphavantage') is None  # not in HEDGE_UPSTREAMS
+
+    functions._UPSTREAM_LATENCIES['omdb'] = deque([0.1] * 18 + [0.4, 0.9])
+    assert hedge_delay('omdb') == 0.9  # the p95 of 20 samples is the slowest one
+    warm_up('omdb')
+    assert hedge_delay('omdb') == functions.HEDGE_MIN_DELAY_SECONDS
+
+    for _ in range(functions.BREAKER_FAILURE_THRESHOLD):
+        record_upstream_result('omdb', False, 0)
+    assert hedge_delay('omdb') is None  # never hedge into an open breaker
+
+def test_slow_call_is_hedged_and_the_faster_attempt_wins(upstream):
+    warm_up('omdb')
+    upstream['delays'] = [0.4, 0]
+
+    started = time.monotonic()
+    response = upstream_get('omdb', 'https://example.test/movie')
+    assert time.monotonic() - started < 0.3
+    assert response.attempt == 1
+    assert functions._HEDGE_BUDGET['tokens'] < functions.HEDGE_BUDGET_BURST - 0.9
+
+    # The losing attempt's response is released when it lands
+    assert upstream['responses'][0].closed.wait(2)
+
+def test_fast_call_is_not_hedged(upstream):
+    warm_up('omdb')
+    assert upstream_get('omdb', 'https://example.test/movie').attempt == 0
+    time.sleep(2 * functions.HEDGE_MIN_DELAY_SECONDS)
+    assert len(upstream['responses']) == 1
+
+def test_no_hedge_without_budget(upstream):
+    warm_up('omdb')
+    functions._HEDGE_BUDGET['tokens'] = 0
+    upstream['delays'] = [0.2]
+    assert upstream_get('omdb', 'https://example.test/movie').attempt == 0
+    assert len(upstream['responses']) == 1
+
+def test_successful_calls_feed_the_latency_window(upstream):
+    for _ in range(HEDGE_MIN_SAMPLES):
+        upstream_get('openweathermap', 'https://example.test/weather')
+    assert len(functions._UPSTREAM_LATENCIES['openweathermap']) == HEDGE_MIN_SAMPLES
+    assert hedge_delay('openweathermap') == functions.HEDGE_MIN_DELAY_SECONDS
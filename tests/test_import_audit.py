@@ -0,0 +1,32 @@
+"""flask import-audit: import cost of a cold start, and the SDKs it must not load"""
+import builtins
+
+def test_import_audit_reports_the_cost_of_importing_the_app(app):
+    result = app.test_cli_runner().invoke(args=['import-audit', '--limit', '5'])
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert lines[0].startswith('Total import time for app: ')
+    assert lines[1].startswith('Peak RSS of importing process: ') and lines[1].endswith(' MB')
+    assert 'Slowest 5 modules by cumulative time (ms):' in lines
+    assert len(lines) == 3 + 2 * (1 + 5) + 1
+
+    # The chatbot's SDK is imported by the first question, not at boot
+    assert 'groq' not in {line.split()[-1] for line in lines if line}
+
+def test_import_audit_reports_a_failed_import(app):
+    result = app.test_cli_runner().invoke(args=['import-audit', '--module', 'no_such_module'])
+    assert result.output.splitlines()[0] == 'Import of no_such_module failed:'
+    assert 'No module named' in result.output
+
+def test_import_audit_without_the_resource_module(app, monkeypatch):
+    real_import = builtins.__import__
+
+    def import_without_resource(name, *args, **kwargs):
+        if name == 'resource':
+            raise ImportError('No module named resource')  # as on Windows
+        return real_import(name, *args, **kwargs)
+    monkeypatch.setattr(builtins, '__import__', import_without_resource)
+
+    result = app.test_cli_runner().invoke(args=['import-audit', '--module', 'json', '--limit', '1'])
+    assert result.exit_code == 0, result.output
+    assert 'Peak RSS of importing process: not available on this platform' in result.output
@@ -0,0 +1,69 @@
+"""Background job queue and the /jobs/<id> status endpoint"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.db_connect import connect_db
+from app.functions import enqueue_job, get_job, register_job_handler
+
+def test_enqueue_reuses_the_active_job(app, db, wait_for):
+    release = threading.Event()
+    register_job_handler('test_blocking', lambda db, payload, progress: release.wait(5) and 'finished')
+
+    with app.app_context():
+        first = enqueue_job(db, 'test_blocking', {'n': 1})
+        assert enqueue_job(db, 'test_blocking', {'n': 1}) == first
+        assert enqueue_job(db, 'test_blocking', {'n': 2}) != first
+
+        wait_for(lambda: get_job(db, first)['status'] == 'running')
+        assert enqueue_job(db, 'test_blocking', {'n': 1}) == first
+
+        release.set()
+        wait_for(lambda: get_job(db, first)['status'] == 'done')
+        assert enqueue_job(db, 'test_blocking', {'n': 1}) != first
+
+def test_concurrent_enqueues_create_one_job(app):
+    release = threading.Event()
+    register_job_handler('test_concurrent', lambda db, payload, progress: release.wait(5))
+
+    def enqueue(_):
+        with app.app_context():
+            connection = connect_db()
+            try:
+                return enqueue_job(connection, 'test_concurrent')
+            finally:
+                connection.close()
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            assert len(set(pool.map(enqueue, range(32)))) == 1
+    finally:
+        release.set()
+
+def test_failed_job_is_retried_later(app, db, wait_for):
+    def fail(db, payload, progress):
+        raise RuntimeError('upstream down')
+    register_job_handler('test_failing', fail)
+
+    with app.app_context():
+        job_id = enqueue_job(db, 'test_failing')
+    wait_for(lambda: get_job(db, job_id)['attempts'] == 1 and get_job(db, job_id)['status'] == 'queued')
+    job = get_job(db, job_id)
+    assert job['last_error'] == 'upstream down'
+    assert job['run_at'] > job['updated_at']
+
+def test_job_status_endpoint(client, db, wait_for):
+    register_job_handler('test_progress', lambda db, payload, progress: progress(2, 2) or {'updated': 2})
+
+    with client.application.app_context():
+        job_id = enqueue_job(db, 'test_progress')
+    wait_for(lambda: get_job(db, job_id)['status'] == 'done')
+
+    resp = client.get(f'/jobs/{job_id}')
+    assert resp.status_code == 200
+    assert resp.get_json()['result'] == {'updated': 2}
+    assert resp.get_json()['progress'] == resp.get_json()['progress_total'] == 2
+
+def test_unknown_job_is_404(client, db):
+    with client.application.app_context():
+        enqueue_job(db, 'test_never_registered')
+    assert client.get('/jobs/999999').status_code == 404
@@ -0,0 +1,106 @@
+"""Movies: the similar-movies cache and the debounced worker job that keeps it fresh"""
+import json
+
+import pytest
+
+import app.blueprints.movies as movies_blueprint
+from app.blueprints.movies import rebuild_movie_similarities, refresh_similar_movies_job
+
+FIELDS = ('title', 'year', 'rated', 'released', 'runtime', 'genre', 'director', 'writer', 'actors', 'plot',
+          'language', 'country', 'awards', 'poster', 'imdb_rating', 'imdb_votes', 'box_office', 'imdb_id')
+
+CATALOGUE = {
+    'Heat': ('Crime, Drama', 'Michael Mann', 'Al Pacino, Robert De Niro', 'A detective hunts a crew of bank robbers.'),
+    'Collateral': ('Crime, Drama', 'Michael Mann', 'Tom Cruise, Jamie Foxx', 'A cab driver is held by a hitman.'),
+    'Thief': ('Crime, Drama', 'Michael Mann', 'James Caan', 'A safecracker plans one last heist with robbers.'),
+    'Up': ('Animation, Family', 'Pete Docter', 'Ed Asner', 'An old man flies his house with balloons.'),
+}
+
+def movie_data(title):
+    genre, director, actors, plot = CATALOGUE[title]
+    data = dict.fromkeys(FIELDS, 'N/A')
+    data.update(title=title, year='1995', genre=genre, director=director, actors=actors, plot=plot)
+    return data
+
+@pytest.fixture
+def omdb(monkeypatch):
+    monkeypatch.setattr(movies_blueprint, 'get_movie_data', lambda title, year=None: (movie_data(title), None))
+
+@pytest.fixture
+def movies_table(client):
+    assert client.get('/movies/').status_code == 200  # creates the movies table
+
+def add_movies(db, *titles):
+    cursor = db.cursor()
+    ids = {}
+    for title in titles:
+        data = movie_data(title)
+        cursor.execute(f"INSERT INTO movies ({', '.join(FIELDS)}) VALUES ({', '.join(['%s'] * len(FIELDS))})",
+                       [data[field] for field in FIELDS])
+        ids[title] = cursor.lastrowid
+    db.commit()
+    return ids
+
+def similar_to(db, movie_id):
+    cursor = db.cursor()
+    cursor.execute('SELECT similar_id FROM movie_similarities WHERE movie_id = %s ORDER BY score DESC', (movie_id,))
+    return [row['similar_id'] for row in cursor.fetchall()]
+
+def test_rebuild_links_related_movies(db, movies_table):
+    ids = add_movies(db, 'Heat', 'Collateral', 'Thief', 'Up')
+    assert rebuild_movie_similarities(db) == 4
+    assert set(similar_to(db, ids['Heat'])) == {ids['Collateral'], ids['Thief']}
+    assert similar_to(db, ids['Up']) == []
+
+def test_refresh_job_picks_up_added_and_deleted_movies(db, movies_table):
+    ids = add_movies(db, 'Heat', 'Collateral')
+    rebuild_movie_similarities(db)
+
+    ids.update(add_movies(db, 'Thief'))
+    assert refresh_similar_movies_job(db, {}, lambda done, total: None) == {'movies': 3}
+    assert ids['Thief'] in similar_to(db, ids['Heat'])
+    assert set(similar_to(db, ids['Thief'])) == {ids['Heat'], ids['Collateral']}
+
+    cursor = db.cursor()
+    cursor.execute('DELETE FROM movies WHERE id = %s', (ids['Thief'],))
+    db.commit()
+    refresh_similar_movies_job(db, {}, lambda done, total: None)
+    cursor.execute('SELECT COUNT(*) AS n FROM movie_similarities WHERE movie_id = %s OR similar_id = %s',
+                   (ids['Thief'], ids['Thief']))
+    assert cursor.fetchone()['n'] == 0
+    assert similar_to(db, ids['Heat']) == [ids['Collateral']]
+
+def test_changes_in_one_window_share_a_delayed_job(client, db, omdb, movies_table, monkeypatch):
+    monkeypatch.setattr(movies_blueprint, 'SIMILAR_MOVIES_DEBOUNCE_SECONDS', 3600)
+    for title in ('Heat', 'Collateral', 'Thief'):
+        assert client.post('/movies/', data={'title': title}).status_code == 302
+    cursor = db.cursor()
+    cursor.execute("SELECT id FROM movies WHERE title = 'Thief'")
+    assert client.get(f"/movies/delete/{cursor.fetchone()['id']}").status_code == 302
+
+    cursor.execute("""SELECT payload, status, TIMESTAMPDIFF(SECOND, NOW(), run_at) AS delay FROM jobs
+                      WHERE job_type = 'refresh_similar_movies'""")
+    jobs = cursor.fetchall()
+    assert len(jobs) == 1
+    assert jobs[0]['status'] == 'queued' and 0 < jobs[0]['delay'] <= 3601
+    assert json.loads(jobs[0]['payload'])['window_end'] % 3600 == 0
+
+def test_adding_a_movie_refreshes_similar_movies_in_the_worker(client, db, omdb, movies_table, wait_for,
+                                                               monkeypatch):
+    monkeypatch.setattr(movies_blueprint, 'SIMILAR_MOVIES_DEBOUNCE_SECONDS', 1)
+    for title in ('Heat', 'Collateral'):
+        assert client.post('/movies/', data={'title': title}).status_code == 302
+
+    cursor = db.cursor()
+    cursor.execute("SELECT id FROM movies WHERE title = 'Heat'")
+    heat_id = cursor.fetchone()['id']
+
+    def jobs_done():
+        cursor.execute("SELECT status FROM jobs WHERE job_type = 'refresh_similar_movies'")
+        statuses = [row['status'] for row in cursor.fetchall()]
+        return statuses and set(statuses) == {'done'}
+    wait_for(jobs_done)
+
+    page = client.get(f'/movies/view/{heat_id}')
+    assert page.status_code == 200
+    assert b'Collateral' in page.data
@@ -0,0 +1,95 @@
+"""Request profiling: tokens, profile files and the /profiles/ pages"""
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+import app.blueprints.profiles as profiles_blueprint
+import app.functions as functions
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(functions, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(profiles_blueprint, 'PROFILE_DIR', str(tmp_path))
+    return tmp_path
+
+@pytest.fixture
+def token(app):
+    with app.app_context():
+        return functions.make_profile_token()
+
+def test_profiles_are_404_without_a_token(client, profile_dir):
+    assert client.get('/profiles/').status_code == 404
+    assert client.get('/profiles/?profile=forged').status_code == 404
+
+def test_token_profiles_a_request(client, profile_dir, token):
+    resp = client.get('/tickers/', headers={'X-Profile': token})
+    assert resp.status_code == 200
+    profile_id = resp.headers['X-Profile-Id']
+    assert (profile_dir / f'{profile_id}.json').exists()
+    assert (profile_dir / f'{profile_id}.folded').exists()
+
+    listing = client.get(f'/profiles/?profile={token}')
+    assert listing.status_code == 200
+    assert profile_id.encode() in listing.data
+    # The token is remembered in the session, so the profile's own page needs no query string
+    page = client.get(f'/profiles/{profile_id}')
+    assert page.status_code == 200
+    assert b'/tickers/' in page.data
+
+# Runs in its own process: gevent has to patch the standard library before anything imports it
+GEVENT_WORKER_SCRIPT = textwrap.dedent('''
+    from gevent import monkey
+    monkey.patch_all()
+
+    import json, sys, time
+    import gevent
+    from app import app
+    from app.functions import load_profile, make_profile_token
+
+    @app.route('/busy')
+    def busy():
+        started = time.monotonic()
+        while time.monotonic() - started < 0.05:
+            sum(range(1000))
+        gevent.sleep(0.05)
+        return 'done'
+
+    with app.app_context():
+        token = make_profile_token()
+    # Like the gevent gunicorn worker: each request is handled in its own greenlet
+    response = gevent.spawn(app.test_client().get, '/busy', headers={'X-Profile': token}).get()
+    json.dump(load_profile(response.headers['X-Profile-Id']), sys.stdout)
+''')
+
+def test_profiles_requests_under_the_gevent_worker(profile_dir):
+    env = dict(os.environ, PROFILE_DIR=str(profile_dir), PROFILE_INTERVAL_MS='2')
+    result = subprocess.run([sys.executable, '-c', GEVENT_WORKER_SCRIPT], env=env, capture_output=True, text=True,
+                            timeout=60, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert result.returncode == 0, result.stderr
+    profile = json.loads(result.stdout.strip().splitlines()[-1])
+    assert profile['samples'] > 0
+    stacks = (profile_dir / f"{profile['id']}.folded").read_text()
+    assert 'busy (' in stacks
+
+def test_unprofiled_requests_write_nothing(client, profile_dir):
+    resp = client.get('/tickers/')
+    assert 'X-Profile-Id' not in resp.headers
+    assert list(profile_dir.iterdir()) == []
+
+@pytest.mark.parametrize('secret_key', ['', 'your-secret', 'change_me'])
+def test_profiling_is_off_without_a_real_secret_key(app, client, profile_dir, token, monkeypatch, secret_key):
+    monkeypatch.setenv('SECRET_KEY', secret_key)
+    assert client.get(f'/profiles/?profile={token}').status_code == 404
+    assert 'X-Profile-Id' not in client.get('/tickers/', headers={'X-Profile': token}).headers
+    with app.app_context(), pytest.raises(RuntimeError):
+        functions.make_profile_token()
+
+def test_profile_token_command(app):
+    result = app.test_cli_runner().invoke(args=['profile-token'])
+    assert result.exit_code == 0
+    with app.app_context():
+        assert functions.profile_token_valid(result.output.splitlines()[0])
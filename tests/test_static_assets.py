@@ -0,0 +1,69 @@
+"""Static asset pipeline: flask build-assets, the manifest, and serving fingerprinted files"""
+import gzip
+import os
+import shutil
+
+import pytest
+from flask import url_for
+
+from app.app_factory import create_app
+from app.functions import STATIC_CACHE_SECONDS, STATIC_DIST_DIR, build_static_assets, load_static_manifest
+
+def test_build_fingerprints_and_precompresses(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'css' / 'site.css').write_text('body { color: red; }\n' * 50)
+    (tmp_path / 'logo.jpg').write_bytes(b'\xff\xd8 not really a jpeg')
+
+    manifest = build_static_assets(str(tmp_path))
+    css, jpg = manifest['files']['css/site.css'], manifest['files']['logo.jpg']
+    assert css.startswith(f'{STATIC_DIST_DIR}/css/site.') and css.endswith('.css')
+    assert (tmp_path / css).read_text() == (tmp_path / 'css' / 'site.css').read_text()
+    assert gzip.decompress((tmp_path / (css + '.gz')).read_bytes()) == (tmp_path / css).read_bytes()
+    assert not (tmp_path / (jpg + '.gz')).exists()  # images are copied as they are
+    assert load_static_manifest(str(tmp_path)) == manifest
+
+    # Rebuilding skips dist/ itself and gives unchanged files the same name
+    assert build_static_assets(str(tmp_path)) == manifest
+    (tmp_path / 'css' / 'site.css').write_text('body { color: blue; }\n')
+    assert build_static_assets(str(tmp_path))['files']['css/site.css'] != css
+
+def test_missing_manifest_leaves_static_urls_alone(tmp_path):
+    assert load_static_manifest(str(tmp_path)) == {'files': {}}
+
+@pytest.fixture
+def built_app(app):
+    """A fresh app created after `flask build-assets` ran on the real static folder (removed afterwards)"""
+    dist = os.path.join(app.static_folder, STATIC_DIST_DIR)
+    if os.path.exists(dist):
+        pytest.skip('app/static/dist holds a real build; not replacing it')
+    try:
+        result = app.test_cli_runner().invoke(args=['build-assets'])
+        assert result.exit_code == 0, result.output
+        assert result.output.startswith('Built 3 asset(s) in ')
+        yield create_app()
+    finally:
+        shutil.rmtree(dist, ignore_errors=True)
+
+def test_fingerprinted_assets_are_served_precompressed_and_immutable(built_app):
+    with built_app.test_request_context():
+        href = url_for('static', filename='assets/site.css')
+    assert href.startswith(f'/static/{STATIC_DIST_DIR}/assets/site.') and href.endswith('.css')
+
+    client = built_app.test_client()
+    plain = client.get(href)
+    assert plain.status_code == 200
+    assert plain.mimetype == 'text/css'
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.cache_control.immutable and plain.cache_control.public
+    assert plain.cache_control.max_age == STATIC_CACHE_SECONDS
+
+    compressed = client.get(href, headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == plain.data
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+
+def test_unhashed_static_files_are_not_cached_forever(built_app):
+    resp = built_app.test_client().get('/static/assets/site.css')
+    assert resp.status_code == 200
+    assert not resp.cache_control.immutable
+    resp.close()
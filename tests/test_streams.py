@@ -0,0 +1,38 @@
+"""Live update streams (/tickers/stream, /weather/stream)"""
+import json
+
+from app.functions import stream_events
+
+def next_event(events):
+    """Next non-keepalive SSE message from a stream_events() generator as (event type, data)"""
+    while True:
+        message = next(events)
+        if message.startswith('event: '):
+            event_line, data_line = message.strip().split('\n')
+            return event_line[len('event: '):], json.loads(data_line[len('data: '):])
+
+def test_stream_endpoint_is_event_stream(client):
+    assert client.get('/tickers/').status_code == 200  # creates the tickers table
+    resp = client.get('/tickers/stream')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/event-stream'
+    assert next(resp.response).startswith(b'retry: ')
+    resp.close()
+
+def test_changes_and_deletes_reach_subscribers(client, db):
+    assert client.get('/weather/').status_code == 200  # creates the weather table
+    events = stream_events('weather')
+    next(events)
+
+    cursor = db.cursor()
+    cursor.execute("INSERT INTO weather (city, state, temperature, description) VALUES ('Atlanta', 'GA', 71, 'clear')")
+    db.commit()
+    event_type, row = next_event(events)
+    assert (event_type, row['city']) == ('update', 'Atlanta')
+
+    # The delete goes through the database, so subscribers in other processes see it too
+    assert client.get(f"/weather/delete/{row['id']}").status_code == 302
+    assert next_event(events) == ('delete', {'id': row['id']})
+    cursor.execute('SELECT channel, row_id FROM stream_deletions')
+    assert cursor.fetchall() == [{'channel': 'weather', 'row_id': row['id']}]
+    events.close()
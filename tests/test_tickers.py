@@ -0,0 +1,69 @@
+"""Tickers pages: listing, and one row per symbol when a symbol is added twice"""
+import pytest
+
+import app.blueprints.tickers as tickers_blueprint
+from app.functions import index_exists
+
+# The tickers table as created before symbols were unique
+OLD_TICKERS_TABLE = '''
+    CREATE TABLE tickers (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        symbol VARCHAR(10) NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        price DECIMAL(10, 2) NOT NULL,
+        change_amount DECIMAL(10, 2) DEFAULT 0,
+        change_percent VARCHAR(20) DEFAULT '0%',
+        volume BIGINT DEFAULT 0,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+@pytest.fixture
+def stock_api(monkeypatch):
+    """Stub Alpha Vantage with a fixed quote"""
+    def get_stock_data(symbol):
+        return {'symbol': symbol, 'price': 123.45, 'change': 1.5, 'change_percent': '1.23%',
+                'volume': 1000, 'latest_trading_day': '2026-10-16'}, None
+    monkeypatch.setattr(tickers_blueprint, 'get_stock_data', get_stock_data)
+
+def test_tickers_list_200(client):
+    assert client.get('/tickers/').status_code == 200
+
+def test_add_ticker_redirects(client, stock_api):
+    resp = client.post('/tickers/', data={'ticker_symbol': 'aapl'})
+    assert resp.status_code == 302
+    assert resp.headers['Location'].endswith('/tickers/')
+
+def test_adding_a_tracked_symbol_updates_it(client, db, stock_api):
+    first = client.post('/tickers/', data={'ticker_symbol': 'MSFT'}, follow_redirects=True)
+    assert b'added successfully' in first.data
+    second = client.post('/tickers/', data={'ticker_symbol': 'msft', 'ticker_name': 'Microsoft'},
+                         follow_redirects=True)
+    assert b'already tracked' in second.data
+
+    cursor = db.cursor()
+    cursor.execute('SELECT symbol, name FROM tickers')
+    assert cursor.fetchall() == [{'symbol': 'MSFT', 'name': 'Microsoft'}]
+
+def test_old_table_gets_the_unique_key(client, db, stock_api, old_table):
+    old_table('tickers', OLD_TICKERS_TABLE)
+    client.post('/tickers/', data={'ticker_symbol': 'MSFT'})
+    second = client.post('/tickers/', data={'ticker_symbol': 'MSFT'}, follow_redirects=True)
+    assert b'already tracked' in second.data
+
+    cursor = db.cursor()
+    assert index_exists(cursor, 'tickers', 'uq_tickers_symbol')
+    cursor.execute("SELECT COUNT(*) AS n FROM tickers WHERE symbol = 'MSFT'")
+    assert cursor.fetchone()['n'] == 1
+
+def test_old_table_with_duplicates_refuses_adds(client, db, stock_api, old_table):
+    old_table('tickers', OLD_TICKERS_TABLE)
+    cursor = db.cursor()
+    cursor.executemany("INSERT INTO tickers (symbol, name, price) VALUES (%s, %s, 1)", [('AAPL', 'Apple')] * 2)
+    db.commit()
+
+    resp = client.post('/tickers/', data={'ticker_symbol': 'MSFT'}, follow_redirects=True)
+    assert b'fix_database_schema.py --migrate' in resp.data
+    cursor.execute("SELECT COUNT(*) AS n FROM tickers WHERE symbol = 'MSFT'")
+    assert cursor.fetchone()['n'] == 0
@@ -0,0 +1,198 @@
+"""Weather locations: one row per (city, state), including tables created by earlier versions"""
+import pytest
+
+import app.blueprints.weather as weather_blueprint
+from app.blueprints.weather import (MILES_PER_DEGREE_LAT, WEATHER_NEARBY_RADIUS_MILES, find_nearby_weather, grid_cell,
+                                    lookup_geocode, refresh_all_weather)
+
+# Decatur is about 6 miles from Atlanta, Macon about 80
+COORDINATES = {'atlanta': (33.749, -84.388), 'decatur': (33.7748, -84.2963), 'macon': (32.8407, -83.6324)}
+
+# The weather table as created before locations were unique
+OLD_WEATHER_TABLE = '''
+    CREATE TABLE weather (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        city VARCHAR(100) NOT NULL,
+        state VARCHAR(50),
+        temperature DECIMAL(5, 2) NOT NULL,
+        feels_like DECIMAL(5, 2),
+        humidity INT,
+        description VARCHAR(100),
+        icon VARCHAR(10),
+        wind_speed DECIMAL(5, 2),
+        temp_min DECIMAL(5, 2),
+        temp_max DECIMAL(5, 2),
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+def observation(city, state='', owm_id=None, lat=33.75, lon=-84.39, temperature=70.0):
+    """A parse_weather()-shaped reading"""
+    return {'city': city, 'state': state.upper(), 'temperature': temperature, 'feels_like': temperature,
+            'humidity': 50, 'description': 'Clear Sky', 'icon': '01d', 'wind_speed': 3.0, 'pressure': 1012,
+            'temp_min': temperature - 2, 'temp_max': temperature + 2, 'owm_id': owm_id, 'lat': lat, 'lon': lon}
+
+@pytest.fixture
+def weather_api(monkeypatch):
+    """Stub OpenWeatherMap; returns the list of (city, state, owm_id) requests made"""
+    calls = []
+
+    def get_weather_data(city, state='', owm_id=None):
+        calls.append((city, state, owm_id))
+        return observation(city.title(), state, owm_id=4180439), None
+    monkeypatch.setattr(weather_blueprint, 'get_weather_data', get_weather_data)
+    return calls
+
+@pytest.fixture
+def group_api(monkeypatch):
+    """Stub the group endpoint; records the id batches requested, and refuses them when 'fail' is set"""
+    state = {'batches': [], 'fail': False}
+
+    def get_weather_group(owm_ids):
+        state['batches'].append(list(owm_ids))
+        if state['fail']:
+            return None, 'Group queries are not available for this API key'
+        return {owm_id: observation(f'City {owm_id}', owm_id=owm_id, temperature=80.0) for owm_id in owm_ids}, None
+    monkeypatch.setattr(weather_blueprint, 'get_weather_group', get_weather_group)
+    return state
+
+def locations(db, columns='city, state'):
+    cursor = db.cursor()
+    cursor.execute(f'SELECT {columns} FROM weather ORDER BY id')
+    return cursor.fetchall()
+
+def add_locations(db, rows):
+    """Insert (city, state, owm_id) rows into the weather table"""
+    cursor = db.cursor()
+    cursor.executemany('INSERT INTO weather (city, state, temperature, owm_id) VALUES (%s, %s, 50, %s)', rows)
+    db.commit()
+
+def test_adding_a_tracked_location_updates_it(client, db, weather_api):
+    first = client.post('/weather/', data={'city': 'atlanta', 'state': 'ga'}, follow_redirects=True)
+    assert b'added successfully' in first.data
+    second = client.post('/weather/', data={'city': 'Atlanta', 'state': 'GA'}, follow_redirects=True)
+    assert b'already tracked' in second.data
+    assert locations(db) == [{'city': 'Atlanta', 'state': 'GA'}]
+
+def test_old_table_with_duplicates_refuses_adds(client, db, weather_api, old_table):
+    old_table('weather', OLD_WEATHER_TABLE)
+    cursor = db.cursor()
+    cursor.executemany("INSERT INTO weather (city, state, temperature) VALUES ('Macon', 'GA', 60)", [(), ()])
+    db.commit()
+
+    resp = client.post('/weather/', data={'city': 'Atlanta', 'state': 'GA'}, follow_redirects=True)
+    assert b'fix_database_schema.py --migrate' in resp.data
+    assert locations(db) == [{'city': 'Macon', 'state': 'GA'}] * 2
+
+def test_old_table_gets_the_cache_columns(client, db, weather_api, old_table):
+    old_table('weather', OLD_WEATHER_TABLE)
+    cursor = db.cursor()
+    cursor.execute("INSERT INTO weather (city, state, temperature) VALUES ('Atlanta', 'GA', 60)")
+    db.commit()
+    weather_id = cursor.lastrowid
+
+    resp = client.get(f'/weather/update/{weather_id}', follow_redirects=True)
+    assert b'updated: 70.0' in resp.data
+    assert locations(db, 'owm_id, temperature') == [{'owm_id': 4180439, 'temperature': 70}]
+
+    second = client.post('/weather/', data={'city': 'Atlanta', 'state': 'GA'}, follow_redirects=True)
+    assert b'already tracked' in second.data
+
+def test_refresh_all_queries_cached_ids_in_groups(app, db, weather_api, group_api, monkeypatch):
+    monkeypatch.setattr(weather_blueprint, 'WEATHER_GROUP_SIZE', 2)
+    assert app.test_client().get('/weather/').status_code == 200  # creates the weather table
+    add_locations(db, [('City 1', 'GA', 1), ('City 2', 'GA', 2), ('City 3', 'GA', 3), ('Macon', 'GA', None)])
+    reported = []
+
+    result = refresh_all_weather(db, {}, lambda done, total: reported.append((done, total)))
+    assert result == {'updated': 4, 'failed': 0}
+    assert group_api['batches'] == [[1, 2], [3]]
+    assert weather_api == [('Macon', 'GA', None)]  # no cached id yet: one request, which caches it
+    assert reported[-1] == (4, 4)
+    assert locations(db, 'city, owm_id, temperature') == [
+        {'city': 'City 1', 'owm_id': 1, 'temperature': 80}, {'city': 'City 2', 'owm_id': 2, 'temperature': 80},
+        {'city': 'City 3', 'owm_id': 3, 'temperature': 80}, {'city': 'Macon', 'owm_id': 4180439, 'temperature': 70},
+    ]
+
+def test_refresh_all_falls_back_to_one_request_per_city(app, db, weather_api, group_api):
+    assert app.test_client().get('/weather/').status_code == 200
+    add_locations(db, [('City 1', 'GA', 1), ('City 2', 'GA', 2)])
+    group_api['fail'] = True
+
+    assert refresh_all_weather(db, {}, lambda done, total: None) == {'updated': 2, 'failed': 0}
+    assert weather_api == [('City 1', 'GA', 1), ('City 2', 'GA', 2)]
+
+def test_refresh_all_on_an_old_table(db, weather_api, group_api, old_table):
+    old_table('weather', OLD_WEATHER_TABLE)
+    cursor = db.cursor()
+    cursor.execute("INSERT INTO weather (city, state, temperature) VALUES ('Atlanta', 'GA', 60)")
+    db.commit()
+
+    assert refresh_all_weather(db, {}, lambda done, total: None) == {'updated': 1, 'failed': 0}
+    assert locations(db, 'owm_id') == [{'owm_id': 4180439}]
+
+@pytest.fixture
+def nearby(monkeypatch):
+    """Empty nearby index and geocode cache, and an API stub that knows COORDINATES; returns the cities requested"""
+    monkeypatch.setattr(weather_blueprint, '_NEARBY_INDEX', {'cells': {}, 'loaded_at': 0.0})
+    monkeypatch.setattr(weather_blueprint, '_GEOCODES', {})
+    calls = []
+
+    def get_weather_data(city, state='', owm_id=None):
+        calls.append(city.lower())
+        lat, lon = COORDINATES[city.lower()]
+        return observation(city.title(), state, lat=lat, lon=lon), None
+    monkeypatch.setattr(weather_blueprint, 'get_weather_data', get_weather_data)
+    return calls
+
+def test_grid_cell_boundaries():
+    size = WEATHER_NEARBY_RADIUS_MILES / MILES_PER_DEGREE_LAT
+    assert grid_cell(0, 0) == (0, 0)
+    assert grid_cell(size * 0.999, size * 0.999) == (0, 0)
+    assert grid_cell(size, size) == (1, 1)
+    assert grid_cell(-size * 0.001, -size * 0.001) == (-1, -1)  # floor, not truncation, below zero
+    assert grid_cell(-size, 3 * size) == (-1, 3)
+
+def test_lookup_answers_from_a_nearby_observation(client, nearby):
+    assert client.get('/weather/lookup?city=Decatur&state=GA').get_json()['nearby'] is False
+    assert client.get('/weather/lookup?city=Atlanta&state=GA&nearby=0').get_json()['nearby'] is False
+    assert nearby == ['decatur', 'atlanta']
+
+    # Decatur's own reading is indexed too, so drop it to be answered from Atlanta's
+    weather_blueprint._NEARBY_INDEX['cells'] = {
+        cell: {key: value for key, value in observations.items() if key[0] != 'decatur'}
+        for cell, observations in weather_blueprint._NEARBY_INDEX['cells'].items()
+    }
+    answer = client.get('/weather/lookup?city=decatur&state=ga').get_json()
+    assert nearby == ['decatur', 'atlanta']  # no API call
+    assert answer['nearby'] is True and answer['city'] == 'Atlanta'
+    assert answer['requested'] == {'city': 'decatur', 'state': 'GA'}
+    assert 5 < answer['distance_miles'] < 7
+
+def test_no_nearby_answer_outside_the_radius(db, nearby):
+    weather_blueprint.remember_weather(observation('Atlanta', 'GA', lat=33.749, lon=-84.388))
+    assert find_nearby_weather(db.cursor(), 'Decatur', 'GA') is None  # location never seen
+    weather_blueprint._GEOCODES[('macon', 'GA')] = COORDINATES['macon']
+    assert find_nearby_weather(db.cursor(), 'Macon', 'GA') is None
+    assert find_nearby_weather(db.cursor(), 'Atlanta', 'GA')['distance_miles'] == 0
+
+def test_geocode_cache_hit_and_miss(client, db, nearby):
+    assert lookup_geocode(db.cursor(), 'Macon', 'GA') is None  # miss: not even a table yet
+
+    client.get('/weather/lookup?city=Macon&state=GA')
+    weather_blueprint._GEOCODES.clear()
+    # Miss in memory, read from weather_geocodes, then cached
+    assert lookup_geocode(db.cursor(), 'macon ', 'ga') == COORDINATES['macon']
+    cursor = db.cursor()
+    cursor.execute('DELETE FROM weather_geocodes')
+    db.commit()
+    assert lookup_geocode(db.cursor(), 'Macon', 'GA') == COORDINATES['macon']
+
+def test_lookup_does_not_pin_the_session_to_the_primary(client, db, nearby):
+    client.get('/weather/lookup?city=Macon&state=GA')
+    cursor = db.cursor()
+    cursor.execute('SELECT city, state FROM weather_geocodes')
+    assert cursor.fetchall() == [{'city': 'macon', 'state': 'GA'}]
+    with client.session_transaction() as session:
+        assert 'db_write_at' not in session
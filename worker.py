@@ -0,0 +1,19 @@
+"""
+Background job worker.
+Runs the jobs queued by routes such as /tickers/update-all and /weather/update-all,
+and the similar-movies refreshes queued when a movie is added, edited or deleted.
+
+    python worker.py
+"""
+import sys
+
+from app import app
+from app.db_connect import connect_db, db_backend
+from app.functions import run_worker
+
+if __name__ == '__main__':
+    if db_backend() == 'memory':
+        sys.exit('DB_BACKEND=memory keeps its data inside the web process, which runs the jobs itself. '
+                 'Use DB_BACKEND=sqlite or mysql to run a separate worker.')
+    with app.app_context():
+        run_worker(connect_db)